@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# Batch version of docType: one NumPy feature matrix for a whole set of documents, classified with vectorised rules instead of a
+# Python loop per document. Also calibrates the heuristics' thresholds against a labelled corpus (e.g. one from corpus_tools.py).
+# Needs numpy, which the rest of the app doesn't.
+import json
+import sys
+from itertools import product
+from os import path
+
+try:
+    import numpy as np
+except ImportError:
+    if __name__ == "__main__":
+        sys.exit("batch_classify.py needs numpy, which the rest of the app doesn't: pip install numpy")
+    raise
+
+import config_service
+from docx_tools import THRESHOLDS, classifierThresholds, headerWindow, lineFeatures
+from paragraph_cache import headerMeta, parseDocument
+from parse_pool import mapShared
+
+TYPES = np.array(["resolution", "position", "notes", "unclassified"])
+COLUMNS = (
+    "paragraphs",
+    "lists",
+    "maxIndent",
+    "roman",
+    "words",
+    "links",
+    "country",
+    "meanLength",
+    "emptyRatio",
+)
+# Candidate values for each threshold, searched exhaustively by calibrate
+GRID = {
+    "listRatio": np.round(np.arange(0.2, 0.81, 0.05), 2),
+    "maxIndent": np.arange(1, 5),
+    "links": np.arange(0, 6),
+    "words": np.arange(300, 1501, 100),
+}
+
+
+def featureMatrix(documents):
+    """Build the feature matrix for a batch of parsed documents
+
+    :param documents: List of (lines, links per line, metadata dict) per document, e.g. from parseFiles
+    :returns: Array of shape (documents, len(COLUMNS)), one column per entry of COLUMNS
+    :rtype: numpy.ndarray
+
+    """
+    count = len(documents)
+    lines = [line for doc in documents for line in doc[0]]
+    owner = np.repeat(np.arange(count), [len(doc[0]) for doc in documents])
+    # Per-line arrays: indent, list-marker mask, roman-marker mask, words, length
+    perLine = np.array([lineFeatures(i) for i in lines], dtype=np.int64).reshape(-1, 4)
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    paragraphs = np.bincount(owner, minlength=count)
+    maxIndent = np.full(count, -1, dtype=np.int64)
+    np.maximum.at(maxIndent, owner, perLine[:, 1])
+    safe = np.maximum(paragraphs, 1)
+    matrix = np.column_stack(
+        [
+            paragraphs,
+            np.bincount(owner, perLine[:, 0], minlength=count),
+            maxIndent,
+            np.bincount(owner, perLine[:, 2], minlength=count),
+            np.bincount(owner, perLine[:, 3], minlength=count),
+            [sum(doc[1]) for doc in documents],
+            ["country" in doc[2] for doc in documents],
+            np.bincount(owner, lengths, minlength=count) / safe,
+            np.bincount(owner, lengths == 0, minlength=count) / safe,
+        ]
+    ).astype(np.float64)
+    return matrix
+
+
+def column(matrix, name):
+    return matrix[:, COLUMNS.index(name)]
+
+
+def classifyMatrix(matrix, thresholds=None):
+    """docType's rules, applied to every row at once. The first rule that matches wins, as in typeFromFeatures
+
+    :param matrix: As returned by featureMatrix
+    :param thresholds: Dict of threshold values (as in docx_tools.THRESHOLDS), values may be arrays to broadcast over
+    :returns: Index into TYPES for each document
+    :rtype: numpy.ndarray
+
+    """
+    thresholds = thresholds or classifierThresholds()
+    resolution = (column(matrix, "maxIndent") >= thresholds["maxIndent"]) | (
+        column(matrix, "lists") >= np.floor(thresholds["listRatio"] * column(matrix, "paragraphs"))
+    )
+    resolution |= column(matrix, "roman") > 0
+    position = column(matrix, "country") > 0
+    notes = (column(matrix, "links") > thresholds["links"]) | (column(matrix, "words") >= thresholds["words"])
+    return np.select([resolution, position, notes], [0, 1, 2], default=3)
+
+
+def parseFiles(paths):
+    # Through paragraph_cache's renderer rather than docx2python: same lines, far quicker
+    # Metadata from the same header window paragraph_cache.classify uses, so calibration sees what classification in the app does
+    documents = []
+    window = headerWindow()
+    for docPath in paths:
+        record, lines, _ = parseDocument(docPath)
+        documents.append((lines, record["links"], headerMeta(record, window)))
+    return documents
+
+
+def documentRow(docFile):
+    # A single document's row of the feature matrix: all a parse_pool worker needs to send back
+    return featureMatrix(parseFiles([docFile]))[0].tolist()
+
+
+def classifyFiles(paths, thresholds=None, processes=0):
+    """Classify a batch of word documents
+
+    :param paths: Paths of the documents
+    :param thresholds: Overrides for the heuristics' thresholds
+    :param processes: Worker processes to parse them in (see parse_pool.py), 0 to parse them in this one
+    :returns: {path: type}
+    :rtype: Dict
+
+    """
+    if processes:
+        rows = mapShared(documentRow, paths, processes)
+        for row in rows.values():
+            if isinstance(row, Exception):
+                raise row
+        matrix = np.array([rows[i] for i in paths], dtype=np.float64).reshape(-1, len(COLUMNS))
+    else:
+        matrix = featureMatrix(parseFiles(paths))
+    types = TYPES[classifyMatrix(matrix, thresholds)]
+    return dict(zip(paths, types.tolist()))
+
+
+def calibrate(matrix, labels, grid=GRID):
+    """Find the thresholds which classify a labelled corpus most accurately, by trying every combination in the grid.
+    Every combination is scored in one vectorised pass per listRatio; ties go to the combination closest to the defaults
+
+    :param matrix: As returned by featureMatrix
+    :param labels: The right type for each row, as strings
+    :param grid: Dict of candidate values for each threshold
+    :returns: (best thresholds, their accuracy, the defaults' accuracy)
+    :rtype: Tuple
+
+    """
+    truth = np.array([TYPES.tolist().index(i) for i in labels])
+    names = ("maxIndent", "links", "words")
+    combos = np.array(list(product(*(grid[i] for i in names))), dtype=np.float64)
+    best = None
+    for ratio in grid["listRatio"]:
+        # Broadcast: rows are documents, columns are threshold combinations
+        thresholds = {"listRatio": ratio, **{name: combos[:, n][None, :] for n, name in enumerate(names)}}
+        scores = batchAccuracy(matrix, truth, thresholds)
+        for n in np.flatnonzero(scores == scores.max()):
+            candidate = {"listRatio": float(ratio), **{name: int(combos[n, i]) for i, name in enumerate(names)}}
+            distance = sum(abs(candidate[k] - THRESHOLDS[k]) / max(abs(THRESHOLDS[k]), 1) for k in candidate)
+            key = (-scores[n], distance)
+            if best is None or key < best[0]:
+                best = (key, candidate, scores[n])
+    defaults = batchAccuracy(matrix, truth, THRESHOLDS)[0]
+    return best[1], float(best[2]), float(defaults)
+
+
+def batchAccuracy(matrix, truth, thresholds):
+    # classifyMatrix with every threshold combination at once: each column vector broadcasts against the (documents, 1) features
+    expanded = matrix[:, :, None]
+    predictions = classifyMatrix(expanded, thresholds)
+    return (predictions == truth[:, None]).mean(axis=0)
+
+
+def loadCorpus(folder):
+    """Read a labelled corpus, as written by corpus_tools.makeCorpus
+
+    :param folder: Folder containing the documents and labels.json ({filename: type})
+    :returns: (paths, labels)
+    :rtype: Tuple of lists
+
+    """
+    with open(path.join(folder, "labels.json")) as f:
+        labels = json.load(f)
+    names = sorted(labels)
+    return [path.join(folder, i) for i in names], [labels[i] for i in names]
+
+
+def saveThresholds(thresholds, configFile="config.json"):
+    # Atomically, like every other write to config.json, so the daemon and web UI never read half of it
+    config_service.service(configFile).update(thresholds=thresholds)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batch classification and threshold calibration")
+    commands = parser.add_subparsers(dest="command", required=True)
+    classifyCommand = commands.add_parser("classify", help="Classify word documents")
+    classifyCommand.add_argument("files", nargs="+")
+    classifyCommand.add_argument("--processes", type=int, default=0, help="Parse in this many worker processes")
+    calibrateCommand = commands.add_parser("calibrate", help="Tune the heuristics' thresholds against a labelled corpus")
+    calibrateCommand.add_argument("folder", help="Corpus folder with a labels.json, e.g. from corpus_tools.py")
+    calibrateCommand.add_argument("--save", action="store_true", help="Write the thresholds to config.json")
+    args = parser.parse_args()
+
+    if args.command == "classify":
+        for docPath, docType in classifyFiles(args.files, processes=args.processes).items():
+            print(f"{docType:14} {docPath}")
+    else:
+        paths, labels = loadCorpus(args.folder)
+        thresholds, accuracy, baseline = calibrate(featureMatrix(parseFiles(paths)), labels)
+        print(f"defaults {THRESHOLDS}: {baseline:.1%}")
+        print(f"best     {thresholds}: {accuracy:.1%}")
+        if args.save:
+            saveThresholds(thresholds)
+            print("Saved to config.json", file=sys.stderr)
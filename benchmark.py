@@ -0,0 +1,405 @@
+#! /usr/bin/env python
+# Benchmarks for the parsing/classification pipeline, run against a synthetic corpus (see corpus_tools.py).
+# Results are appended to .benchmarks/history.json, keyed by commit, so a slow change shows up as a regression against the previous run.
+import io
+import json
+import multiprocessing.reduction
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+os.environ.setdefault("PYMUN_OFFLINE", "1")
+
+from corpus_tools import makeCorpus
+from docx_tools import (
+    Clause,
+    asArr,
+    docType,
+    extractMetadata,
+    getBody,
+    replaceLinksXml,
+)
+import near_duplicates
+import paragraph_cache
+import parse_pool
+import search_index
+from gdrive_tools import updateMetadata
+
+HISTORY = path.join(path.dirname(path.abspath(__file__)), ".benchmarks", "history.json")
+SIZES = {"small": 0.5, "medium": 1.0, "large": 5.0}
+MIMES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+}
+
+
+class FakeDriveFile(dict):
+    """Just enough of pydrive2's DriveFile for updateMetadata: content comes from a local file and uploads are counted rather than sent"""
+
+    def __init__(self, source, fileId):
+        super().__init__(
+            id=fileId,
+            title=path.basename(source),
+            mimeType=MIMES["docx"],
+            description="",
+            parents=[],
+        )
+        self.source = source
+        self.content = None
+        self.uploads = 0
+
+    def GetContentFile(self, filename, mimetype=None):
+        os.makedirs(path.dirname(filename), exist_ok=True)
+        shutil.copy(self.source, filename)
+
+    def SetContentFile(self, filename):
+        self.content = filename
+
+    def Upload(self, param=None):
+        self.uploads += 1
+
+
+class ArticleHandler(BaseHTTPRequestHandler):
+    # Answers every request (we're used as an HTTP proxy) with a small news-style page, so link fetching is exercised without the network
+    def do_GET(self):
+        slug = self.path.rstrip("/").split("/")[-1]
+        body = (
+            f"<html><head><title>{slug.replace('-', ' ').title()}</title>"
+            f'<meta property="og:site_name" content="{self.headers.get("Host", "")}">'
+            f'<meta property="og:type" content="article"></head><body>'
+            + "<p>Lorem ipsum dolor sit amet.</p>" * 200
+            + "</body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def startLinkServer():
+    """Start a local HTTP proxy that serves fake articles, and route requests' http traffic through it
+
+    :returns: The running server, so it can be shut down afterwards
+    :rtype: ThreadingHTTPServer
+
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArticleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["HTTP_PROXY"] = os.environ["http_proxy"] = f"http://127.0.0.1:{server.server_port}"
+    # Local servers (e.g. the fake drive) are still talked to directly
+    os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+    return server
+
+
+def timeIt(func, docs, repeat):
+    """Time func over every doc, several times over
+
+    :param func: Function taking a single document
+    :param docs: List of documents (paths, usually) to run func on
+    :param repeat: Number of passes over the docs
+    :returns: Per-document timings in seconds (min and median across passes), or the error raised
+    :rtype: Dict
+
+    """
+    passes = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for doc in docs:
+                func(doc)
+            passes.append((time.perf_counter() - start) / len(docs))
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    return {"min": min(passes), "median": statistics.median(passes), "docs": len(docs)}
+
+
+def documentXml(docPath, folder):
+    # Pull document.xml out once, so the link benchmark measures only the rewrite
+    target = path.join(folder, path.basename(docPath) + ".xml")
+    with zipfile.ZipFile(docPath) as z, open(target, "wb") as out:
+        out.write(z.read("word/document.xml"))
+    return target
+
+
+def endToEnd(docPath):
+    # A fresh ID each time, so every pass is a first sighting rather than an unchanged revision
+    fileId = f"bench-{uuid.uuid4().hex}"
+    try:
+        return updateMetadata(FakeDriveFile(docPath, fileId))
+    finally:
+        if path.exists(paragraph_cache.fingerprintPath(fileId)):
+            os.remove(paragraph_cache.fingerprintPath(fileId))
+        search_index.removeDocument(fileId)
+        near_duplicates.removeDocument(fileId)
+
+
+def runBenchmarks(sizes=SIZES, count=9, repeat=3, linkDensity=0.1):
+    """Generate a corpus for every size and time each pipeline stage against it
+
+    :param sizes: Dict of {name: size multiplier} passed to makeCorpus
+    :param count: Documents per size (split evenly between resolutions, position papers and notes)
+    :param repeat: Passes per benchmark
+    :param linkDensity: Link density of the generated documents
+    :returns: Dict of {"<stage>/<size>": timing dict}
+    :rtype: Dict
+
+    """
+    results = {}
+    server = startLinkServer()
+    workdir = tempfile.mkdtemp(prefix="pymun-bench-")
+    try:
+        for name, size in sizes.items():
+            folder = path.join(workdir, name)
+            labels = makeCorpus(folder, count, size=size, linkDensity=linkDensity)
+            docs = sorted(labels)
+            resolutions = [i for i in docs if labels[i] == "resolution"]
+            xmls = [documentXml(i, folder) for i in docs]
+            # Parsed once up front, so clause-format measures only the clause parser and formatter
+            resolutionArrs = [asArr(i) for i in resolutions]
+            fingerprints = {i: paragraph_cache.parseDocument(i)[0] for i in docs}
+            stages = {
+                "parse": (lambda p: getBody(asArr(p)), docs),
+                "classify": (docType, docs),
+                "metadata": (lambda p: extractMetadata(getBody(asArr(p))), docs),
+                "link-rewrite": (replaceLinksXml, xmls),
+                "clause-tree": (lambda p: Clause.fromFormattedDocArr(asArr(p)), resolutions),
+                "clause-format": (lambda a: Clause.fromFormattedDocArr(a).format(), resolutionArrs),
+                "reparse-unchanged": (lambda p: paragraph_cache.parseDocument(p, fingerprints[p]), docs),
+                "end-to-end": (endToEnd, docs),
+            }
+            for stage, (func, inputs) in stages.items():
+                results[f"{stage}/{name}"] = timeIt(func, inputs, repeat)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def padDocument(docPath, megabytes, seed=0):
+    # An image-heavy document: the same text, plus an incompressible "image" stored as is, as photos in a .docx usually are
+    with zipfile.ZipFile(docPath, "a") as z:
+        z.writestr("word/media/image1.jpeg", random.Random(seed).randbytes(int(megabytes * (1 << 20))), zipfile.ZIP_STORED)
+
+
+def naiveParse(data):
+    # The naive handoff: the document's bytes are pickled into the worker, and its whole parse is pickled back
+    return paragraph_cache.parseDocument(io.BytesIO(data))[:2]
+
+
+def naiveOpen(data):
+    return len(zipfile.ZipFile(io.BytesIO(data)).namelist())
+
+
+def sharedOpen(docFile):
+    return len(zipfile.ZipFile(docFile).namelist())
+
+
+@contextmanager
+def countPickled():
+    # Count the bytes this process pickles into, and unpickles out of, multiprocessing's pipes while the block runs: the calls
+    # submitted to a ProcessPoolExecutor going out, and their results coming back. Yields a list whose one item is the running total
+    pickler = multiprocessing.reduction.ForkingPickler
+    dumps, loads = pickler.__dict__["dumps"], pickler.__dict__["loads"]
+    total = [0]
+    lock = threading.Lock()
+
+    def counted(nbytes):
+        with lock:
+            total[0] += nbytes
+
+    def countedDumps(cls, obj, protocol=None):
+        buf = dumps.__func__(cls, obj, protocol)
+        counted(buf.nbytes)
+        return buf
+
+    def countedLoads(data, *args, **kwargs):
+        counted(memoryview(data).nbytes)
+        return loads(data, *args, **kwargs)
+
+    pickler.dumps, pickler.loads = classmethod(countedDumps), staticmethod(countedLoads)
+    try:
+        yield total
+    finally:
+        pickler.dumps, pickler.loads = dumps, loads
+
+
+def timeHandoff(handoff, docs, repeat):
+    # Like timeIt, but for functions that take the whole batch (so the pool's startup is shared out over it), noting what was pickled
+    passes = []
+    for _ in range(repeat):
+        with countPickled() as pickled:
+            start = time.perf_counter()
+            handoff(docs)
+            passes.append((time.perf_counter() - start) / len(docs))
+    return {"min": min(passes), "median": statistics.median(passes), "docs": len(docs), "pickled": pickled[0] / len(docs)}
+
+
+def runHandoffBenchmarks(count=8, megabytes=10, processes=2, repeat=3):
+    """Compare handing documents to parser processes as pickled bytes against handing them over in shared memory (parse_pool.py)
+
+    :param count: Documents in the batch
+    :param megabytes: Size each document is padded out to with an embedded image
+    :param processes: Worker processes
+    :param repeat: Passes per benchmark
+    :returns: Dict of {"<benchmark>/<size>": timing dict}, each with the bytes pickled per document
+    :rtype: Dict
+
+    """
+
+    def naive(func):
+        def handoff(docs):
+            with ProcessPoolExecutor(processes) as executor:
+                datas = []
+                for doc in docs:
+                    with open(doc, "rb") as f:
+                        datas.append(f.read())
+                return list(executor.map(func, datas))
+
+        return handoff
+
+    def shared(func):
+        def handoff(docs):
+            return parse_pool.mapShared(func, docs, processes)
+
+        return handoff
+
+    workdir = tempfile.mkdtemp(prefix="pymun-bench-")
+    name = f"{megabytes:g}mb"
+    try:
+        labels = makeCorpus(workdir, count, size=SIZES["large"])
+        docs = sorted(labels)
+        for n, doc in enumerate(docs):
+            padDocument(doc, megabytes, n)
+        benchmarks = {
+            "handoff-naive": naive(naiveOpen),
+            "handoff-shared": shared(sharedOpen),
+            "parse-pool-naive": naive(naiveParse),
+            "parse-pool-shared": shared(parse_pool.classifyRecord),
+        }
+        return {f"{k}/{name}": timeHandoff(v, docs, repeat) for k, v in benchmarks.items()}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def currentCommit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def loadHistory(historyFile=HISTORY):
+    try:
+        with open(historyFile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def saveRun(results, historyFile=HISTORY):
+    """Append a benchmark run to the history file
+
+    :param results: As returned by runBenchmarks
+    :param historyFile: Path of the JSON history
+    :returns: The run that was stored
+    :rtype: Dict
+
+    """
+    run = {
+        "commit": currentCommit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    history = loadHistory(historyFile)
+    history.append(run)
+    os.makedirs(path.dirname(historyFile), exist_ok=True)
+    with open(historyFile, "w") as f:
+        json.dump(history, f, indent=1)
+    return run
+
+
+def compare(previous, current, tolerance=0.15):
+    """Compare two runs' medians, stage by stage
+
+    :param previous: Earlier results dict
+    :param current: Newer results dict
+    :param tolerance: Fractional slowdown tolerated before it counts as a regression
+    :returns: A list of (benchmark, old median, new median, relative change, is regression)
+    :rtype: List of tuples
+
+    """
+    rows = []
+    for name, new in current.items():
+        old = previous.get(name, {})
+        if "median" not in new or "median" not in old:
+            continue
+        change = new["median"] / old["median"] - 1
+        rows.append((name, old["median"], new["median"], change, change > tolerance))
+    return rows
+
+
+def report(results, previousRun=None, tolerance=0.15):
+    print(f"{'benchmark':28} {'median (ms)':>12} {'min (ms)':>10}")
+    for name, timing in results.items():
+        if "error" in timing:
+            print(f"{name:28} {'ERROR':>12}  {timing['error']}")
+        else:
+            pickled = f"  {timing['pickled'] / 1024:.1f} KiB pickled/doc" if "pickled" in timing else ""
+            print(f"{name:28} {timing['median'] * 1000:12.2f} {timing['min'] * 1000:10.2f}{pickled}")
+    if previousRun:
+        print(f"\nCompared to {previousRun['commit']} ({previousRun['date']}):")
+        regressions = 0
+        for name, old, new, change, regressed in compare(previousRun["results"], results, tolerance):
+            regressions += regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:28} {old * 1000:10.2f} -> {new * 1000:10.2f} ms ({change:+.0%}){flag}")
+        return regressions
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the PyMUN pipeline on a synthetic corpus")
+    parser.add_argument("--quick", action="store_true", help="Small corpus, single pass")
+    parser.add_argument("--count", type=int, default=9, help="Documents per size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--link-density", type=float, default=0.1)
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--no-save", action="store_true", help="Don't record this run in the history")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument(
+        "--handoff", action="store_true", help="Also compare pickled and shared-memory handoff to parser processes, for 10 MB documents"
+    )
+    parser.add_argument("--processes", type=int, default=2, help="Worker processes for --handoff")
+    args = parser.parse_args()
+
+    sizes = {"small": SIZES["small"]} if args.quick else SIZES
+    results = runBenchmarks(
+        sizes, 3 if args.quick else args.count, 1 if args.quick else args.repeat, args.link_density
+    )
+    if args.handoff:
+        results.update(runHandoffBenchmarks(processes=args.processes, repeat=1 if args.quick else args.repeat))
+    history = loadHistory()
+    regressions = report(results, history[-1] if history else None, args.tolerance)
+    if not args.no_save:
+        saveRun(results)
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+# Classification engines: the heuristic chain (docx_tools.typeFromFeatures) or a small naive Bayes model over hashed features.
+# Which one is used is the "classifier" option in config.json; without a trained model, the heuristics are used regardless.
+import json
+import math
+import re
+import sys
+import zlib
+from array import array
+from collections import Counter
+from os import makedirs, path, replace
+
+import config_service
+import metrics
+from docx_tools import MARKER, markerKind, typeFromFeatures
+
+appname = "pyMUN"
+MODEL_FILE = f"{path.expanduser('~')}/tmp/{appname}/classifier.model"
+MAGIC = b"PMNB"
+VERSION = 1
+BITS = 18  # 2**18 hashed features
+WORD = re.compile(r"[a-z]+")
+KEYS = ("country", "committee", "topic", "sponsor")
+
+models = {}  # model file -> (mtime, HashedModel), so the model is only read again when it's retrained
+
+
+def bucket(n):
+    # Coarse size buckets, so "long line" and "short line" are features rather than every exact length
+    return n.bit_length()
+
+
+def lineTokens(line):
+    """The features of a single line: its words, plus what its structure looks like
+
+    :param line: A line of the document, as rendered by docx2python
+    :returns: Generator of feature strings
+    :rtype: Generator
+
+    """
+    text = line.strip()
+    if not text:
+        yield "empty"
+        return
+    indent = len(line) - len(line.lstrip("\t"))
+    yield f"indent:{min(indent, 4)}"
+    yield f"length:{bucket(len(text))}"
+    marker = MARKER.match(text)
+    if marker:
+        yield "marker:" + (markerKind(marker.group(1), []) if marker.group(1) else "bullet")
+        yield f"marker-indent:{min(indent, 4)}"
+    lowered = text.lower()
+    if "http" in lowered or "www." in lowered:
+        yield "link"
+    if ":" in lowered[:40]:
+        for key in KEYS:
+            if key in lowered[:40]:
+                yield f"key:{key}"
+    for word in WORD.findall(lowered):
+        yield "w:" + word
+
+
+def vectorise(lines, bits=BITS):
+    """Hash every feature of a document into a sparse vector, in one pass over its lines.
+    Counts are log-scaled and the vector normalised to unit length, otherwise long documents drown out everything else
+
+    :param lines: Every line of the document
+    :param bits: Size of the hashed feature space, as a power of two
+    :returns: {feature index: weight}
+    :rtype: Dict
+
+    """
+    mask = (1 << bits) - 1
+    counts = Counter()
+    for line in lines:
+        for token in lineTokens(line):
+            counts[zlib.crc32(token.encode()) & mask] += 1
+    counts[zlib.crc32(f"paragraphs:{bucket(len(lines))}".encode()) & mask] += 1
+    scaled = {feature: math.log1p(count) for feature, count in counts.items()}
+    norm = math.sqrt(sum(i * i for i in scaled.values()))
+    return {feature: value / norm for feature, value in scaled.items()}
+
+
+class HashedModel:
+    """Multinomial naive Bayes over hashed features. The weights are one flat float array, feature-major
+    (weights[feature * classes + class]), so scoring a document is one dot product per class over its non-zero features"""
+
+    def __init__(self, classes, bits=BITS):
+        self.classes = list(classes)
+        self.bits = bits
+        self.bias = array("f", [0.0] * len(self.classes))
+        self.weights = array("f", bytes(4 * len(self.classes) << bits))
+
+    def scores(self, vector):
+        n = len(self.classes)
+        scores = list(self.bias)
+        weights = self.weights
+        for feature, value in vector.items():
+            offset = feature * n
+            for c in range(n):
+                scores[c] += value * weights[offset + c]
+        return scores
+
+    def predict(self, lines):
+        scores = self.scores(vectorise(lines, self.bits))
+        return self.classes[scores.index(max(scores))]
+
+    @classmethod
+    def train(cls, documents, labels, bits=BITS, alpha=1.0):
+        """Fit the model
+
+        :param documents: List of documents, each a list of lines
+        :param labels: The type of each document
+        :param bits: Size of the hashed feature space, as a power of two
+        :param alpha: Additive smoothing
+        :returns: The trained model
+        :rtype: HashedModel
+
+        """
+        model = cls(sorted(set(labels)), bits)
+        n = len(model.classes)
+        totals = [0.0] * n
+        counts = [Counter() for _ in range(n)]
+        for lines, label in zip(documents, labels):
+            c = model.classes.index(label)
+            vector = vectorise(lines, bits)
+            counts[c].update(vector)
+            totals[c] += sum(vector.values())
+        size = 1 << bits
+        for c in range(n):
+            model.bias[c] = math.log(labels.count(model.classes[c]) / len(labels))
+            denominator = math.log(totals[c] + alpha * size)
+            unseen = math.log(alpha) - denominator
+            # Every feature starts at the smoothed "never seen" weight, then the seen ones are filled in
+            model.weights[c::n] = array("f", [unseen]) * size
+            for feature, value in counts[c].items():
+                model.weights[feature * n + c] = math.log(value + alpha) - denominator
+        return model
+
+    def dumps(self):
+        names = "\n".join(self.classes).encode()
+        header = MAGIC + bytes([VERSION, self.bits]) + len(names).to_bytes(4, "little") + names
+        bias, weights = array("f", self.bias), array("f", self.weights)
+        if sys.byteorder == "big":
+            bias.byteswap()
+            weights.byteswap()
+        return header + bias.tobytes() + weights.tobytes()
+
+    @classmethod
+    def loads(cls, data):
+        if data[:4] != MAGIC or data[4] != VERSION:
+            raise ValueError("Not a classifier model")
+        bits = data[5]
+        length = int.from_bytes(data[6:10], "little")
+        model = cls(data[10 : 10 + length].decode().split("\n"), bits)
+        offset = 10 + length
+        model.bias = array("f")
+        model.bias.frombytes(data[offset : offset + 4 * len(model.classes)])
+        model.weights = array("f")
+        model.weights.frombytes(data[offset + 4 * len(model.classes) :])
+        if sys.byteorder == "big":
+            model.bias.byteswap()
+            model.weights.byteswap()
+        return model
+
+    def save(self, filename=MODEL_FILE):
+        makedirs(path.dirname(filename), exist_ok=True)
+        with open(filename + ".tmp", "wb") as f:
+            f.write(self.dumps())
+        replace(filename + ".tmp", filename)
+
+
+def loadModel(filename=MODEL_FILE):
+    """The trained model, or None if there isn't one. Cached until the file changes
+
+    :param filename: Path of the saved model
+    :returns: The model
+    :rtype: HashedModel or NoneType
+
+    """
+    try:
+        mtime = path.getmtime(filename)
+    except OSError:
+        return None
+    cached = models.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(filename, "rb") as f:
+            cached = models[filename] = (mtime, HashedModel.loads(f.read()))
+    return cached[1]
+
+
+def configuredEngine(configFile="config.json"):
+    return config_service.current(configFile).get("classifier", "heuristic")
+
+
+def classify(lines, features, meta, engine=None):
+    """Classify a document with the configured engine, falling back to the heuristics if there's no trained model
+
+    :param lines: Every line of the document
+    :param features: As returned by docx_tools.documentFeatures (used by the heuristics)
+    :param meta: Metadata found in the document (used by the heuristics)
+    :param engine: "heuristic" or "model", defaults to the "classifier" option in config.json
+    :returns: The document's type
+    :rtype: String
+
+    """
+    engine = engine or configuredEngine()
+    model = loadModel() if engine == "model" else None
+    if model is None:
+        engine = "heuristic"
+        documentType = typeFromFeatures(features, meta)
+    else:
+        documentType = model.predict(lines)
+    metrics.inc("pymun_classifications_total", engine=engine, type=documentType)
+    return documentType
+
+
+def driveExamples(drive=None):
+    """Download the word documents in the configured drive folders that already have a type, as training data
+
+    :param drive: GoogleDrive object, defaults to the authorised one
+    :returns: (list of documents as lists of lines, their types)
+    :rtype: Tuple
+
+    """
+    # Imported here: gdrive_tools needs this module (through paragraph_cache) to import
+    from send2trash import send2trash
+
+    import gdrive_tools
+    from paragraph_cache import parseDocument
+
+    drive = drive or gdrive_tools.mydrive
+    with open("config.json") as conf:
+        config = json.load(conf)
+    documents, labels = [], []
+    for configured in gdrive_tools.configuredFolders(config):
+        folderDrive = gdrive_tools.accountDrive(configured.get("account"), drive)
+        folder = gdrive_tools.getMainFolder(configured["path"], folderDrive)
+        for fileObj in gdrive_tools.listFiles(folder, folderDrive, processed=True):
+            label = gdrive_tools.getMetadata(fileObj).get("type")
+            if not label or gdrive_tools.mimeToName(gdrive_tools.getMimeType(fileObj)) not in ("gdoc", "word"):
+                continue
+            localMeta = gdrive_tools.downloadHelper(fileObj)
+            documents.append(parseDocument(localMeta["path"])[1])
+            labels.append(label)
+            send2trash(localMeta["path"])
+    return documents, labels
+
+
+def corpusExamples(folder):
+    # A labelled corpus, as written by corpus_tools.makeCorpus
+    from paragraph_cache import parseDocument
+
+    with open(path.join(folder, "labels.json")) as f:
+        labels = json.load(f)
+    names = sorted(labels)
+    return [parseDocument(path.join(folder, i))[1] for i in names], [labels[i] for i in names]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from paragraph_cache import parseDocument
+
+    parser = argparse.ArgumentParser(description="Train or try out the hashed-feature classifier")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trainCommand = commands.add_parser("train", help="Train on the already-classified files in the drive folder")
+    trainCommand.add_argument("--corpus", help="Train on a labelled corpus folder (labels.json) instead")
+    trainCommand.add_argument("--model", default=MODEL_FILE)
+    evaluateCommand = commands.add_parser("evaluate", help="Accuracy of the model and the heuristics on a labelled corpus")
+    evaluateCommand.add_argument("corpus")
+    evaluateCommand.add_argument("--model", default=MODEL_FILE)
+    classifyCommand = commands.add_parser("classify", help="Classify word documents with the model")
+    classifyCommand.add_argument("files", nargs="+")
+    classifyCommand.add_argument("--model", default=MODEL_FILE)
+    args = parser.parse_args()
+    if args.command != "train" and loadModel(args.model) is None:
+        raise SystemExit(f"No model at {args.model}, train one first")
+
+    if args.command == "train":
+        documents, labels = corpusExamples(args.corpus) if args.corpus else driveExamples()
+        HashedModel.train(documents, labels).save(args.model)
+        print(f"Trained on {len(labels)} documents ({dict(Counter(labels))}), saved to {args.model}")
+    elif args.command == "evaluate":
+        from docx_tools import documentFeatures, extractMetadata
+
+        model = loadModel(args.model)
+        documents, labels = corpusExamples(args.corpus)
+        modelRight = sum(model.predict(d) == l for d, l in zip(documents, labels))
+        heuristicRight = sum(typeFromFeatures(documentFeatures(d), extractMetadata(d)) == l for d, l in zip(documents, labels))
+        print(f"model {modelRight / len(labels):.1%}, heuristics {heuristicRight / len(labels):.1%}")
+    else:
+        model = loadModel(args.model)
+        for docPath in args.files:
+            print(f"{model.predict(parseDocument(docPath)[1]):14} {docPath}")
@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+# Compact storage for resolution clause trees: one set of parallel arrays per tree instead of an object (and a children list) per clause.
+# docx_tools.Tree/Clause are thin views onto a node of one of these.
+import sys
+from array import array
+
+NONE = -1
+MAGIC = b"PMCT"
+VERSION = 2
+FIELDS = ("parent", "depth", "firstChild", "lastChild", "nextSibling", "start", "end", "kind", "para")
+
+# Node kinds
+OPERATIVE = 0
+PREAMBLE = 1
+
+
+class CompactTree:
+    """A tree stored as parallel int arrays, indexed by node number. Node 0 is the root.
+
+    parent/firstChild/lastChild/nextSibling link the nodes (NONE where there isn't one), depth is stored so looking it up is O(1),
+    start/end are offsets of each node's text into a single text buffer, kind says whether a clause is operative or preambulatory,
+    and para is the index of the (last) document paragraph the node's text came from, NONE if it wasn't parsed from a document.
+    """
+
+    def __init__(self):
+        for field in FIELDS:
+            setattr(self, field, array("i"))
+        self.chunks = []  # Text appended since the buffer was last joined
+        self.pending = {}  # Start offset -> chunk, so recently added text can be read without re-joining the buffer
+        self.buffer = ""
+        self.length = 0
+
+    def __len__(self):
+        return len(self.parent)
+
+    def appendText(self, text):
+        start = self.length
+        self.chunks.append(text)
+        self.pending[start] = text
+        self.length += len(text)
+        return start, self.length
+
+    def joined(self):
+        if self.chunks:
+            self.buffer = "".join([self.buffer] + self.chunks)
+            self.chunks = []
+            self.pending = {}
+        return self.buffer
+
+    def text(self, node):
+        """
+        :param node: Node number
+        :returns: The text of that node
+        :rtype: String
+
+        """
+        if self.start[node] == self.end[node]:
+            return ""
+        if self.end[node] <= len(self.buffer):
+            return self.buffer[self.start[node] : self.end[node]]
+        # Every node's text is appended as one chunk, so anything not yet joined is a whole chunk
+        return self.pending[self.start[node]]
+
+    def setText(self, node, text):
+        # The old text is left in the buffer; it's garbage until the tree is next serialised/compacted
+        self.start[node], self.end[node] = self.appendText(text)
+
+    def addNode(self, text, parent=NONE, kind=OPERATIVE, para=NONE):
+        """Add a node as the last child of parent (or as the root, if parent is NONE)
+
+        :param text: The node's text
+        :param parent: Node number of the parent
+        :param kind: OPERATIVE or PREAMBLE
+        :param para: Index of the source paragraph in the document, if any
+        :returns: The new node's number
+        :rtype: Integer
+
+        """
+        node = len(self.parent)
+        start, end = self.appendText(text)
+        self.parent.append(parent)
+        self.depth.append(self.depth[parent] + 1 if parent != NONE else 0)
+        self.firstChild.append(NONE)
+        self.lastChild.append(NONE)
+        self.nextSibling.append(NONE)
+        self.start.append(start)
+        self.end.append(end)
+        self.kind.append(kind)
+        self.para.append(para)
+        if parent != NONE:
+            if self.lastChild[parent] == NONE:
+                self.firstChild[parent] = node
+            else:
+                self.nextSibling[self.lastChild[parent]] = node
+            self.lastChild[parent] = node
+        return node
+
+    def children(self, node):
+        child = self.firstChild[node]
+        while child != NONE:
+            yield child
+            child = self.nextSibling[child]
+
+    def unlink(self, node):
+        """Detach a node (and so its subtree) from its parent. Its slots stay in the arrays until compact() is called"""
+        parent = self.parent[node]
+        if parent == NONE:
+            return
+        previous = NONE
+        for child in self.children(parent):
+            if child == node:
+                break
+            previous = child
+        else:
+            return
+        following = self.nextSibling[node]
+        if previous == NONE:
+            self.firstChild[parent] = following
+        else:
+            self.nextSibling[previous] = following
+        if self.lastChild[parent] == node:
+            self.lastChild[parent] = previous
+        self.parent[node] = NONE
+        self.nextSibling[node] = NONE
+
+    def preorder(self, root=0):
+        """Iterative pre-order traversal of a subtree, following the sibling links (no recursion, no stack)
+
+        :param root: Node number to start from
+        :returns: Generator of node numbers
+        :rtype: Generator
+
+        """
+        if not len(self):
+            return
+        node = root
+        while True:
+            yield node
+            if self.firstChild[node] != NONE:
+                node = self.firstChild[node]
+                continue
+            while node != root and self.nextSibling[node] == NONE:
+                node = self.parent[node]
+            if node == root:
+                return
+            node = self.nextSibling[node]
+
+    def maxDepth(self, root=0):
+        # Depth of the deepest descendant, relative to root (so a leaf is 0)
+        return max(self.depth[i] for i in self.preorder(root)) - self.depth[root]
+
+    def compact(self, root=0):
+        """Return a copy of the subtree at root, with detached nodes and stale text dropped and nodes renumbered in pre-order"""
+        tree = CompactTree()
+        mapping = {}
+        for node in self.preorder(root):
+            parent = mapping.get(self.parent[node], NONE) if node != root else NONE
+            mapping[node] = tree.addNode(self.text(node), parent, self.kind[node], self.para[node])
+        return tree
+
+    def dumps(self):
+        """Serialise to bytes: a small header, then each array, then the UTF-8 text"""
+        tree = self.compact() if len(self) else self
+        text = tree.joined().encode()
+        header = MAGIC + bytes([VERSION]) + len(tree).to_bytes(4, "little") + len(text).to_bytes(4, "little")
+        body = []
+        for field in FIELDS:
+            values = array("i", getattr(tree, field))
+            if sys.byteorder == "big":
+                values.byteswap()
+            body.append(values.tobytes())
+        return header + b"".join(body) + text
+
+    @classmethod
+    def loads(cls, data):
+        """Inverse of dumps
+
+        :param data: Bytes, as returned by dumps
+        :returns: The deserialised tree
+        :rtype: CompactTree
+
+        """
+        if data[:4] != MAGIC or data[4] != VERSION:
+            raise ValueError("Not a serialised clause tree")
+        count = int.from_bytes(data[5:9], "little")
+        textLength = int.from_bytes(data[9:13], "little")
+        tree = cls()
+        offset = 13
+        size = array("i").itemsize * count
+        for field in FIELDS:
+            values = array("i")
+            values.frombytes(data[offset : offset + size])
+            if sys.byteorder == "big":
+                values.byteswap()
+            setattr(tree, field, values)
+            offset += size
+        tree.buffer = data[offset : offset + textLength].decode()
+        tree.length = len(tree.buffer)
+        return tree
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.loads(f.read())
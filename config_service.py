@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# config.json for the web UI, parsed once and kept until the file changes on disk (by its mtime and size), so a page render that
+# asks for several settings doesn't re-read and re-parse the file for each. Writes go to a temporary file which then replaces the
+# real one, so neither the daemon nor the next request ever reads half a config. The drive link for the configured folder needs a
+# walk down the folder path on the drive, which is done in the background and remembered: a page shows the link last resolved (the
+# one saved in config.json, to begin with) rather than waiting on the drive.
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG = "config.json"
+
+services = {}  # Absolute path of the config file -> ConfigService
+servicesLock = threading.Lock()
+
+
+class ConfigService:
+    """The parsed config.json, shared by every request in the process. What get returns is shared too, so it mustn't be changed
+    in place: save or update a copy instead"""
+
+    def __init__(self, configFile=CONFIG):
+        self.configFile = configFile
+        self.lock = threading.RLock()  # Held across read-modify-writes, which re-enter it through get and save
+        self.config = None
+        self.stamp = None  # (mtime_ns, size) of the file self.config was read from
+        self.links = {}  # Folder path -> the folder's drive link
+        self.resolving = set()  # Folder paths with a lookup under way
+        self.resolver = None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="folder-link")
+
+    def get(self):
+        """The current config
+
+        :returns: The parsed config.json, re-read only if it has changed since it was last read
+        :rtype: Dict
+
+        """
+        stat = os.stat(self.configFile)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if stamp != self.stamp:
+                with open(self.configFile) as conf:
+                    self.config = json.load(conf)
+                self.stamp = stamp
+            return self.config
+
+    def save(self, config):
+        """Atomically replace config.json
+
+        :param config: The whole new config
+        :returns: None
+        :rtype: NoneType
+
+        """
+        temp = self.configFile + ".tmp"
+        with self.lock:
+            with open(temp, "w") as conf:
+                json.dump(config, conf)
+            os.replace(temp, self.configFile)
+            stat = os.stat(self.configFile)
+            self.config = config
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+
+    def update(self, **changes):
+        """Change some settings, keeping the rest. Keys with dashes (e.g. custom-rules) can be passed with **{"custom-rules": ...}
+
+        :param changes: The settings to change
+        :returns: The new config
+        :rtype: Dict
+
+        """
+        with self.lock:
+            config = {**self.get(), **changes}
+            self.save(config)
+            return config
+
+    def knownLink(self, folderpath):
+        """The drive link of a folder, if it's been looked up already (without starting a lookup)
+
+        :param folderpath: The folder's path
+        :returns: Its link, or None
+        :rtype: String or NoneType
+
+        """
+        with self.lock:
+            return self.links.get(folderpath)
+
+    def folderLink(self, folderpath=None):
+        """The drive link of a folder, without waiting on the drive. The first time a path is asked about, it's looked up in the
+        background; until then, the link saved in config.json (which may be for an earlier folder path) is given
+
+        :param folderpath: The folder's path, defaults to the configured one
+        :returns: The folder's link, or None if none is known yet
+        :rtype: String or NoneType
+
+        """
+        config = self.get()
+        folderpath = folderpath or config["folderpath"]
+        with self.lock:
+            link = self.links.get(folderpath)
+        if link is None:
+            self.resolveLater(folderpath)
+            return config.get("folderlink")
+        return link
+
+    def resolveLater(self, folderpath):
+        with self.lock:
+            if self.resolver is None or folderpath in self.resolving:
+                return
+            self.resolving.add(folderpath)
+        self.executor.submit(self.resolve, folderpath)
+
+    def resolve(self, folderpath):
+        # In the background: look the folder up, remember its link, and save it in config.json if it's still the configured folder
+        try:
+            link = self.resolver(folderpath)
+        except Exception as e:  # The drive being unreachable mustn't take the web UI down; the next page load tries again
+            print(f"Couldn't resolve {folderpath}: {e}")
+            return
+        finally:
+            with self.lock:
+                self.resolving.discard(folderpath)
+        with self.lock:
+            self.links[folderpath] = link
+            # Checked and written under the one lock, so a settings change to another folder can't slip in between
+            config = self.get()
+            if config.get("folderpath") == folderpath and config.get("folderlink") != link:
+                self.update(folderlink=link)
+
+
+def current(configFile=CONFIG):
+    """The config, for settings read on hot paths: config.json is only re-read when it changes, rather than on every call
+
+    :param configFile: Path to the config file
+    :returns: The parsed config (shared, so not to be changed in place), or {} if it's missing or unreadable, so callers use
+        their defaults
+    :rtype: Dict
+
+    """
+    try:
+        return service(configFile).get()
+    except (OSError, ValueError):
+        return {}
+
+
+def service(configFile=CONFIG, resolver=None):
+    """The config service for a config file, made the first time it's asked for
+
+    :param configFile: Path to the config file
+    :param resolver: Function from a folder path to its drive link (e.g. via gdrive_tools.getMainFolder), for folderLink
+    :returns: The file's service
+    :rtype: ConfigService
+
+    """
+    with servicesLock:
+        key = os.path.abspath(configFile)
+        if key not in services:
+            services[key] = ConfigService(configFile)
+        if resolver is not None:
+            services[key].resolver = resolver
+        return services[key]
@@ -0,0 +1,296 @@
+#! /usr/bin/env python
+# Generates fake (but realistic-looking) MUN documents, so we have something to benchmark and load test against without touching anyone's drive.
+import json
+import random
+from os import makedirs, path
+
+import docx
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+PREAMBULATORY = (
+    "Recalling",
+    "Reaffirming",
+    "Noting with concern",
+    "Deeply disturbed by",
+    "Acknowledging",
+    "Bearing in mind",
+    "Emphasizing",
+    "Guided by",
+    "Alarmed by",
+    "Recognizing",
+)
+OPERATIVE = (
+    "Urges",
+    "Calls upon",
+    "Encourages",
+    "Requests",
+    "Decides",
+    "Recommends",
+    "Invites",
+    "Supports",
+    "Condemns",
+    "Further requests",
+)
+COMMITTEES = (
+    "General Assembly First Committee",
+    "Security Council",
+    "Human Rights Council",
+    "World Health Organization",
+    "Economic and Social Council",
+    "UNEP",
+)
+TOPICS = (
+    "Nuclear Disarmament",
+    "The Question of Cyber Warfare",
+    "Access to Clean Water",
+    "Refugee Protection in Conflict Zones",
+    "Regulation of Autonomous Weapons",
+    "Climate Induced Migration",
+)
+COUNTRIES = (
+    "France",
+    "Brazil",
+    "India",
+    "Japan",
+    "Kenya",
+    "Germany",
+    "Mexico",
+    "Indonesia",
+    "Nigeria",
+    "Canada",
+)
+DOMAINS = (
+    "www.un.org",
+    "www.reuters.com",
+    "www.bbc.co.uk",
+    "www.aljazeera.com",
+    "news.un.org",
+    "www.hrw.org",
+    "www.who.int",
+    "www.theguardian.com",
+)
+WORDS = (
+    "member states the international community should cooperate with regional "
+    "organisations to ensure that humanitarian assistance reaches civilians "
+    "affected by the ongoing crisis while respecting national sovereignty and "
+    "the principles of the charter including transparency accountability and "
+    "sustainable development through funding frameworks capacity building and "
+    "the exchange of best practices between developed and developing nations"
+).split()
+
+# Multilevel list definition, so resolutions get real word numbering (1. / (a) / (i)) rather than typed prefixes.
+NUMBERING_ID = 90
+NUMBERING_XML = f"""<w:abstractNum {nsdecls("w")} w:abstractNumId="{NUMBERING_ID}">
+<w:lvl w:ilvl="0"><w:start w:val="1"/><w:numFmt w:val="decimal"/><w:lvlText w:val="%1."/></w:lvl>
+<w:lvl w:ilvl="1"><w:start w:val="1"/><w:numFmt w:val="lowerLetter"/><w:lvlText w:val="(%2)"/></w:lvl>
+<w:lvl w:ilvl="2"><w:start w:val="1"/><w:numFmt w:val="lowerRoman"/><w:lvlText w:val="(%3)"/></w:lvl>
+<w:lvl w:ilvl="3"><w:start w:val="1"/><w:numFmt w:val="upperLetter"/><w:lvlText w:val="%4."/></w:lvl>
+</w:abstractNum>"""
+
+
+def sentence(rng, words=12):
+    """Make a random sentence out of the filler vocabulary
+
+    :param rng: A random.Random instance, so output is reproducible
+    :param words: Approximate number of words in the sentence
+    :returns: A sentence, without trailing punctuation
+    :rtype: String
+
+    """
+    return " ".join(rng.choice(WORDS) for _ in range(max(1, words)))
+
+
+def fakeLink(rng):
+    """Make a plausible news/UN style URL
+
+    :param rng: A random.Random instance
+    :returns: A naked http link
+    :rtype: String
+
+    """
+    slug = "-".join(rng.choice(WORDS) for _ in range(4))
+    return f"http://{rng.choice(DOMAINS)}/{rng.randint(2015, 2021)}/{slug}-{rng.randint(1000, 99999)}"
+
+
+def withLinks(rng, text, linkDensity):
+    # Each paragraph gets a link with probability linkDensity
+    return f"{text} {fakeLink(rng)}" if rng.random() < linkDensity else text
+
+
+def addNumbering(document):
+    """Register the resolution list style with a document's numbering part
+
+    :param document: A python-docx Document
+    :returns: The numId to reference from list paragraphs
+    :rtype: Integer
+
+    """
+    numbering = document.part.numbering_part.element
+    numbering.insert(0, parse_xml(NUMBERING_XML))
+    numbering.append(
+        parse_xml(
+            f'<w:num {nsdecls("w")} w:numId="{NUMBERING_ID}"><w:abstractNumId w:val="{NUMBERING_ID}"/></w:num>'
+        )
+    )
+    return NUMBERING_ID
+
+
+def addListParagraph(document, text, level, numId=NUMBERING_ID):
+    paragraph = document.add_paragraph(text)
+    paragraph._p.get_or_add_pPr().append(
+        parse_xml(
+            f'<w:numPr {nsdecls("w")}><w:ilvl w:val="{level}"/><w:numId w:val="{numId}"/></w:numPr>'
+        )
+    )
+    return paragraph
+
+
+def makeResolution(filename, clauses=10, depth=3, linkDensity=0.0, seed=None):
+    """Write a draft resolution: bold committee header, topic, sponsors, preamble and a nested operative clause list
+
+    :param filename: Where to save the .docx
+    :param clauses: Number of top-level operative clauses
+    :param depth: Deepest level of sub-clauses (1 means no sub-clauses)
+    :param linkDensity: Probability of any given paragraph containing a naked link
+    :param seed: Seed for reproducible output
+    :returns: The path of the saved document
+    :rtype: String
+
+    """
+    rng = random.Random(seed)
+    document = docx.Document()
+    numId = addNumbering(document)
+    document.add_paragraph().add_run(f"Committee: {rng.choice(COMMITTEES)}").bold = True
+    document.add_paragraph(f"Topic: {rng.choice(TOPICS)}")
+    document.add_paragraph(f"Sponsors: {', '.join(rng.sample(COUNTRIES, 3))}")
+    document.add_paragraph("The General Assembly,")
+    for _ in range(max(1, clauses // 2)):
+        document.add_paragraph(
+            withLinks(rng, f"{rng.choice(PREAMBULATORY)} {sentence(rng)},", linkDensity)
+        )
+
+    def addClause(level, last):
+        # Sub-clauses get rarer the deeper we go
+        children = (
+            rng.randint(2, 4) if level + 1 < depth and rng.random() < 0.6 / (level + 1) else 0
+        )
+        opener = rng.choice(OPERATIVE) + " " if level == 0 else ""
+        ending = ":" if children else ("." if last else ";")
+        addListParagraph(
+            document,
+            withLinks(rng, f"{opener}{sentence(rng, rng.randint(8, 25))}", linkDensity)
+            + ending,
+            level,
+            numId,
+        )
+        for i in range(children):
+            addClause(level + 1, last and i == children - 1)
+
+    for i in range(clauses):
+        addClause(0, i == clauses - 1)
+    document.save(filename)
+    return filename
+
+
+def makePositionPaper(filename, paragraphs=5, linkDensity=0.0, seed=None):
+    """Write a position paper: country/committee/topic header followed by prose paragraphs
+
+    :param filename: Where to save the .docx
+    :param paragraphs: Number of body paragraphs
+    :param linkDensity: Probability of any given paragraph containing a naked link
+    :param seed: Seed for reproducible output
+    :returns: The path of the saved document
+    :rtype: String
+
+    """
+    rng = random.Random(seed)
+    document = docx.Document()
+    document.add_paragraph(f"Country: {rng.choice(COUNTRIES)}")
+    document.add_paragraph(f"Committee: {rng.choice(COMMITTEES)}")
+    document.add_paragraph(f"Topic: {rng.choice(TOPICS)}")
+    for _ in range(paragraphs):
+        body = ". ".join(sentence(rng, rng.randint(10, 20)) for _ in range(rng.randint(4, 8)))
+        document.add_paragraph(withLinks(rng, body.capitalize() + ".", linkDensity))
+    document.save(filename)
+    return filename
+
+
+def makeNotes(filename, lines=60, linkDensity=0.2, seed=None):
+    """Write research notes: lots of short lines, some loosely indented, and plenty of links
+
+    :param filename: Where to save the .docx
+    :param lines: Number of lines of notes
+    :param linkDensity: Probability of any given line containing a naked link
+    :param seed: Seed for reproducible output
+    :returns: The path of the saved document
+    :rtype: String
+
+    """
+    rng = random.Random(seed)
+    document = docx.Document()
+    document.add_paragraph(f"Notes on {rng.choice(TOPICS)}")
+    for _ in range(lines):
+        indent = "\t" if rng.random() < 0.2 else ""
+        document.add_paragraph(
+            indent + withLinks(rng, sentence(rng, rng.randint(3, 10)), linkDensity)
+        )
+    document.save(filename)
+    return filename
+
+
+GENERATORS = {
+    "resolution": lambda f, size, density, seed: makeResolution(
+        f, clauses=max(2, int(10 * size)), linkDensity=density, seed=seed
+    ),
+    "position": lambda f, size, density, seed: makePositionPaper(
+        f, paragraphs=max(2, int(5 * size)), linkDensity=density, seed=seed
+    ),
+    "notes": lambda f, size, density, seed: makeNotes(
+        f, lines=max(5, int(60 * size)), linkDensity=density, seed=seed
+    ),
+}
+
+
+def makeCorpus(
+    folder,
+    count=30,
+    kinds=("resolution", "position", "notes"),
+    size=1.0,
+    linkDensity=0.1,
+    seed=0,
+):
+    """Fill a folder with a mix of synthetic documents, and write a labels.json mapping filenames to their true type
+
+    :param folder: The folder to write documents into (created if missing)
+    :param count: Total number of documents
+    :param kinds: Which document types to generate, cycled in order
+    :param size: Size multiplier, 1.0 is a typical document of each kind
+    :param linkDensity: Probability of a paragraph/line containing a naked link
+    :param seed: Base seed, so the same arguments always give the same corpus
+    :returns: A dictionary of {path: type}
+    :rtype: Dict
+
+    """
+    makedirs(folder, exist_ok=True)
+    labels = {}
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        filename = path.join(folder, f"{kind}-{i:05d}.docx")
+        labels[GENERATORS[kind](filename, size, linkDensity, seed * 100003 + i)] = kind
+    with open(path.join(folder, "labels.json"), "w") as labelFile:
+        json.dump({path.basename(k): v for k, v in labels.items()}, labelFile)
+    return labels
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic MUN corpus")
+    parser.add_argument("folder")
+    parser.add_argument("--count", type=int, default=30)
+    parser.add_argument("--size", type=float, default=1.0)
+    parser.add_argument("--link-density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    makeCorpus(args.folder, args.count, size=args.size, linkDensity=args.link_density, seed=args.seed)
@@ -1,28 +1,51 @@
 #! /usr/bin/env python
 # Basically the file where I put everything that messes with ODF files
+import codecs
+import re
 import shutil
 import zipfile
-from json import load
+from collections import deque
+from itertools import islice
+from html.parser import HTMLParser
 from math import floor
-from os import path
+from os import path, replace
 from pathlib import Path
 from pprint import pprint
 from re import findall
-from string import ascii_lowercase
-from types import GeneratorType
 from urllib.parse import urlparse
+from xml.sax.saxutils import escape, unescape
 
 import docx
 import requests
-from bs4 import BeautifulSoup
 from docx2python import docx2python
 from docx2txt import process as asTxt
 from send2trash import send2trash
 from urlextract import URLExtract
 
-appname = "pyMUN"
-
+import config_service
+import metrics
+import tracing
+from clause_tree import NONE, OPERATIVE, PREAMBLE, CompactTree
 
+appname = "pyMUN"
+# Defaults for the classification heuristics' constants. Overridden by "thresholds" in config.json
+THRESHOLDS = {"listRatio": 0.5, "maxIndent": 2, "links": 1, "words": 900}
+# Header keys (and their synonyms) -> the metadata field they fill
+HEADER_KEYS = {
+    "topic": "agenda",
+    "agenda": "agenda",
+    "committee": "committee",
+    "forum": "committee",
+    "country": "country",
+    "delegation": "country",
+    "submitted by": "country",
+}
+# "<key>: value" or "<key> - value", with the key near the start of the line ("Topic Area: ...", "1. Committee: ...")
+HEADER = re.compile(r"^.{0,40}?\b(" + "|".join(HEADER_KEYS) + r")\b[^:\n]{0,20}?\s*(?::|\s-|\u2013)\s*(\S.*)", re.I)
+HEADER_WINDOW = 40  # Lines at the start and end of a document searched for header keys. Overridden by "header-window" in config.json
+
+
+@tracing.traced()
 def asArr(filename):
     return docx2python(filename).body
 
@@ -66,6 +89,7 @@ def getBody(docArr):
         return getBody(docArr[0])
 
 
+@tracing.traced()
 def listElems(docBody):
     """Given a document body, return all lines/paras which are elements of a list
 
@@ -149,6 +173,7 @@ def indentLevel(line):
     return -1
 
 
+@tracing.traced()
 def maxIndent(docArray):
     """Returns the level of indentation of the most deeply-indented line in a word document
 
@@ -174,9 +199,16 @@ def links(txt):
     :rtype: List of string
 
     """
-    return URLExtract().find_urls(txt)
+    global extractor
+    if extractor is None:
+        extractor = URLExtract()  # Loads the TLD list, so it's slow to create
+    return extractor.find_urls(txt)
+
+
+extractor = None
 
 
+@tracing.traced()
 def countLinks(txt):
     return len(links(txt))
 
@@ -213,6 +245,52 @@ def cleanString(string, keyword):
     return x if len(x) <= 75 else x[0:74] + "..."
 
 
+def headerFields(line):
+    """Match a single line against every header key at once
+
+    :param line: A line of the document
+    :returns: {field: value} for the key on the line, if there is one
+    :rtype: Dict
+
+    """
+    match = HEADER.match(line.strip())
+    if not match:
+        return {}
+    value = match.group(2).strip().lower()
+    return {HEADER_KEYS[match.group(1).lower()]: value if len(value) <= 75 else value[0:74] + "..."}
+
+
+def headerWindow(configFile="config.json"):
+    try:
+        return int(config_service.current(configFile).get("header-window", HEADER_WINDOW))
+    except (TypeError, ValueError):
+        return HEADER_WINDOW
+
+
+def scanHeader(lines, window=None):
+    """Find the header metadata in the first and last few lines of a document. Lines are read lazily, and the scan stops as soon as every
+    field has been found; anything between the head and the tail is skipped over without being looked at
+
+    :param lines: Iterable of the document's lines, in order
+    :param window: Number of lines at each end to look at, headerWindow() if not given
+    :returns: {field: value} for each field found, the first occurrence winning
+    :rtype: Dict
+
+    """
+    window = window or headerWindow()
+    wanted = len(set(HEADER_KEYS.values()))
+    result = {}
+    lines = iter(lines)
+    for part in (lambda: islice(lines, window), lambda: deque(lines, maxlen=window)):  # The tail is only read once the head is done
+        for line in part():
+            for field, value in headerFields(line).items():
+                result.setdefault(field, value)
+            if len(result) == wanted:
+                return result
+    return result
+
+
+@tracing.traced()
 def extractMetadata(docArr):
     """Search through the document array, and attempt to discover document metadata such as the agenda, committee, country.
 
@@ -221,28 +299,14 @@ def extractMetadata(docArr):
     :rtype: Dict
 
     """
-    # Search through a flattened version of the list, where one line represents one element.
     # Position papers usually have metadata as key:value somewhere at the top, or occasionally the bottom.
     # https://www.wisemee.com/how-to-write-a-mun-position-paper/
     # https://bestdelegate.com/model-un-made-easy-how-to-write-a-resolution/
-    clean = flatten(docArr)  # Each elem of clean is a line of text
-    lowered = [i.lower() for i in clean]
-    meta = [i for i in lowered if ":" in i or "-" in i]
-    agenda = [i for i in meta if "topic" in i]
-    committee = [i for i in meta if "committee" in i]
-    country = [i for i in meta if "country" in i]
-    result = {}
-    # Everything up till here is good. The problem now is that resolution headers have committee names as the first line in bold, without any key:value syntax. How to get that
-    # Everything below here is hacky and I want to fix it.
-    if agenda:
-        result.update({"agenda": cleanString(agenda[0], "topic")})
-    if committee:
-        result.update({"committee": cleanString(committee[0], "committee")})
-    if country:
-        result.update({"country": cleanString(country[0], "country")})
-    return result
+    # Resolution headers have the committee name as the first bold line instead, without any key:value syntax: see getCommittee
+    return scanHeader(flatten(docArr))
 
 
+@tracing.traced()
 def getCommittee(resolution):
     """In resolutions, the committee name is bold and on one of the first lines. This function finds and returns it.
 
@@ -264,6 +328,7 @@ def getCommittee(resolution):
 # Not very robust, but it'll have to do for now.
 
 
+@tracing.traced()
 def wordCount(document):
     """Count the number of words in a word document
 
@@ -278,37 +343,111 @@ def wordCount(document):
     return len(body)
 
 
-def docType(docxFile):
-    """Uses a variety of heuristics to deduce the type of a given document, returning unclassified if it fails
+def lineFeatures(line):
+    """The structural features of a single line/para, cheap enough to recompute every time
 
-    :param docxFile: Path to the word document that needs to be classified
+    :param line: A line of the document, as rendered by docx2python (tabs for list levels, then the list marker)
+    :returns: (is a numbered list element, indent level, has a small roman marker, word count)
+    :rtype: Tuple
+
+    """
+    text = line.strip()
+    marker = MARKER.match(text)
+    return (
+        bool(marker and marker.group(1)),
+        indentLevel(line),
+        ")" in text and hasSmallRoman(text),
+        len(line.split()),
+    )
+
+
+def textFeatures(line):
+    """The features of a line which are expensive to find (links), or only depend on its text (key: value metadata), so worth caching
+
+    :param line: A line of the document
+    :returns: (number of links, number of those not yet rewritten by replaceLinks, dict of metadata found on the line)
+    :rtype: Tuple
+
+    """
+    found = links(line) if "." in line else []
+    return len(found), sum(f"[{i}]" not in line for i in found), headerFields(line)
+
+
+def documentFeatures(lines, linkCounts=None):
+    """Sum up the features of every line into the counts docType works from
+
+    :param lines: Every line/para of the document, in order
+    :param linkCounts: Links per line if already known (e.g. cached), otherwise they're counted here
+    :returns: Dict of paragraphs, lists, maxIndent, roman, words and links
+    :rtype: Dict
+
+    """
+    features = {"paragraphs": len(lines), "lists": 0, "maxIndent": -1, "roman": 0, "words": 0}
+    for line in lines:
+        isList, indent, roman, words = lineFeatures(line)
+        features["lists"] += isList
+        features["maxIndent"] = max(features["maxIndent"], indent)
+        features["roman"] += roman
+        features["words"] += words
+    if linkCounts is None:
+        linkCounts = [textFeatures(i)[0] for i in lines]
+    features["links"] = sum(linkCounts)
+    return features
+
+
+def classifierThresholds(configFile="config.json"):
+    """The constants the classification heuristics use, with any overrides from config.json (see batch_classify.py calibrate)
+
+    :param configFile: Path to the config file
+    :returns: Dict of listRatio, maxIndent, links and words
+    :rtype: Dict
+
+    """
+    return {**THRESHOLDS, **config_service.current(configFile).get("thresholds", {})}
+
+
+def typeFromFeatures(features, meta, thresholds=None):
+    """The classification heuristics, given a document's features
+
+    :param features: As returned by documentFeatures
+    :param meta: As returned by extractMetadata
+    :param thresholds: As returned by classifierThresholds, which is used if not given
     :returns: One of ("resolution","position","notes","unclassified")
     :rtype: String
 
     """
-    docArr = getBody(asArr(docxFile))
-    maxdepth = maxIndent(docArr)  # NOTE: Unreliable
-    if maxdepth >= 2 or bool(
-        len(listElems(docArr)) >= floor(0.5 * len(docArr))  # Reliable
+    thresholds = thresholds or classifierThresholds()
+    # As docType always has, a document with (next to) no paragraphs counts as all list, so as a resolution
+    if features["maxIndent"] >= thresholds["maxIndent"] or (
+        features["lists"] >= floor(thresholds["listRatio"] * features["paragraphs"])
     ):  # More than 50% list
         return "resolution"
-    for i in docArr:
-        if hasSmallRoman(i):  # We have a 3-nested sublist
-            return "resolution"
-    # We can develop the stuff above a bit, but for now it's fine
-    meta = extractMetadata(docArr)
+    if features["roman"]:  # We have a 3-nested sublist
+        return "resolution"
     if "country" in meta:
         return "position"
-    if countLinks(docxFile) > 1:
+    if features["links"] > thresholds["links"]:
         return "notes"
     # TODO: Para structure tests
-
-    if wordCount(docArr) >= 900:
+    if features["words"] >= thresholds["words"]:
         return "notes"
-
     return "unclassified"
 
 
+@tracing.traced()
+def docType(docxFile):
+    """Uses a variety of heuristics to deduce the type of a given document, returning unclassified if it fails
+
+    :param docxFile: Path to the word document that needs to be classified
+    :returns: One of ("resolution","position","notes","unclassified")
+    :rtype: String
+
+    """
+    lines = list(flatten(asArr(docxFile)))
+    return typeFromFeatures(documentFeatures(lines), extractMetadata(lines))
+
+
+@tracing.traced()
 def magicParse(path):
     """Determine the type of a document, and extract whatever metadata it can
 
@@ -330,73 +469,213 @@ def magicParse(path):
     )
 
 
-def customClassify(title, localPath):
-    """Read the config.json file and find the list of custom rules. Then, apply them to a given file
+def customRules(configFile="config.json"):
+    # The config's own copy, so it's only to be read
+    return config_service.current(configFile)["custom-rules"]
+
+
+def ruleType(rules, title, text):
+    """Apply custom rules to a document: name rules first, then (only if there are any) contains rules
 
+    :param rules: The "custom-rules" section of config.json
     :param title: The title of the file, as it is stored in Gdrive
-    :param localPath: The path to the download of the file.
+    :param text: The document's text, or a function returning it, which is only called if there are contains rules
     :returns: A classification for the document if the custom rules provide one, else None
     :rtype: String, or Nonetype
 
     """
-    # Read json. Get a list of custom rules and split them into two dicts: containRules, nameRules
-    with open("config.json") as conf:
-        rules = load(conf)["custom-rules"]
     nameRules = {i["regex"]: i["type"] for i in rules["name"]}
     containRules = {i["regex"]: i["type"] for i in rules["contains"]}
     for k, v in nameRules.items():
         if k in title:
             return v
-    text = asTxt(localPath)
+    if not containRules:
+        return None
+    text = text() if callable(text) else text
     for k, v in containRules.items():
         if k in text:
             return v
     return None  # Or false
 
 
+@tracing.traced()
+def customClassify(title, localPath):
+    """Read the config.json file and find the list of custom rules. Then, apply them to a given file
+
+    :param title: The title of the file, as it is stored in Gdrive
+    :param localPath: The path to the download of the file.
+    :returns: A classification for the document if the custom rules provide one, else None
+    :rtype: String, or Nonetype
+
+    """
+    return ruleType(customRules(), title, lambda: asTxt(localPath))
+
+
+LINK_CHUNK = 8192
+HEAD_BYTES = 128 * 1024  # Most of a page read looking for the end of its <head>; titles past this aren't worth the download
+PDF_BYTES = 64 * 1024  # Read from each end of a PDF looking for its document information dictionary
+PDF_INFO = re.compile(rb"/Info\s+(\d+)\s+(\d+)\s+R")
+PDF_TITLE = re.compile(rb"/Title\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)", re.S)
+PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+class HeadParser(HTMLParser):
+    """Picks the title and og: properties out of a page as it's fed in, and notes when the <head> is over so the rest can go unread"""
+
+    def __init__(self):
+        super().__init__()
+        self.title = None
+        self.inTitle = False
+        self.metadata = {}
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "title" and self.title is None:
+            self.inTitle = True
+            self.title = ""
+        elif tag == "meta" and (attrs.get("property") or "").startswith("og:") and attrs.get("content") is not None:
+            self.metadata.setdefault(attrs["property"][3:], attrs["content"])
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.inTitle = False
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self.inTitle:
+            self.title += data
+
+    def result(self):
+        title = " ".join(self.title.split()) if self.title else None
+        return {"web_title": title, **self.metadata}
+
+
 # Credit https://github.com/python-openxml/python-docx/issues/610
 def getHtmlData(html):
-    """Given a well-formed HTML page, return metadata including the title, and whatever other metadata the document contains
+    """Given an HTML page (or as much of it as covers the <head>), return metadata including the title, and whatever other metadata the document contains
 
-    :param html: The html to scrape/extract metadata from
+    :param html: The html to scrape/extract metadata from, as a string or bytes
     :returns: Dictionary containing whatever metadata was extracted
     :rtype: Dict
 
     """
-    # Given a URL, return a dict of the title, site/source, and any other metadata
-    soup = BeautifulSoup(html, features="lxml")
-    title = soup.title.string
-    metas = soup.find_all("meta")
-    metadata = {}
-    relevant = [
-        m for m in metas if "property" in m.attrs and "og" in m.attrs["property"]
-    ]
-    for meta in relevant:
-        metadata.update(
-            {meta.attrs["property"].replace("og:", ""): meta.attrs["content"]}
-        )
-    return {"web_title": title, **metadata}
+    parser = HeadParser()
+    parser.feed(html.decode("utf-8", "replace") if isinstance(html, bytes) else html)
+    return parser.result()
+
 
+def streamHead(response, cap=HEAD_BYTES):
+    # Feed the page to the parser a chunk at a time, and hang up as soon as the head's been read
+    parser = HeadParser()
+    # Only a charset the server gave; requests' ISO-8859-1 default for text/* would garble most pages, which are UTF-8
+    charset = re.search(r"charset=[\"']?([\w-]+)", response.headers.get("Content-Type", ""))
+    try:
+        decoder = codecs.getincrementaldecoder(charset.group(1) if charset else "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    read = 0
+    for chunk in response.iter_content(LINK_CHUNK):
+        read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or read >= cap:
+            break
+    metrics.inc("pymun_link_bytes_total", read, kind="html")
+    return parser.result()
+
+
+def pdfEscape(match):
+    escaped = match.group(1)
+    if escaped[:1].isdigit():
+        return bytes([int(escaped, 8) & 0xFF])
+    if escaped in (b"\r\n", b"\n", b"\r"):
+        return b""  # A backslash at the end of a line continues the string onto the next
+    return PDF_ESCAPES.get(escaped, escaped)
+
+
+def pdfString(raw):
+    # A PDF string object, literal "(...)" or hex "<...>", decoded from UTF-16 if it has a byte order mark, otherwise PDFDocEncoding
+    # (close enough to Latin-1 for a title)
+    if raw.startswith(b"<"):
+        value = bytes.fromhex(re.sub(rb"\s", b"", raw[1:-1]).decode().ljust(2, "0"))
+    else:
+        value = re.sub(rb"\\([0-7]{1,3}|\r\n|.)", pdfEscape, raw[1:-1], flags=re.S)
+    if value.startswith(b"\xfe\xff"):
+        return value[2:].decode("utf-16-be", "replace")
+    return value.decode("latin-1")
+
+
+def pdfTitle(head, tail):
+    """The /Title of a PDF's document information dictionary, from the ends of the file. The trailer at the end points to the
+    dictionary, which is usually near one end or the other; one packed into a compressed object stream isn't found
+
+    :param head: The start of the PDF
+    :param tail: The end of the PDF (or b"" if head is the whole of it)
+    :returns: The title, or None
+    :rtype: String or NoneType
 
+    """
+    data = head + tail
+    info = None
+    for info in PDF_INFO.finditer(data):
+        pass  # The last trailer is the current one
+    if info is None:
+        return None
+    obj = re.search(rb"(?<!\d)" + info.group(1) + rb"\s+" + info.group(2) + rb"\s+obj\b(.*?)endobj", data, re.S)
+    title = obj and PDF_TITLE.search(obj.group(1))
+    if not title:
+        return None
+    return " ".join(pdfString(title.group(1)).split()) or None
+
+
+def fetchPdfTitle(url, response):
+    # The start of the PDF comes from the response already open; the end, where the trailer is, from a range request
+    head = b""
+    for chunk in response.iter_content(LINK_CHUNK):
+        head += chunk
+        if len(head) >= PDF_BYTES:
+            break
+    tail = b""
+    size = int(response.headers.get("Content-Length") or 0)
+    if len(head) >= PDF_BYTES and size != len(head):
+        with requests.get(url, timeout=2, stream=True, headers={"Range": f"bytes=-{PDF_BYTES}"}) as ranged:
+            if ranged.status_code == 206:
+                tail = ranged.raw.read(PDF_BYTES)
+    metrics.inc("pymun_link_bytes_total", len(head) + len(tail), kind="pdf")
+    return {"web_title": pdfTitle(head, tail)}
+
+
+@tracing.traced(withArgs=True)
 def getLinkData(url):
-    """Given a URL, extract whatever metadata is possible, including the title, source, and whatever metadata the webpage itself provides
+    """Given a URL, extract whatever metadata is possible, including the title, source, and whatever metadata the webpage itself provides.
+    Only as much of the page is downloaded as it takes to get to the end of its <head>; PDFs are titled from their document information,
+    and anything else just from its URL
 
     :param url: URL to read
     :returns: Key-value representation of website metadata attributes
     :rtype: Dict
 
     """
-    try:
-        response = requests.get(url, timeout=2)
-    except:
-        response = False
     source = urlparse(url).netloc.replace(
         "www.", ""
     )  # Consider replacing the last bit of the domain name (.org, etc)
-    if response:
-        return {**getHtmlData(response.content), "source": source}
-    else:
-        return {"source": source, "web_title": url.split("/")[-1]}
+    data = {}
+    try:
+        with metrics.stage("link-fetch"), requests.get(url, timeout=2, stream=True) as response:
+            # The headers arrive before any of the body, so the content type decides how much of it (if any) is read
+            kind = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if response and kind in ("text/html", "application/xhtml+xml", ""):
+                data = streamHead(response)
+            elif response and (kind == "application/pdf" or (kind == "application/octet-stream" and url.lower().endswith(".pdf"))):
+                data = fetchPdfTitle(url, response)
+    except Exception:
+        pass
+    if not data.get("web_title"):
+        data["web_title"] = url.rstrip("/").split("/")[-1]
+    return {**data, "source": source}
 
 
 # DONE: Test on some HTML pages (actual sources I used for MUN)
@@ -407,18 +686,30 @@ Compress the folder back and write it to the original docx file
 DONE"""
 
 
-def linkDict(txt):
+@tracing.traced()
+def linkDict(txt, known=None):
     """Given a string, find all links in that string, and create string representations of them of the form "{title} {source}".
 
     :param txt: The string/text from which to extract links
+    :param known: Replacements already worked out for some links (e.g. the link table of the document this one is a copy of), which aren't fetched again
     :returns: Dict, where keys are links found in the text and values are f-strings containing some metadata
     :rtype: Dict
 
     """
-    allLinks = [i for i in links(txt) if "schemas" not in i and "http" in i]
+    known = known or {}
+    # Links already rewritten (which end up as "... [<link>]") are skipped, so re-processing an edited document only fetches new ones
+    allLinks = [
+        i
+        for i in set(links(txt))
+        if "schemas" not in i and "http" in i and txt.count(i) > txt.count(f"[{i}]")
+    ]
     # print(allLinks)
     conversionTable = {}
     for link in allLinks:
+        metrics.cacheLookup("links", link in known)
+        if link in known:
+            conversionTable.update({link: known[link]})
+            continue
         meta = getLinkData(link)
         string = f"\"{meta['web_title']} ({meta['source']}) [{link}]\""  # consider replacing webtitle
         conversionTable.update({link: string})
@@ -472,10 +763,19 @@ def getDocumentFile(folderPath):
     )
 
 
-def replaceLinksXml(filePath):
+def rewriteLinks(string, links):
+    # Links that are already followed by their "[url]" (i.e. rewritten last time) are left alone
+    for i in links:
+        string = re.sub(rf"(?<!\[){re.escape(i)}(?!\])", lambda m: links[i], string)
+    return string
+
+
+@tracing.traced()
+def replaceLinksXml(filePath, known=None):
     """Given an XML file (document.xml, specifically), replace all the hyperlinks within it
 
     :param filePath: Path to the document.xml
+    :param known: Passed on to linkDict
     :returns: A string of the XML file, with all links replaced
     :rtype: String
 
@@ -483,88 +783,143 @@ def replaceLinksXml(filePath):
     # Enough libraries, I'll just mess with the XML directly and rewrite it. Time to do something on the level of parsing HTML with regex.
     with open(filePath, "r") as xmlFile:
         string = xmlFile.read()
-        lines = xmlFile.readlines()
-    links = linkDict(string)
-    newString = string
-    for i in links:
-        newString = newString.replace(i, links[i])
-    return newString
+    return rewriteLinks(string, linkDict(string, known))
 
 
-def replaceLinks(docPath):
+@tracing.traced()
+def replaceLinks(docPath, known=None):
     """Given a path to a document, uses XML chicanery to replace the displayed text of the various links to something which reflects link metadata (as returned by linkDict() func)
 
     :param docPath: Path to the docx file which needs to be manipulated
-    :returns: None
-    :rtype: NoneType
+    :param known: Replacements already worked out for some links, passed on to linkDict
+    :returns: (the link table used, {url: replacement}; whether the document was changed, and so needs uploading again)
+    :rtype: Tuple
 
     """
     folder = extractToTemp(docPath)
     f = getDocumentFile(folder)
-    replaced = replaceLinksXml(f)
-    with open(f, "w+") as xmlFile:
-        xmlFile.write(replaced)
-    writeToDoc(folder)
+    with open(f, "r") as xmlFile:
+        string = xmlFile.read()
+    links = linkDict(string, known)
+    replaced = rewriteLinks(string, links)
+    changed = replaced != string
+    if changed:
+        # Left as it was otherwise: rezipping alone would make the file differ from the drive's copy
+        with open(f, "w+") as xmlFile:
+            xmlFile.write(replaced)
+        writeToDoc(folder)
     # DONE: Somehow mark this file as one that needs to be re-uploaded to google drive. basically, my instinct is to somehow wrap it as a google drive file object, and then push that object (or a reference to it) to a file or a list. So push the path to a file or list
     send2trash(str(folder))
+    return links, changed
 
 
 class Tree:
-    # Attributes: A list of children, all of whom are either trees or empty.
+    # A view onto one node of a CompactTree (see clause_tree.py). Every node of a tree shares the one store, so building,
+    # walking and keeping lots of trees around doesn't cost an object and a children list per clause.
     def __init__(self, rootstring, parent=None):
-        self.root = rootstring
-        self.children = []
-        self.parent = parent
+        if parent is None:
+            self.store = CompactTree()
+            self.node = self.store.addNode(rootstring)
+        else:
+            self.store = parent.store
+            self.node = self.store.addNode(rootstring, parent.node)
+
+    @classmethod
+    def view(cls, store, node=0):
+        tree = cls.__new__(cls)
+        tree.store = store
+        tree.node = node
+        return tree
 
     def __str__(self):
         return self.root  # TODO: Consider fixing
 
+    def __eq__(self, other):
+        return (
+            isinstance(other, Tree)
+            and self.store is other.store
+            and self.node == other.node
+        )
+
+    def __hash__(self):
+        return hash((id(self.store), self.node))
+
+    @property
+    def root(self):
+        return self.store.text(self.node)
+
+    @root.setter
+    def root(self, text):
+        self.store.setText(self.node, text)
+
+    @property
+    def children(self):
+        return [self.view(self.store, i) for i in self.store.children(self.node)]
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.node]
+        return self.view(self.store, parent) if parent != NONE else None
+
+    def depth(self):
+        # How far below the top of the tree this node is. Stored, so O(1)
+        return self.store.depth[self.node]
+
     def addChild(self, child):
-        self.children.append(Tree(child, self))
+        type(self)(child, self)
 
     def addChildren(self, children):
-        self.children.extend([Tree(i, self) for i in children])
+        for i in children:
+            type(self)(i, self)
 
     def removeChild(self, child):
         if child in self.children:
-            self.children.remove(child)
+            self.store.unlink(child.node)
 
     def maxDepth(self):
-        if self.children:
-            depths = [i.maxDepth() for i in self.children]
-            return max(depths) + 1
-        else:
-            return 0
+        return self.store.maxDepth(self.node)
         # Tree with only one node (no children) registers as depth 0.
 
     def getChild(self, n):
         return self.children[n]
 
     def getNestedChild(self, *args):
-        if len(args) == 1:
-            return self.getChild(args[0])
-        else:
-            return self.getChild(args[0]).getNestedChild(*args[1:])
+        node = self
+        for i in args:
+            node = node.getChild(i)
+        return node
+
+    def nodes(self):
+        # Every node in the subtree, in order, as views
+        return (self.view(self.store, i) for i in self.store.preorder(self.node))
 
     def flatten(
         self,
     ):  # Return a list of all clauses and subclauses in order. No formatting, no nesting, just all the strings.
-        yield self.root
-        for i in self.children:
-            yield i.flatten()
-            # for j in i.children:
-            #        yield j.flatten()
+        store = self.store
+        return (store.text(i) for i in store.preorder(self.node))
 
     def flattenGenerators(
         self, flat
-    ):  # The flatten function leaves nested lists as generators
-        for i, v in enumerate(flat):
-            if isinstance(v, GeneratorType):
-                flat[i] = self.flattenGenerators(list(v))
+    ):  # Kept for compatibility: flatten() no longer leaves nested generators behind, so this just flattens lists
         return flatten(flat)
 
     def fullFlatten(self):
-        return self.flattenGenerators(list(self.flatten()))
+        return list(self.flatten())
+
+    def dumps(self):
+        return self.store.compact(self.node).dumps()
+
+    def save(self, filename):
+        self.store.compact(self.node).save(filename)
+
+    @classmethod
+    def loads(cls, data):
+        return cls.view(CompactTree.loads(data))
+
+    @classmethod
+    def load(cls, filename):
+        return cls.view(CompactTree.load(filename))
 
 
 def treeTest():
@@ -577,82 +932,226 @@ def treeTest():
     pprint(x.fullFlatten())
 
 
+# A clause marker at the start of a paragraph (after any list-level tabs): 1. 1) (a) a) (iv) iv) A. or a bullet.
+# docx2python renders real (numbered) lists as "<marker>\t<text>", with one leading tab per list level.
+MARKER = re.compile(r"^(?:\(?(\d+|[a-z]{1,2}|[ivxlc]+|[A-Z])[.)]|(--|-|\u2022|\*))(?=\s)\s*")
+ROMAN = re.compile(r"^[ivxlc]+$")
+PUNCTUATION = "!&*-;:,.?"
+# A paragraph of document.xml, and a text element within one
+PARAGRAPH = re.compile(r"<w:p\b[^>]*?(?:/>|>.*?</w:p>)", re.S)
+TEXT = re.compile(r"(<w:t(?:\s[^>]*)?>)([^<]*)(</w:t>)")
+TAG = re.compile(r"<[^>]*>")
+
+
+def markerKind(token, stack):
+    """Work out which numbering scheme a clause marker belongs to
+
+    :param token: The marker without brackets/punctuation, e.g. "1", "b", "iv"
+    :param stack: The parser's stack of open clause levels, as (level, node, token) with the level being (kind, list depth)
+    :returns: One of "number", "letter", "roman", "upper"
+    :rtype: String
+
+    """
+    if token.isdigit():
+        return "number"
+    if token.isupper():
+        return "upper"
+    if ROMAN.match(token):
+        if len(token) > 1:
+            return "roman"
+        # i, v, x, l and c are letters too, but only as the next letter of an open lettered level ("i)" right after "h)");
+        # otherwise they're roman numerals, even with no lettered level above them
+        letters = [previous for (kind, _), _, previous in stack if kind == "letter"]
+        if letters and ord(token) == ord(letters[-1][-1]) + 1:
+            return "letter"
+        return "roman"
+    return "letter"
+
+
 class Clause(Tree):
-    @staticmethod
-    def filter_clauses(body, testfunc):
-        indices = [i for i, v in enumerate(body) if testfunc(v)]
-        values = [Tree(body[i]) for i in indices]
-        return indices, values
+    @property
+    def kind(self):
+        return self.store.kind[self.node]
+
+    @property
+    def para(self):
+        # Index of the paragraph (in flatten(docArr) order) this clause ends in, NONE for the document root
+        return self.store.para[self.node]
+
+    def preamble(self):
+        return [i for i in self.children if i.kind == PREAMBLE]
+
+    def operatives(self):
+        return [i for i in self.children if i.kind == OPERATIVE]
 
     @staticmethod
-    def fromFormattedDocArr(
-        docArr,
-    ):  # For now. Assumes everything is perfectly formatted
-        body = getBody(docArr)
-        docstart = Tree("Document Start")
-        toplevel = listElems(body)
-        headers = [
-            i for i in body if i not in clauses
-        ]  # In theory, just the preamble stuff. In practice, a lot more.
-
-        indices, clauses = Clause.filter_clauses(
-            clauses, lambda i: i[0] in "123456789" and i[1] in ")."
-        )
-        for index, root in enumerate(clauses):
-            # Everything between the current toplevel and the next toplevel
-            children = toplevel[
-                indices[index] : indices[index + 1]
-            ]  # So between the first and second clauses, or between the second and third,or whatever
-            subindices, subclauses = Clause.filter_clauses(
-                children,
-                lambda i: i[0] == "(" and i[2] == ")" and i[1] in ascii_lowercase,
-            )
-
-            for subindex, subroot in enumerate(subclauses):
-                subchildren = children[subindices[subindex] : subindices[subindex + 1]]
-                subsubindices, subsubclauses = Clause.filter_clauses(
-                    subchildren, hasSmallRoman
-                )  # NOTE: Since MUN only allows up to sub-sub-sub-clauses, we're probably fine without a filter and just taking everything. But keep this, partly to test if it works and partly because... reasons.
-                subclauses[subindex].addChildren(subsubclauses)
-
-            clauses[index].addChildren(subclauses)
-        docstart.addChildren(clauses)
-        return docstart
-
-    # TODO: This is a reliable-ish way to get a tree, at the cost of decent formatting and the like.
-    # For simplicity, and because recursion, we'll consider the document a single clause with subclauses
-    # We've seen that docx2python makes it a nested list and uses tabs for indents. So we'll need to start at the top,
-    # NOTE: We can consider using
+    def fromFormattedDocArr(docArr):
+        """Parse a resolution into a tree: the root's children are its preambulatory paragraphs then its operative clauses,
+        and sub*clauses nest under their clause however deep they go. Single pass, with a stack of the currently open clause levels.
+
+        :param docArr: The result of passing the doc through docx2python
+        :returns: The root (a "Document Start" clause)
+        :rtype: Clause
+
+        """
+        store = CompactTree()
+        store.addNode("Document Start")
+        stack = []  # (level, node, token) for each open level, outermost first. A level is (kind, list depth)
+        levels = {}  # level -> position in stack, so finding where a marker belongs doesn't mean scanning the stack
+        continued = {}  # node -> its paragraphs, for clauses which run over several. Joined once at the end
+        for index, line in enumerate(flatten(docArr)):
+            text = line.strip()
+            if not text:
+                continue
+            match = MARKER.match(text)
+            if not match:
+                if stack:
+                    # Continuation of the current clause (e.g. a soft break that became its own paragraph)
+                    node = stack[-1][1]
+                    continued.setdefault(node, [store.text(node)]).append(text)
+                    store.para[node] = index
+                else:
+                    store.addNode(text, 0, PREAMBLE, index)
+                continue
+            token = match.group(1) or match.group(2)
+            kind = markerKind(token, stack) if match.group(1) else "bullet"
+            level = (kind, indentLevel(line) if line[0] == "\t" else 0)
+            if level in levels:
+                # A sibling of an open clause: close it and everything below it
+                position = levels[level]
+                while len(stack) > position:
+                    del levels[stack.pop()[0]]
+            parent = stack[-1][1] if stack else 0
+            node = store.addNode(text[match.end() :], parent, OPERATIVE, index)
+            levels[level] = len(stack)
+            stack.append((level, node, token))
+        for node, parts in continued.items():
+            store.setText(node, "\n".join(parts))
+        return Clause.view(store)
+
     @staticmethod
     def appendOrReplace(target, replacer):
         # Check if the last char is punctuation. If so, replace it with replacer. Otherwise, append replacer to target.
-        last = target[-1]
-        if last in "!&*-;:,.?":
-            target[-1] = replacer
-            return target
-        else:
-            return target + replacer
+        # Trailing whitespace stays where it is
+        body = target.rstrip()
+        if body and body[-1] in PUNCTUATION:
+            body = body[:-1].rstrip()
+        return body + replacer + target[len(target.rstrip()) :]
+
+    def punctuate(self, node, replacer, changes):
+        store = self.store
+        text = store.text(node)
+        new = self.appendOrReplace(text, replacer)
+        if new != text:
+            store.setText(node, new)
+            if store.para[node] != NONE:
+                changes[store.para[node]] = replacer
 
     def format(self):
-        # Regardless of nesting level, we basically have a semicolon at the end of every sub* clause except the last one, which has a.
-        # So for every clause, I'd suggest children[-1] have a fullstop added. For the rest, if they have children, append a ":", else append a ";"
-        # If the last char is a punctuation mark, replace it, otherwise append.
-        flat = self.fullFlatten()
-        body = self.root
-        if flat[-1] == body:
-            # Last clause
-            self.appendOrReplace(".")
-        if self.children:
-            self.appendOrReplace(":")
-        else:
-            self.appendOrReplace(";")
+        """Fix the punctuation of every operative clause below (and including) this one, in a single pre-order pass:
+        a clause with subclauses ends in ":", one without in ";", and the very last clause of all in ".". Preambulatory clauses are left alone,
+        as is the top of the tree (the document itself, rather than a clause).
+
+        :returns: Dict of {paragraph index: new final punctuation mark} for every clause whose text changed, so the document can be patched
+        :rtype: Dict
+
+        """
+        store = self.store
+        changes = {}
+        previous = NONE
+        # Whether a clause is the last one is only known once the traversal moves past it, so each clause is punctuated one step late
+        for node in store.preorder(self.node):
+            if store.parent[node] == NONE or store.kind[node] != OPERATIVE:
+                continue
+            if previous != NONE:
+                self.punctuate(previous, ":" if store.firstChild[previous] != NONE else ";", changes)
+            previous = node
+        if previous != NONE:
+            self.punctuate(previous, ".", changes)
+        return changes
+
+
+def paragraphText(xml):
+    return "".join(unescape(i.group(2)) for i in TEXT.finditer(xml))
+
+
+def punctuateParagraph(xml, replacer):
+    """Put replacer at the end of a paragraph by editing only its last non-blank text element, so runs and their styles are untouched
+
+    :param xml: The paragraph's XML (a whole w:p element)
+    :param replacer: The punctuation mark the paragraph should end with
+    :returns: The edited XML
+    :rtype: String
+
+    """
+    for i in reversed(list(TEXT.finditer(xml))):
+        text = unescape(i.group(2))
+        if text.strip():
+            return xml[: i.start(2)] + escape(Clause.appendOrReplace(text, replacer)) + xml[i.end(2) :]
+    return xml
 
-        for i in self.children:
-            i.format()
-            # Calls itself recursively. Stops when there are no children left, which is perfect
 
+def sameEnding(parsed, xmlText, length=20):
+    # docx2python adds list markers and renders links as <a> tags, so only the end of the text is compared
+    parsed = "".join(TAG.sub("", parsed).split())
+    xmlText = "".join(xmlText.split())
+    return bool(xmlText) and parsed[-length:] == xmlText[-length:]
+
+
+def rewriteMember(docPath, member, data):
+    """Replace one file inside a docx (zip) without extracting the rest to disk
+
+    :param docPath: The word doc
+    :param member: Name of the file within it, e.g. word/document.xml
+    :param data: New contents, as bytes
+    :returns: None
+    :rtype: NoneType
+
+    """
+    temp = f"{docPath}.tmp"
+    with zipfile.ZipFile(docPath) as source, zipfile.ZipFile(temp, "w") as target:
+        for info in source.infolist():
+            target.writestr(info, data if info.filename == member else source.read(info))
+    replace(temp, docPath)
+
+
+@tracing.traced()
+def formatDocx(docPath, paragraphs=None):
+    """Autoformat a resolution in place: fix the punctuation at the end of every operative clause, editing document.xml directly
+
+    :param docPath: Path to the word doc
+    :param paragraphs: The document's lines, if already parsed (e.g. by paragraph_cache), in flatten(asArr(docPath)) order
+    :returns: The number of paragraphs actually changed. 0 (and the file left alone) if nothing needed changing, or if the document's
+        paragraphs couldn't be matched up safely
+    :rtype: Integer
+
+    """
+    if paragraphs is None:
+        paragraphs = list(flatten(asArr(docPath)))
+    changes = Clause.fromFormattedDocArr(paragraphs).format()
+    if not changes:
+        return 0
+    with zipfile.ZipFile(docPath) as z:
+        xml = z.read("word/document.xml").decode()
+    pieces = []
+    position = 0
+    applied = 0  # Changes to paragraphs the XML hasn't got, or which were already right, don't count
+    for index, match in enumerate(PARAGRAPH.finditer(xml)):
+        if index not in changes:
+            continue
+        if index >= len(paragraphs) or not sameEnding(paragraphs[index], paragraphText(match.group(0))):
+            # docx2python and the XML disagree on which paragraph is which (text boxes, nested tables, ...). Better unformatted than mangled
+            return 0
+        punctuated = punctuateParagraph(match.group(0), changes[index])
+        applied += punctuated != match.group(0)
+        pieces += [xml[position : match.start()], punctuated]
+        position = match.end()
+    if not applied:
+        return 0
+    pieces.append(xml[position:])
+    rewriteMember(docPath, "word/document.xml", "".join(pieces).encode())
+    return applied
 
-# TODO: Write a tree to a word doc somehow.
 
 # NOTE: Should consider using the 1) a) i) system to find lists, as well as simply indentation. Perhaps combine both and come up with a nice heuristic.
 # NOTE: It seems periods are only for the very last element.
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# A bounded pool of HTTP connections per Drive account, so several threads can talk to the drive at once.
+# pydrive2 makes each request on whatever httplib2 connection is bound to the calling thread (creating one per thread if there isn't),
+# so checking a client out binds one of the pool's connections to the thread until it's checked back in: everything pydrive2 does
+# in between, GetContentFile and Upload included, goes over that connection and reuses its keep-alive socket. All of an account's
+# connections share its credentials, and a token refresh happens once, under a lock, however many threads hit the expiry at once.
+import queue
+import threading
+from contextlib import contextmanager
+
+import config_service
+
+POOL_SIZE = 8  # Connections per account. Overridden by "drive-connections" in config.json
+
+pools = {}  # id(GoogleAuth) -> DrivePool
+poolsLock = threading.Lock()
+
+
+def shareRefresh(credentials):
+    """Make concurrent token refreshes on these credentials happen once: a thread that waited for another's refresh uses its token
+
+    :param credentials: oauth2client credentials, as pydrive2's GoogleAuth holds them
+    :returns: None
+    :rtype: NoneType
+
+    """
+    if credentials is None or getattr(credentials, "pymunShared", False):
+        return
+    refresh = credentials._refresh
+    lock = threading.Lock()
+
+    def refreshOnce(request):
+        token = credentials.access_token
+        with lock:
+            if credentials.access_token == token:
+                refresh(request)
+
+    credentials._refresh = refreshOnce
+    credentials.pymunShared = True
+
+
+class DrivePool:
+    """The connections to one account's drive. Connections are made as they're first needed, up to size; after that a thread
+    waits for one to be checked back in. The most recently used is handed out first, as its socket is the likeliest to still be open"""
+
+    def __init__(self, drive, size=POOL_SIZE):
+        self.drive = drive
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.made = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()  # The connection each thread has checked out, if any
+
+    def take(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.made < self.size:
+                self.made += 1
+                return self.drive.auth.Get_Http_Object()
+        return self.idle.get()
+
+    @contextmanager
+    def client(self):
+        """Check out a connection for the current thread
+
+        :returns: Context manager giving the pool's GoogleDrive, whose requests from this thread go over the checked-out connection
+        :rtype: contextmanager
+
+        """
+        auth = self.drive.auth
+        if getattr(self.local, "http", None) is not None:
+            # Already checked out further up this thread's stack
+            yield self.drive
+            return
+        shareRefresh(auth.credentials)
+        http = self.take()
+        previous = getattr(auth.thread_local, "http", None)
+        self.local.http = auth.thread_local.http = http
+        try:
+            yield self.drive
+        finally:
+            self.local.http = None
+            auth.thread_local.http = previous
+            self.idle.put(http)
+
+
+def configuredSize(configFile="config.json"):
+    try:
+        return int(config_service.current(configFile).get("drive-connections", POOL_SIZE))
+    except (TypeError, ValueError):
+        return POOL_SIZE
+
+
+def poolFor(drive):
+    """The pool for a drive's account, made the first time it's asked for
+
+    :param drive: An authorised GoogleDrive
+    :returns: Its account's pool
+    :rtype: DrivePool
+
+    """
+    with poolsLock:
+        key = id(drive.auth)
+        if key not in pools:
+            pools[key] = DrivePool(drive, configuredSize())
+        return pools[key]
+
+
+def client(drive):
+    """Check out a connection to a drive for the current thread, e.g. `with client(drive) as pooled: listFiles(folder, pooled)`
+
+    :param drive: An authorised GoogleDrive
+    :returns: Context manager giving a GoogleDrive to use on this thread
+    :rtype: contextmanager
+
+    """
+    return poolFor(drive).client()
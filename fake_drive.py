@@ -0,0 +1,629 @@
+#! /usr/bin/env python
+# A local stand-in for the bits of the Drive v2 API that pydrive2 (and so gdrive_tools) uses, for load testing without a real Google account.
+# Files live in memory. Latency, random errors and 403 rate limiting can be switched on to see how the scheduler copes.
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+GDOC_MIME = "application/vnd.google-apps.document"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Query language -----------------------------------------------------------------
+# Enough of https://developers.google.com/drive/api/v2/ref-search-terms for the queries we send.
+
+TOKEN = re.compile(
+    r"\s*(?:(?P<string>'(?:[^'\\]|\\.)*')|(?P<op>!=|<=|>=|=|<|>|[(){}])|(?P<word>[\w.]+))"
+)
+
+
+def tokenize(query):
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN.match(query, position)
+        if not match:
+            raise ValueError(f"Invalid query near: {query[position:]}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        tokens.append((kind, value))
+    return tokens
+
+
+def fieldValue(item, field):
+    if field == "trashed":
+        return item.get("labels", {}).get("trashed", False)
+    if field == "starred":
+        return item.get("labels", {}).get("starred", False)
+    if field == "parents":
+        return [p["id"] for p in item.get("parents", [])]
+    if field == "fullText":
+        return f"{item.get('title', '')} {item.get('description', '')}"
+    return item.get(field, "")
+
+
+def literal(kind, value):
+    if kind == "string":
+        return value
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return float(value) if re.fullmatch(r"-?\d+(\.\d+)?", value) else value
+
+
+COMPARISONS = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class QueryParser:
+    """Recursive descent parser turning a Drive `q` string into a predicate over file metadata dicts"""
+
+    def __init__(self, query):
+        self.tokens = tokenize(query)
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def take(self, expected=None):
+        kind, value = self.peek()
+        if kind is None or (expected and value.lower() != expected):
+            raise ValueError(f"Expected {expected or 'token'}, found {value}")
+        self.i += 1
+        return kind, value
+
+    def isWord(self, word):
+        kind, value = self.peek()
+        return kind == "word" and value.lower() == word
+
+    def parse(self):
+        if not self.tokens:
+            return lambda item: True
+        predicate = self.expression()
+        if self.i != len(self.tokens):
+            raise ValueError(f"Unexpected {self.peek()[1]}")
+        return predicate
+
+    def expression(self):
+        terms = [self.conjunction()]
+        while self.isWord("or"):
+            self.take()
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else lambda item: any(t(item) for t in terms)
+
+    def conjunction(self):
+        terms = [self.unary()]
+        while self.isWord("and"):
+            self.take()
+            terms.append(self.unary())
+        return terms[0] if len(terms) == 1 else lambda item: all(t(item) for t in terms)
+
+    def unary(self):
+        if self.isWord("not"):
+            self.take()
+            inner = self.unary()
+            return lambda item: not inner(item)
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if value == "(":
+            inner = self.expression()
+            self.take(")")
+            return inner
+        if kind == "string":
+            # 'id' in parents
+            self.take("in")
+            field = self.take()[1]
+            return lambda item: value in fieldValue(item, field)
+        if value in ("properties", "appProperties") and self.isWord("has"):
+            self.take()
+            return self.propertyClause()
+        op = self.take()[1]
+        target = literal(*self.take())
+        if op.lower() == "contains":
+            return lambda item: str(target).lower() in str(fieldValue(item, value)).lower()
+        compare = COMPARISONS[op]
+        return lambda item: compare(fieldValue(item, value), target)
+
+    def propertyClause(self):
+        # properties has { key='k' and value='v' and visibility='PRIVATE' }
+        self.take("{")
+        wanted = {}
+        while True:
+            name = self.take()[1].lower()
+            self.take("=")
+            wanted[name] = literal(*self.take())
+            if self.isWord("and"):
+                self.take()
+                continue
+            break
+        self.take("}")
+
+        def matches(item):
+            return any(
+                all(prop.get(k, "PRIVATE" if k == "visibility" else None) == v for k, v in wanted.items())
+                for prop in item.get("properties", [])
+            )
+
+        return matches
+
+
+def compileQuery(query):
+    return QueryParser(query or "").parse()
+
+
+# Fake drive state -----------------------------------------------------------------
+
+
+def now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class FakeDrive:
+    """In-memory file store, with the same metadata shape Drive v2 returns"""
+
+    def __init__(self, baseUrl="http://127.0.0.1"):
+        self.baseUrl = baseUrl
+        self.lock = threading.RLock()
+        self.files = {"root": self.metadata({"id": "root", "title": "My Drive", "mimeType": FOLDER_MIME, "parents": []})}
+        self.content = {}
+        self.pages = {}
+        self.sessions = {}
+        self.queries = {}
+
+    def metadata(self, body, content=None, touch=True):
+        item = {
+            "kind": "drive#file",
+            "title": "Untitled",
+            "mimeType": "application/octet-stream",
+            "description": "",
+            "labels": {"trashed": False, "starred": False},
+            "parents": [{"kind": "drive#parentReference", "id": "root"}],
+            "properties": [],
+            **body,
+        }
+        item.setdefault("id", uuid.uuid4().hex[:28])
+        item["parents"] = [{"kind": "drive#parentReference", **p} for p in item["parents"]]
+        if touch or "modifiedDate" not in item:
+            item["modifiedDate"] = now()
+        item["version"] = str(int(item.get("version", 0)) + 1)
+        item["alternateLink"] = f"{self.baseUrl}/open?id={item['id']}"
+        if item["mimeType"] == GDOC_MIME:
+            item["exportLinks"] = {DOCX_MIME: f"{self.baseUrl}/drive/v2/files/{item['id']}/export?mimeType={DOCX_MIME}"}
+        if content is not None and item["mimeType"] != GDOC_MIME:  # Google Docs have neither a checksum nor a size
+            item["md5Checksum"] = hashlib.md5(content).hexdigest()
+            item["fileSize"] = str(len(content))
+        return item
+
+    def insert(self, body, content=None):
+        with self.lock:
+            item = self.metadata(body, content)
+            self.files[item["id"]] = item
+            if content is not None:
+                self.content[item["id"]] = content
+            return item
+
+    def update(self, fileId, body, content=None, touch=True):
+        with self.lock:
+            item = self.files[fileId]
+            merged = {**item, **body, "id": fileId}
+            if "properties" in body:
+                # Drive merges properties by key rather than replacing the list
+                props = {p["key"]: p for p in item.get("properties", [])}
+                props.update({p["key"]: p for p in body["properties"]})
+                merged["properties"] = [p for p in props.values() if p.get("value") is not None]
+            updated = self.metadata(merged, content, touch)
+            self.files[fileId] = updated
+            if content is not None:
+                self.content[fileId] = content
+            return updated
+
+    def list(self, query, maxResults=100, pageToken=None):
+        with self.lock:
+            if pageToken:
+                ids = self.pages[pageToken.split(":")[0]]
+                offset = int(pageToken.split(":")[1])
+            else:
+                if query not in self.queries:
+                    self.queries[query] = compileQuery(query)
+                predicate = self.queries[query]
+                ids = [k for k, v in self.files.items() if k != "root" and predicate(v)]
+                token = uuid.uuid4().hex[:12]
+                self.pages[token] = ids
+                pageToken, offset = token, 0
+            page = ids[offset : offset + maxResults]
+            result = {"kind": "drive#fileList", "items": [self.files[i] for i in page]}
+            if offset + maxResults < len(ids):
+                result["nextPageToken"] = f"{pageToken.split(':')[0]}:{offset + maxResults}"
+            return result
+
+    def makePath(self, folderpath):
+        """Create (or find) the folders in a unix style path, returning the innermost folder's ID"""
+        parent = "root"
+        for name in [i for i in folderpath.split("/") if i]:
+            existing = [
+                k for k, v in self.files.items()
+                if v["title"] == name and v["mimeType"] == FOLDER_MIME and parent in fieldValue(v, "parents")
+            ]
+            parent = existing[0] if existing else self.insert({"title": name, "mimeType": FOLDER_MIME, "parents": [{"id": parent}]})["id"]
+        return parent
+
+
+def contentPool(count=12, seed=0):
+    """Generate a small pool of realistic document bodies to share between seeded files
+
+    :param count: Number of distinct .docx bodies to generate
+    :param seed: Seed passed through to corpus_tools
+    :returns: Dict of {mimeType: [bytes, ...]}
+    :rtype: Dict
+
+    """
+    import tempfile
+
+    from corpus_tools import makeCorpus
+
+    with tempfile.TemporaryDirectory() as folder:
+        labels = makeCorpus(folder, count, seed=seed)  # With naked links, as real notes have, or they'd classify as unclassified
+        docs = []
+        for i in sorted(labels):
+            with open(i, "rb") as f:
+                docs.append(f.read())
+    pdf = b"%PDF-1.4\n1 0 obj << /Title (Report of the Secretary-General) >> endobj\ntrailer << /Info 1 0 R >>\n%%EOF\n"
+    html = b"<html><head><title>UN News</title></head><body><p>Article text</p></body></html>"
+    return {DOCX_MIME: docs, GDOC_MIME: docs, "application/pdf": [pdf], "text/html": [html]}
+
+
+def seedFiles(drive, count, folderpath="/MUN", classified=0.0, mix=None, seed=0):
+    """Fill the fake drive with synthetic files
+
+    :param drive: The FakeDrive to fill
+    :param count: Number of files
+    :param folderpath: The folder (created if needed) to put them in
+    :param classified: Fraction of files which already carry PyMUN metadata, so a tick skips them
+    :param mix: Dict of {mimeType: weight}; defaults to mostly word documents
+    :param seed: Seed for reproducible file mixes
+    :returns: The ID of the folder the files were put in
+    :rtype: String
+
+    """
+    rng = random.Random(seed)
+    mix = mix or {DOCX_MIME: 0.7, GDOC_MIME: 0.1, "application/pdf": 0.1, "text/html": 0.1}
+    pool = contentPool(seed=seed)
+    parent = drive.makePath(folderpath)
+    mimes, weights = zip(*mix.items())
+    for i in range(count):
+        mime = rng.choices(mimes, weights)[0]
+        done = rng.random() < classified
+        drive.insert(
+            {
+                "title": f"document-{i:06d}",
+                "mimeType": mime,
+                "parents": [{"id": parent}],
+                # As gdrive_tools.setMetadata writes it
+                "properties": [
+                    {"key": "type", "value": "unclassified", "visibility": "PRIVATE"},
+                    {"key": "pymun", "value": "1", "visibility": "PRIVATE"},
+                ]
+                if done
+                else [],
+            },
+            rng.choice(pool[mime]),
+        )
+    return parent
+
+
+# HTTP layer -----------------------------------------------------------------
+
+
+def errorBody(code, reason, message):
+    return json.dumps(
+        {"error": {"errors": [{"domain": "global", "reason": reason, "message": message}], "code": code, "message": message}}
+    ).encode()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.latencies = {}
+            self.faults = {"error": 0, "throttle": 0}
+            self.bytesOut = 0
+            self.bytesIn = 0
+
+    def record(self, method, seconds, bytesIn, bytesOut):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.latencies.setdefault(method, []).append(seconds)
+            self.bytesIn += bytesIn
+            self.bytesOut += bytesOut
+
+    def snapshot(self):
+        with self.lock:
+            everything = sorted(i for v in self.latencies.values() for i in v)
+
+            def pct(p):
+                return everything[min(len(everything) - 1, int(p * len(everything)))] if everything else 0
+
+            return {
+                "calls": dict(self.calls),
+                "total": sum(self.calls.values()),
+                "faults": dict(self.faults),
+                "bytesIn": self.bytesIn,
+                "bytesOut": self.bytesOut,
+                "latency": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "max": everything[-1] if everything else 0},
+            }
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, errorRate=0.0, throttleRate=0.0, seed=0):
+        super().__init__(address, FakeDriveHandler)
+        self.url = f"http://{self.server_address[0]}:{self.server_port}/"
+        self.drive = FakeDrive(self.url.rstrip("/"))
+        self.stats = Stats()
+        self.rng = random.Random(seed)
+        self.configure(latency=latency, errorRate=errorRate, throttleRate=throttleRate)
+
+    def configure(self, latency=None, errorRate=None, throttleRate=None):
+        """Change the fault injection settings: latency is the mean delay in seconds, rates are probabilities per request"""
+        if latency is not None:
+            self.latency = latency
+        if errorRate is not None:
+            self.errorRate = errorRate
+        if throttleRate is not None:
+            self.throttleRate = throttleRate
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_any("GET")
+
+    def do_POST(self):
+        self.handle_any("POST")
+
+    def do_PUT(self):
+        self.handle_any("PUT")
+
+    def do_PATCH(self):
+        self.handle_any("PATCH")
+
+    def do_DELETE(self):
+        self.handle_any("DELETE")
+
+    def handle_any(self, method):
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        server = self.server
+        if self.path.startswith("/_fake/"):
+            name, status, headers, payload = "control", *self.control(method, body)
+        else:
+            if server.latency:
+                time.sleep(server.rng.expovariate(1 / server.latency))
+            roll = server.rng.random()
+            if roll < server.throttleRate:
+                server.stats.faults["throttle"] += 1
+                name, status, headers, payload = "throttled", 403, {}, errorBody(403, "userRateLimitExceeded", "User Rate Limit Exceeded")
+            elif roll < server.throttleRate + server.errorRate:
+                server.stats.faults["error"] += 1
+                name, status, headers, payload = "failed", 500, {}, errorBody(500, "backendError", "Backend Error")
+            else:
+                name, status, headers, payload = dispatch(server.drive, method, self.path, self.headers, body)
+        self.send_response(status)
+        headers = {"Content-Type": "application/json; charset=UTF-8", **headers}
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if name != "control":
+            server.stats.record(name, time.perf_counter() - start, len(body), len(payload))
+
+    def control(self, method, body):
+        if self.path.startswith("/_fake/stats"):
+            return 200, {}, json.dumps(self.server.stats.snapshot()).encode()
+        if self.path.startswith("/_fake/reset"):
+            self.server.stats.reset()
+            return 200, {}, b"{}"
+        if self.path.startswith("/_fake/config"):
+            self.server.configure(**json.loads(body or b"{}"))
+            return 200, {}, b"{}"
+        if self.path.startswith("/_fake/seed"):
+            args = json.loads(body or b"{}")
+            folder = seedFiles(self.server.drive, **args)
+            return 200, {}, json.dumps({"folder": folder}).encode()
+        return 404, {}, errorBody(404, "notFound", "No such control endpoint")
+
+
+FILE_PATH = re.compile(r"^/(?P<upload>upload/)?drive/v2/files(?:/(?P<id>[^/?]+))?(?P<export>/export)?$")
+
+
+def dispatch(drive, method, rawPath, headers, body):
+    """Route a single API request (also used for each part of a batch)
+
+    :returns: (method name for stats, status, extra headers, body bytes)
+    :rtype: Tuple
+
+    """
+    url = urlsplit(rawPath)
+    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    if url.path.startswith("/batch"):
+        return ("batch", *batch(drive, headers, body))
+    if url.path.startswith("/upload/session/"):
+        return ("files.upload", *resumeUpload(drive, url.path.split("/")[-1], headers, body))
+    match = FILE_PATH.match(url.path)
+    if not match:
+        return "unknown", 404, {}, errorBody(404, "notFound", f"Unknown path {url.path}")
+    fileId = match.group("id")
+    if fileId and fileId not in drive.files:
+        return "files.get", 404, {}, errorBody(404, "notFound", f"File not found: {fileId}")
+    if method == "GET" and not fileId:
+        result = drive.list(params.get("q", ""), int(params.get("maxResults", 100)), params.get("pageToken"))
+        return "files.list", 200, {}, json.dumps(result).encode()
+    if method == "GET" and match.group("export"):
+        return "files.export", 200, {"Content-Type": params.get("mimeType", DOCX_MIME)}, drive.content.get(fileId, b"")
+    if method == "GET" and params.get("alt") == "media":
+        if drive.files[fileId]["mimeType"].startswith("application/vnd.google-apps."):
+            return "files.get_media", 403, {}, errorBody(403, "fileNotDownloadable", "Use Export with Docs Editors files")
+        return "files.get_media", 200, {"Content-Type": drive.files[fileId]["mimeType"]}, drive.content.get(fileId, b"")
+    if method == "GET":
+        return "files.get", 200, {}, json.dumps(drive.files[fileId]).encode()
+    if method == "DELETE":
+        with drive.lock:
+            drive.files.pop(fileId)
+            drive.content.pop(fileId, None)
+        return "files.delete", 204, {}, b""
+
+    name = {"POST": "files.insert", "PUT": "files.update", "PATCH": "files.patch"}[method]
+    touch = params.get("modifiedDateBehavior") != "noChange"
+    uploadType = params.get("uploadType")
+    if match.group("upload") and uploadType == "resumable":
+        session = uuid.uuid4().hex
+        drive.sessions[session] = {"fileId": fileId, "metadata": json.loads(body or b"{}"), "data": b"", "touch": touch}
+        location = f"http://{headers.get('Host')}/upload/session/{session}"
+        return name, 200, {"Location": location}, b""
+    content = None
+    metadata = json.loads(body or b"{}") if body and not uploadType else {}
+    if uploadType == "multipart":
+        metadata, content = multipartParts(headers, body)
+    elif uploadType == "media":
+        content = body
+    item = drive.update(fileId, metadata, content, touch) if fileId else drive.insert(metadata, content)
+    return name, 200, {}, json.dumps(item).encode()
+
+
+def multipartParts(headers, body):
+    message = BytesParser().parsebytes(
+        f"Content-Type: {headers.get('Content-Type')}\r\n\r\n".encode() + body
+    )
+    parts = message.get_payload()
+    metadata = json.loads(parts[0].get_payload(decode=True) or b"{}")
+    return metadata, parts[1].get_payload(decode=True) if len(parts) > 1 else None
+
+
+def resumeUpload(drive, session, headers, body):
+    # Content-Range: bytes <first>-<last>/<total>, or bytes */<total> to ask how far we got
+    state = drive.sessions.get(session)
+    if state is None:
+        return 404, {}, errorBody(404, "notFound", "Upload session expired")
+    match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", headers.get("Content-Range", ""))
+    total = headers.get("Content-Range", "").split("/")[-1]
+    if match:
+        first = int(match.group(1))
+        state["data"] = state["data"][:first] + body
+    if total != "*" and total and len(state["data"]) >= int(total):
+        del drive.sessions[session]
+        fileId = state["fileId"]
+        if fileId:
+            item = drive.update(fileId, state["metadata"], state["data"], state["touch"])
+        else:
+            item = drive.insert(state["metadata"], state["data"])
+        return 200, {}, json.dumps(item).encode()
+    received = len(state["data"])
+    return 308, ({"Range": f"bytes=0-{received - 1}"} if received else {}), b""
+
+
+def batch(drive, headers, body):
+    """Handle a multipart/mixed batch request, where each part is itself an HTTP request"""
+    message = BytesParser().parsebytes(f"Content-Type: {headers.get('Content-Type')}\r\n\r\n".encode() + body)
+    boundary = "batch_" + uuid.uuid4().hex
+    out = []
+    for part in message.get_payload():
+        raw = part.get_payload(decode=True)
+        head, _, partBody = raw.partition(b"\r\n\r\n")
+        lines = head.decode().split("\r\n")
+        method, target = lines[0].split(" ")[:2]
+        partHeaders = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+        path = urlsplit(target)
+        _, status, extra, payload = dispatch(drive, method, path.path + ("?" + path.query if path.query else ""), partHeaders, partBody)
+        response = f"HTTP/1.1 {status} OK\r\nContent-Type: application/json; charset=UTF-8\r\n"
+        response += "".join(f"{k}: {v}\r\n" for k, v in extra.items())
+        out.append(
+            f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{part.get('Content-ID', '').strip('<>')}>\r\n\r\n".encode()
+            + response.encode() + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload + b"\r\n"
+        )
+    return 200, {"Content-Type": f"multipart/mixed; boundary={boundary}"}, b"".join(out) + f"--{boundary}--\r\n".encode()
+
+
+# Client side -----------------------------------------------------------------
+
+
+def fakeDrive(url):
+    """Build a pydrive2 GoogleDrive which talks to a fake drive server instead of Google
+
+    :param url: Root URL of the server, e.g. FakeDriveServer().url
+    :returns: A GoogleDrive which can be passed anywhere gdrive_tools takes a drive
+    :rtype: pydrive2.drive.GoogleDrive object
+
+    """
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from oauth2client.client import AccessTokenCredentials
+    from pydrive2.auth import GoogleAuth
+    from pydrive2.drive import GoogleDrive
+
+    document = json.loads(get_static_doc("drive", "v2"))
+    document.update(rootUrl=url, mtlsRootUrl=url, baseUrl=url + document["servicePath"])
+    gauth = GoogleAuth(
+        settings={
+            "client_config_backend": "settings",
+            "client_config": {"client_id": "fake", "client_secret": "fake"},
+            "save_credentials": False,
+            "oauth_scope": ["https://www.googleapis.com/auth/drive"],
+        }
+    )
+    # The server is local, so never go through an HTTP proxy (benchmark.py sets one up for link fetches)
+    gauth._build_http = lambda: httplib2.Http(timeout=gauth.http_timeout, proxy_info=None)
+    gauth.credentials = AccessTokenCredentials("fake-token", "pymun-fake-drive")
+    gauth.service = build_from_document(document, http=gauth.Get_Http_Object())
+    return GoogleDrive(gauth)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake Google Drive v2 server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--files", type=int, default=100, help="Number of synthetic files to seed")
+    parser.add_argument("--folder", default="/MUN")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean added latency per request, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeDriveServer(("127.0.0.1", args.port), args.latency, args.error_rate, args.throttle_rate)
+    seedFiles(server.drive, args.files, args.folder)
+    print(f"Fake drive serving {args.files} files in {args.folder} at {server.url}")
+    server.serve_forever()
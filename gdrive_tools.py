@@ -1,14 +1,38 @@
 #! /usr/bin/env python
+import hashlib
 import json
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from pprint import pprint
 from threading import Timer
 
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
+from pydrive2.files import ApiRequestError
 from send2trash import send2trash
 
-from docx_tools import customClassify, magicParse, replaceLinks
+import drive_pool
+import job_queue
+import memory_budget
+import metrics
+import near_duplicates
+from docx_tools import customRules, formatDocx, replaceLinks, ruleType
+import paragraph_cache
+import rule_changes
+import search_index
+import tracing
+from profiling import PROFILE_DIR, profileRun
+
+GDOC_MIME = "application/vnd.google-apps.document"
+WORD_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+TYPE_FOLDERS = {"notes": "note"}  # docx_tools' heuristics say "notes", but the folder (like the config and the web UI) says "note"
 
 """
 metadata_format = {
@@ -21,17 +45,17 @@ metadata_format = {
 """
 
 
-def authorisedDrive():
+def authorisedDrive(settingsFile="settings.yaml"):
     """
 
+    :param settingsFile: The pydrive2 settings file, which says where the account's credentials are saved
     :returns: An authorised google drive object which can be used to interact with user's drive
     :rtype: pydrive2.drive.GoogleDrive object
 
     """
-    gauth = GoogleAuth()
-    return GoogleDrive(
-        gauth.LocalWebserverAuth()
-    )  # Creates local webserver and auto handles authentication.
+    gauth = GoogleAuth(settings_file=settingsFile)
+    gauth.LocalWebserverAuth()  # Creates local webserver and auto handles authentication.
+    return GoogleDrive(gauth)
 
 
 def deAuthorise():
@@ -43,7 +67,38 @@ def deAuthorise():
     send2trash("credentials.json")  # NOTE: Lazy as hell.
 
 
-mydrive = authorisedDrive()
+# Benchmarks and the fake drive server set PYMUN_OFFLINE, so importing this module doesn't kick off an OAuth flow
+mydrive = None if os.environ.get("PYMUN_OFFLINE") else authorisedDrive()
+drives = {}  # Settings file -> GoogleDrive, for folders in other accounts
+prepared = {}  # The folders the last tick worked on, as passed to runJobs, for the fast lane to use between ticks
+busy = threading.Lock()  # Held while this process works through the queue, so the fast lane doesn't start a second pass at it
+
+
+def accountDrive(settingsFile=None, drive=mydrive):
+    """The drive of the account a configured folder is in
+
+    :param settingsFile: The account's pydrive2 settings file, or None for the default account
+    :param drive: The default account's GoogleDrive object
+    :returns: An authorised GoogleDrive object
+    :rtype: pydrive2.drive.GoogleDrive object
+
+    """
+    if not settingsFile:
+        return drive
+    if settingsFile not in drives:
+        drives[settingsFile] = authorisedDrive(settingsFile)
+    return drives[settingsFile]
+
+
+def configuredFolders(config):
+    """The folders to process: "folders" in config.json, each a path or {"path": ..., "account": pydrive2 settings file}, else "folderpath"
+
+    :param config: The parsed config.json
+    :returns: Dicts of path and (optionally) account
+    :rtype: List
+
+    """
+    return [i if isinstance(i, dict) else {"path": i} for i in config.get("folders") or [config["folderpath"]]]
 
 
 def getFile(filename, drive=mydrive):
@@ -60,7 +115,8 @@ def getFile(filename, drive=mydrive):
         "q": f"title contains '{filename}' and trashed = False"
         # "maxresults": 3,
     }
-    files = drive.ListFile(queryParams).GetList()
+    with metrics.apiCall("files.list"):
+        files = drive.ListFile(queryParams).GetList()
     return files[0]
 
 
@@ -78,7 +134,8 @@ def getAllFiles(filename, drive=mydrive):
         "q": f"title contains '{filename}' and trashed = False"
         # "maxresults": 3,
     }
-    files = drive.ListFile(queryParams).GetList()
+    with metrics.apiCall("files.list"):
+        files = drive.ListFile(queryParams).GetList()
     return files
 
 
@@ -97,15 +154,17 @@ def getExistingFolder(filename, parentId, drive=mydrive):
         "q": f"title='{filename}' and mimeType='application/vnd.google-apps.folder' and '{parentId}' in parents and trashed = False"
         # "maxresults": 3,
     }
-    files = drive.ListFile(queryParams).GetList()
+    with metrics.apiCall("files.list"):
+        files = drive.ListFile(queryParams).GetList()
     return files[0] if files else False
 
 
-def downloadHelper(fileObj, appname="pyMUN"):
+def downloadHelper(fileObj, appname="pyMUN", drive=None):
     """A wrapper function that downloads a google drive file locally, saves it to the right path, and returns some useful data about the file
 
     :param fileObj: The DriveFile object to download
     :param appname: The name of the subfolder in which to store the document
+    :param drive: A GoogleDrive whose pooled connection to download over (see drive_pool); otherwise this thread's own
     :returns: A dictionary with the path, id, name, and mimetype of the document
     :rtype: Dict
 
@@ -121,7 +180,13 @@ def downloadHelper(fileObj, appname="pyMUN"):
 
     # We assume that we actually have to download this, so the metadata check is already done
     path = f"{os.path.expanduser('~')}/tmp/{appname}/{fileObj['id']}.docx"
-    fileObj.GetContentFile(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Google docs can't be downloaded as-is, they have to be exported (otherwise pydrive2 exports them as plaintext)
+    with drive_pool.client(drive) if drive else nullcontext(), metrics.stage("download"), metrics.apiCall("files.get"):
+        fileObj.GetContentFile(
+            path,
+            mimetype=WORD_MIME if fileObj["mimeType"] == GDOC_MIME else None,
+        )
     return {
         "path": path,
         "id": fileObj["id"],
@@ -130,8 +195,26 @@ def downloadHelper(fileObj, appname="pyMUN"):
     }
 
 
-# We're using the description to store metadata as JSON, since I can't make the properties work.
-# Implies we have to insert some basic checks for corrupt data: If we face an err reading JSON we should just replace it and start over.
+# Metadata is stored as private (app-only) properties, which the drive can filter on, so a tick only lists the files it needs.
+# It used to be JSON in the description (which clobbered users' own descriptions); files still like that are migrated as they're seen.
+METADATA_VERSION = "1"  # Value of the "pymun" property every processed file carries
+MARKER = "pymun"
+# The revision (see paragraph_cache.revisionOf) our last upload left the file at. Kept on the file rather than only in this machine's
+# fingerprints, so whichever machine lists the file next can tell whether it's been edited since
+REVISION = "pymun-revision"
+PROPERTY_BYTES = 124  # Drive's limit on a property's key and value together
+TICK_FILE = f"{os.path.expanduser('~')}/tmp/pyMUN/ticks.json"
+TICK_OVERLAP = 300  # Seconds; files modified this long before the previous tick started are listed again, in case of clock skew
+# Scheduling: files modified in the last FRESH_MINUTES go in the job queue's fast lane, which the daemon polls for every
+# FAST_LANE_SECONDS. The backlog goes most recently modified first, brought forward by these bonuses (in seconds of recency)
+FRESH_MINUTES = 10  # Overridden by "fresh-minutes" in config.json
+FAST_LANE_SECONDS = 20  # Overridden by "fast-lane-seconds"
+PRIORITY_TYPES = ("resolution", "position")  # Overridden by "priority-types": title rules giving these types bring a file forward
+HINT_BONUS = 86400
+SMALL_BONUS = 3600  # For the smallest files, tapering to nothing at SMALL_BYTES
+SMALL_BYTES = 1 << 20
+CHUNK_BYTES = 8 << 20  # Content bigger than this is uploaded in chunks of this size. Overridden by "upload-chunk-mb"
+UPLOAD_RETRIES = 5
 
 
 def makeDriveFile(localpath, drive=mydrive):
@@ -148,33 +231,84 @@ def makeDriveFile(localpath, drive=mydrive):
     return f
 
 
+def privateProperties(fileObj):
+    return {
+        i["key"]: i.get("value")
+        for i in fileObj.get("properties", [])
+        if i.get("visibility", "PRIVATE") == "PRIVATE" and i.get("value") is not None
+    }
+
+
+def legacyMetadata(fileObj):
+    """Metadata stored the old way, as JSON in the file's description
+
+    :param fileObj: The drive file to query
+    :returns: The metadata, or an empty dict if the description isn't ours
+    :rtype: Dict
+
+    """
+    try:
+        meta = json.loads(fileObj.get("description") or "")
+    except ValueError:
+        return dict()
+    return meta if isinstance(meta, dict) and "type" in meta else dict()
+
+
 def getMetadata(fileObj):
-    """Return the metadata we've set for the fileobject in it's 'description' section
+    """Return the metadata we've set for the fileobject in its properties (or, for files not yet migrated, its description)
 
     :param fileObj: The drive file to query
     :returns: Dict representing metadata, which may or may not be empty
     :rtype: dict
 
     """
-    try:
-        return json.loads(fileObj["description"])
-    except:
-        return dict()
+    properties = privateProperties(fileObj)
+    if MARKER in properties:
+        return {k: v for k, v in properties.items() if k not in (MARKER, REVISION)}
+    return legacyMetadata(fileObj)
+
+
+def metadataProperty(key, value):
+    # Values are cut down to fit Drive's size limit, without splitting a character
+    budget = PROPERTY_BYTES - len(key.encode())
+    value = None if value is None else str(value).encode()[:budget].decode(errors="ignore")
+    return {"key": key, "value": value, "visibility": "PRIVATE"}
 
 
 def setMetadata(fileObj, dataDict):
-    """Sets the description attr of the google drive file to a json dump of the dataDict. Used as our personal metadata store, overwriting existing metadata.
+    """Sets the file's private properties to the dataDict. Used as our personal metadata store, overwriting existing metadata.
 
     :param fileObj: The drive file who's metadata we want to set
     :param dataDict: The metadata we want to declare, in the form of a dictionary
-    :returns: A file object with that metadata(description) added on
+    :returns: A file object with that metadata added on
     :rtype: DriveFile object
 
     """
-    fileObj["description"] = json.dumps(dataDict)
+    # Drive merges properties by key, so keys we no longer have are sent with no value to delete them
+    stale = [k for k in privateProperties(fileObj) if k not in dataDict and k not in (MARKER, REVISION)]
+    fileObj["properties"] = [metadataProperty(k, v) for k, v in dataDict.items()] + [
+        metadataProperty(k, None) for k in stale
+    ] + [metadataProperty(MARKER, METADATA_VERSION)]
+    if legacyMetadata(fileObj):
+        # The description was only ever our JSON, so give it back to the user
+        fileObj["description"] = ""
     return fileObj
 
 
+def migrateMetadata(fileObj):
+    """Move metadata from the description JSON into properties
+
+    :param fileObj: The drive file
+    :returns: The file with its metadata moved (to be uploaded), or None if there was nothing to migrate
+    :rtype: DriveFile object or NoneType
+
+    """
+    if MARKER in privateProperties(fileObj):
+        return None
+    meta = legacyMetadata(fileObj)
+    return setMetadata(fileObj, meta) if meta else None
+
+
 # We might have to perform several functions on a doc before uploading it. So it makes more sense to return than to upload, for performance
 
 
@@ -222,6 +356,8 @@ def createLink(fileObj, folderObj, drive=mydrive):
     :rtype: DriveFile object
 
     """
+    if any(i["id"] == folderObj["id"] for i in fileObj["parents"]):
+        return fileObj  # Already there, e.g. a file that's been edited and re-processed
     fileObj["parents"].append(
         {
             "kind": "drive#parentReference",
@@ -307,10 +443,14 @@ def classifyFile(fileObj):
     return "unclassified"
 
 
-def updateMetadata(fileObj):
+def updateMetadata(fileObj, autoformat=False, threshold=paragraph_cache.THRESHOLD, localMeta=None):
     """Download and parse the file to identify the type, etc. and then update the fileObj with the requisite metadata, and with the links replaced
 
     :param fileObj: The file object to download and analyse
+    :param autoformat: Whether to fix the clause punctuation of resolutions before they're re-uploaded
+    :param threshold: Fraction of paragraphs which must have changed since the last revision before an edited document is re-classified
+    :param localMeta: What downloadHelper returned, if the file's already downloaded. The caller then owns the local copy and deletes it,
+        and "rewritten" is set in it to whether the local copy was changed (and is to be uploaded)
     :returns: A drive file with the requisite metadata added onto it
     :rtype: DriveFile object
 
@@ -320,21 +460,77 @@ def updateMetadata(fileObj):
     filetype = mimeToName(mime)
     result = {"filetype": filetype}  # DONE: Fill out in requisite format
     # Download google doc via downloadHelper
-    localMeta = downloadHelper(fileObj)
-    replaceLinks(localMeta["path"])
-    fileObj.SetContentFile(localMeta["path"])
-    if filetype in ("gdoc", "word"):
-        # Do the docx parsing magic on that doc, convert the return values into metadata.
-        result.update(
-            magicParse(localMeta["path"])
-        )  # DONE Should get type, agenda, committee, country
-        custom = customClassify(localMeta["name"], localMeta["path"])
-        if custom:
-            result.update({"type": custom})
-        # Overwrite if a custom rule takes precedence
-    else:
-        result.update({"type": classifyFile(fileObj)})
-    send2trash(localMeta["path"])
+    with metrics.tracking(fileObj["id"]), tracing.span(fileObj["title"], "file"):
+        downloaded = localMeta is None
+        if downloaded:
+            localMeta = downloadHelper(fileObj)
+        if filetype in ("gdoc", "word"):
+            # Only the paragraphs that changed since the file's last revision are parsed; the rest come from its fingerprint
+            with metrics.stage("parse"):
+                record, lines, changed = paragraph_cache.parseDocument(
+                    localMeta["path"], paragraph_cache.loadFingerprint(fileObj["id"])
+                )
+            # A copy of a document we've already classified takes its metadata and link table from that one
+            with metrics.stage("dedup"):
+                signature = near_duplicates.signature(record["texts"])
+                original = near_duplicates.findDuplicate(signature, exclude=fileObj["id"])
+            # Only word documents can be unzipped and have their links rewritten. Links rewritten last time don't count
+            links = {}
+            rewritten = False
+            if any(record["naked"]):
+                with metrics.stage("link-rewrite"):
+                    links, rewritten = replaceLinks(localMeta["path"], original["links"] if original else None)
+                if rewritten:
+                    with metrics.stage("parse"):
+                        record, lines, _ = paragraph_cache.parseDocument(localMeta["path"], record)
+            with metrics.stage("classify"):
+                previous = record["result"]
+                if original and not previous:
+                    metrics.inc("pymun_duplicates_total")
+                    result.update({k: v for k, v in original["result"].items() if k != "filetype"})
+                    # The original's type before its custom rules (one may have matched its title, not this one's); this file's
+                    # own rules are applied below. Originals indexed before that was kept are classified afresh
+                    result["type"] = original["heuristic"] or paragraph_cache.classify(record, lines)["type"]
+                else:
+                    result.update(paragraph_cache.classify(record, lines))
+                if previous and changed <= threshold:
+                    # A small edit: keep the classification, just refresh the metadata
+                    result["type"] = previous["type"]
+                else:
+                    # What the heuristics (or the original) said, so custom rules can be re-applied later without the document
+                    record["heuristic"] = result["type"]
+                    custom = ruleType(customRules(), localMeta["name"], lambda: "\n".join(record["texts"]))
+                    if custom:
+                        result.update({"type": custom})
+                    # Overwrite if a custom rule takes precedence
+            if autoformat and result["type"] == "resolution":
+                with metrics.stage("format"):
+                    formatted = formatDocx(localMeta["path"], lines)
+                if formatted:
+                    rewritten = True
+                    with metrics.stage("parse"):
+                        record, lines, _ = paragraph_cache.parseDocument(localMeta["path"], record)
+            record["result"] = result
+            record["title"] = fileObj["title"]
+            paragraph_cache.saveFingerprint(fileObj["id"], record)
+            # Only once the file's final: SetContentFile opens it straight away. A document nothing was changed in just has its
+            # metadata updated, rather than the same content uploaded again (and a Google Doc converted to a word one)
+            if rewritten:
+                fileObj.SetContentFile(localMeta["path"])
+            localMeta["rewritten"] = rewritten
+            text = "\n".join(record["texts"])
+        else:
+            with metrics.stage("classify"):
+                result.update({"type": classifyFile(fileObj)})
+            text = ""  # Only the title is searchable
+        with metrics.stage("index"):
+            search_index.indexDocument(fileObj["id"], fileObj["title"], result, text, fileObj.get("alternateLink"))
+            if filetype in ("gdoc", "word"):
+                near_duplicates.addDocument(
+                    fileObj["id"], fileObj["title"], signature, result, links, original, record.get("heuristic")
+                )
+        if downloaded:
+            send2trash(localMeta["path"])
     return addMetadata(fileObj, result)
 
 
@@ -361,7 +557,8 @@ def getChild(name, parentId, drive=mydrive):
     queryParams = {
         "q": f"title = '{name}' and '{parentId}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed=False",
     }
-    files = drive.ListFile(queryParams).GetList()
+    with metrics.apiCall("files.list"):
+        files = drive.ListFile(queryParams).GetList()
     return files[0]
 
 
@@ -386,50 +583,115 @@ def getMainFolder(path, drive=mydrive):
 
 
 def createTypeFolders(
-    root, types=("source", "note", "position", "resolution", "unclassified")
+    root,
+    types=("source", "note", "position", "resolution", "unclassified"),
+    drive=mydrive,
 ):
     """Creates the folders to store/sort different kinds of documents
 
     :param root: The ID of the folder in which these new folders should be created
     :param types: A tuple/list of document types, for which folders should be created
+    :param drive: The GoogleDrive object in which to create them
     :returns: A dictionary where keys are the types, and the vals are the folders which represent those types
     :rtype: dict (keys=strings, vals=DriveFile objects)
 
     """
-    folders = [createFolder(i, root) for i in types]
+    folders = [createFolder(i, root, drive) for i in types]
     for i in folders:
-        i.Upload()
+        with metrics.apiCall("files.update"):
+            i.Upload()
 
     return dict(zip(types, folders))
 
 
-def listFiles(root, drive=mydrive):
-    """Like ls for google drive, lists all the children of a given folder.
+def quote(value):
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def propertyClause(key, value):
+    return f"properties has {{ key={quote(key)} and value={quote(metadataProperty(key, value)['value'])} and visibility='PRIVATE' }}"
+
+
+def listFiles(root, drive=mydrive, filters=None, processed=None, modifiedSince=None):
+    """Like ls for google drive, lists all the children of a given folder. Filters are done by the drive, so only matching files are sent
 
     :param root: The folder object in question
     :param drive: GoogleDrive object
+    :param filters: Dict of metadata the files must have, e.g. {"type": "resolution", "committee": "..."}
+    :param processed: True for only files we've processed, False for only ones we haven't, None for either
+    :param modifiedSince: With processed=False, also include processed files modified after this RFC 3339 timestamp. Otherwise, only
+        files modified after it
     :returns: A list of files, all of which are children of the specified root
     :rtype: List (elems=DriveFile objects)
 
     """
-    queryParams = {
-        "q": f"'{root['id']}' in parents and mimeType != 'application/vnd.google-apps.folder' and trashed=False",
-    }
-    files = drive.ListFile(queryParams).GetList()
+    clauses = [f"'{root['id']}' in parents", "mimeType != 'application/vnd.google-apps.folder'", "trashed=False"]
+    clauses += [propertyClause(k, v) for k, v in (filters or {}).items()]
+    marked = propertyClause(MARKER, METADATA_VERSION)
+    if processed:
+        clauses.append(marked)
+    elif processed is False:
+        clauses.append(f"(not {marked} or modifiedDate > {quote(modifiedSince)})" if modifiedSince else f"not {marked}")
+    elif modifiedSince:
+        clauses.append(f"modifiedDate > {quote(modifiedSince)}")
+    queryParams = {"q": " and ".join(clauses)}
+    with metrics.stage("list"), metrics.apiCall("files.list"):
+        files = drive.ListFile(queryParams).GetList()
     return files
 
 
-def updateAllMetadata(files):
-    """Analyse all the files given, and update their metadata accordingly
+def isUnedited(fileObj):
+    """Whether a processed file is still at the revision our last upload left it at
+
+    :param fileObj: The drive file
+    :returns: False if it's been edited since it was processed
+    :rtype: Boolean
+
+    """
+    revision = privateProperties(fileObj).get(REVISION)
+    if revision is None:
+        return paragraph_cache.isCurrent(fileObj)  # Processed before the revision was kept on the file
+    return revision == paragraph_cache.revisionOf(fileObj)
+
+
+def triageFiles(files):
+    """Split files into those which need analysing, and those which are already classified (migrating any old-style metadata)
+
+    :param files: Drive files
+    :returns: (files to analyse, already-classified files whose metadata was migrated and need uploading)
+    :rtype: Tuple of lists
+
+    """
+    toUpdate = []
+    migrated = []
+    for i in files:
+        known = bool(getMetadata(i)) and isUnedited(i)
+        metrics.cacheLookup("metadata", known)
+        if not known:
+            toUpdate.append(i)
+        elif migrateMetadata(i):
+            migrated.append(i)  # Only needs its metadata moved out of the description
+    return toUpdate, migrated
+
+
+def updateAllMetadata(files, autoformat=False, threshold=paragraph_cache.THRESHOLD):
+    """Analyse all the files given (new ones, and ones edited since they were last processed), and update their metadata accordingly
 
     :param files: The list of files to download and analyse
+    :param autoformat: Passed on to updateMetadata
+    :param threshold: Passed on to updateMetadata
     :returns: A list of file objects with updated metadata
     :rtype: List (elems=DriveFile objects)
 
     """
     # File list is optional param, so we can update selective files if we have to. For instance, only add the metadata we have to, and only sort those rather than the whole list
-    toUpdate = [i for i in files if not getMetadata(i)]
-    return [updateMetadata(i) for i in toUpdate]
+    toUpdate, updated = triageFiles(files)
+    for n, i in enumerate(toUpdate):
+        metrics.setGauge("pymun_queue_depth", len(toUpdate) - n, queue="metadata")
+        updated.append(updateMetadata(i, autoformat, threshold))
+        metrics.dump()
+    metrics.setGauge("pymun_queue_depth", 0, queue="metadata")
+    return updated
 
 
 def sortIntoFolder(fileObj, types):
@@ -443,7 +705,11 @@ def sortIntoFolder(fileObj, types):
     """
     # Non-destructive. It adds to the list of parents, but does not replace anything.
     meta = getMetadata(fileObj)
-    doctype = meta["type"]
+    doctype = TYPE_FOLDERS.get(meta["type"], meta["type"])
+    # Out of the folder of any type it used to have (it's been re-classified)
+    others = {i["id"] for k, i in types.items() if k != doctype}
+    if any(i["id"] in others for i in fileObj["parents"]):
+        fileObj["parents"] = [i for i in fileObj["parents"] if i["id"] not in others]
     return createLink(fileObj, types[doctype])
 
 
@@ -459,6 +725,68 @@ def sortAllFiles(files, types):
     return [sortIntoFolder(i, types) for i in files]
 
 
+def reclassifyFile(fileId, record, newType, folders, slowSeconds=30):
+    """Give an already-classified file the type the custom rules now say, and upload its metadata. Its fingerprint (which
+    pendingChanges compares the new type against) is only updated once the upload's gone through, so a failed upload is retried
+
+    :param fileId: The drive ID of the file
+    :param record: Its fingerprint, as returned by paragraph_cache.loadFingerprint
+    :param newType: The type the rules now give it
+    :param folders: {main folder ID: (main folder, its type folders, its account's GoogleDrive)}
+    :param slowSeconds: Uploads taking longer than this are logged as slow
+    :returns: Whether the file was updated (False if it's been deleted or trashed since)
+    :rtype: Boolean
+
+    """
+    # Files processed before the job queue existed can only have come from the one folder there was then
+    _, types, drive = folders.get(job_queue.folderOf(fileId)) or next(iter(folders.values()))
+    fileObj = drive.CreateFile({"id": fileId})
+    try:
+        with metrics.apiCall("files.get"):
+            fileObj.FetchMetadata()
+    except ApiRequestError:
+        return False  # Deleted since it was classified
+    if fileObj.get("labels", {}).get("trashed"):
+        return False
+    record["result"]["type"] = newType
+    uploadFile(sortIntoFolder(addMetadata(fileObj, record["result"]), types), slowSeconds)
+    record["revision"] = paragraph_cache.revisionOf(fileObj) or record.get("revision")
+    paragraph_cache.saveFingerprint(fileId, record)
+    search_index.indexDocument(fileId, fileObj["title"], record["result"], "\n".join(record["texts"]), fileObj.get("alternateLink"))
+    metrics.inc("pymun_reclassified_total")
+    return True
+
+
+def applyRuleChanges(rules, folders, slowSeconds=30):
+    """Re-apply custom rules which changed since they were last applied, to the already-classified files they affect. The files'
+    text comes from their stored fingerprints, so nothing is downloaded: only the metadata of files whose type changes is fetched.
+    A file that can't be updated is logged and skipped, and the rules aren't marked as applied, so it's tried again next tick
+
+    :param rules: The custom rules now in config.json
+    :param folders: {main folder ID: (main folder, its type folders, its account's GoogleDrive)}
+    :param slowSeconds: Uploads taking longer than this are logged as slow
+    :returns: Whether every affected file was updated, so the rules can be saved as applied
+    :rtype: Boolean
+
+    """
+    applied = rule_changes.appliedRules()
+    if rules == applied:
+        return True
+    with metrics.stage("reclassify"):
+        pending = rule_changes.pendingChanges(rules, rule_changes.changedRules(applied, rules))
+    failed = 0
+    for n, (fileId, (record, newType)) in enumerate(pending.items()):
+        metrics.setGauge("pymun_queue_depth", len(pending) - n, queue="upload")
+        try:
+            reclassifyFile(fileId, record, newType, folders, slowSeconds)
+        except Exception as e:  # One file mustn't stop the rest, nor the tick
+            print(f"Couldn't re-apply the rules to {fileId}: {type(e).__name__}: {e}")
+            metrics.inc("pymun_reclassify_failures_total")
+            failed += 1
+    metrics.setGauge("pymun_queue_depth", 0, queue="upload")
+    return not failed
+
+
 # So far we only have 1 upload call in a function. This is good, since everything else simply returns. We can pretty easily slap on an upload() method call when we actually call the functions:
 """TODO:
 - Break an odt/odf document into a nice tree
@@ -471,33 +799,516 @@ Saving documents: Save it to ~/tmp/mundoc/<id>.odt. We'll use the ID as the uniq
 """
 
 
-def batchProcess(drive=mydrive):
-    """A single function that processes all files in the drive, sorts them, etc. as appropriate. Should be automatically run regularly
+def uploadContent(fileObj, chunkBytes=CHUNK_BYTES, retries=UPLOAD_RETRIES, param=None):
+    """Upload a file's changed metadata and content through a resumable upload session, a chunk at a time. A chunk that fails
+    (a 5xx, a 429, a dropped connection) is retried with backoff; before sending more, the client asks the session how much it
+    already has, so the upload carries on from there rather than from the start
 
-    :param drive: The drive object in which to look
+    :param fileObj: The drive file, with content set by SetContentFile
+    :param chunkBytes: Bytes per request, a multiple of 256 KiB
+    :param retries: Times in a row a chunk is retried before giving up
+    :param param: Further parameters for files.update, as for pydrive2's Upload
     :returns: None
     :rtype: NoneType
 
     """
-    mainFolder = json.load(open("config.json"))["folderpath"]
-    mainFolder = getMainFolder(mainFolder)
-    types = createTypeFolders(mainFolder["id"])
-    relevant = listFiles(mainFolder)
-    updated = updateAllMetadata(relevant)
-    sortedFiles = sortAllFiles(updated, types)
-    for i in sortedFiles:
-        i.Upload()
+    media = MediaIoBaseUpload(fileObj.content, fileObj["mimeType"], chunksize=chunkBytes, resumable=True)
+    request = fileObj.auth.service.files().update(
+        fileId=fileObj["id"], body=fileObj.GetChanges(), media_body=media, supportsAllDrives=True, **(param or {})
+    )
+    # The connection drive_pool has bound to this thread, if any
+    http = getattr(fileObj.auth.thread_local, "http", None) or fileObj.auth.Get_Http_Object()
+    # A resumable session answers each chunk with a 308, which httplib2 would otherwise follow as a redirect (googleapiclient's
+    # build_http does the same, but pydrive2 makes its own connections). Only for this upload: the connection may be a pooled one
+    redirects = http.redirect_codes
+    http.redirect_codes = redirects - {308}
+    try:
+        response = None
+        failures = 0
+        while response is None:
+            try:
+                # Retried here rather than by next_chunk, which would resend a chunk from a stream it has already read to the end
+                _, response = request.next_chunk(http=http)
+                failures = 0
+            except (HttpError, OSError) as e:
+                if isinstance(e, HttpError) and e.resp.status < 500 and e.resp.status != 429:
+                    raise ApiRequestError(e)
+                failures += 1
+                if failures > retries:
+                    raise ApiRequestError(e) if isinstance(e, HttpError) else e
+                metrics.inc("pymun_upload_resumes_total")
+                time.sleep(min(2**failures, 30))
+    finally:
+        http.redirect_codes = redirects
+    fileObj.uploaded = True
+    fileObj.dirty["content"] = False
+    fileObj.UpdateMetadata(response)
+
+
+def uploadedRevision(fileObj, content=None):
+    # The revision the file will be at once it's uploaded, so it can go up with it. Binary files' is the checksum of the content
+    # they'll have; Google Docs' is their modified date, which the upload is told to leave alone
+    if not fileObj.get("md5Checksum"):
+        return fileObj.get("modifiedDate"), {"modifiedDateBehavior": "noChange"}
+    if content is None:
+        return fileObj["md5Checksum"], None
+    digest = hashlib.md5()
+    for chunk in iter(lambda: content.read(1 << 20), b""):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest(), None
+
+
+def uploadFile(fileObj, slowSeconds=30, chunkBytes=CHUNK_BYTES):
+    # Content is only sent if SetContentFile was called since the last upload; otherwise it's a metadata-only patch
+    content = fileObj.content if fileObj.dirty["content"] else None
+    chunked = content is not None and content.seek(0, os.SEEK_END) > chunkBytes
+    if content is not None:
+        content.seek(0)
+    revision, param = uploadedRevision(fileObj, content)
+    if revision:
+        fileObj["properties"] = [i for i in fileObj.get("properties", []) if i["key"] != REVISION] + [
+            metadataProperty(REVISION, revision)
+        ]
+    with metrics.tracking(fileObj["id"]), metrics.stage("upload"), metrics.apiCall("files.update"):
+        if chunked:
+            uploadContent(fileObj, chunkBytes, param=param)
+        else:
+            fileObj.Upload(param)
+    metrics.inc("pymun_uploads_total", content="chunked" if chunked else "whole" if content is not None else "none")
+    # Our own upload is a new revision, so that's the one the fingerprint now describes
+    paragraph_cache.setRevision(fileObj["id"], paragraph_cache.revisionOf(fileObj))
+    metrics.finishFile(fileObj["id"], fileObj["title"], slowSeconds)
+
+
+def processJob(job, fileObj, types, config, worker):
+    """Take a queued file the rest of the way: download, classify, sort and upload it, checkpointing after each step so a crash
+    resumes from the last one. A checkpoint the worker no longer holds the lease for means another worker took the job over
+
+    :param job: As returned by job_queue.lease
+    :param fileObj: The job's drive file
+    :param types: A dict, as returned by createTypeFolders
+    :param config: The parsed config.json
+    :param worker: This worker's ID
+    :returns: Whether this worker finished the job
+    :rtype: Boolean
+
+    """
+    state = job["state"]
+    localPath = job["path"]
+    budget = memory_budget.configuredBudget(config)
+    size = memory_budget.sizeOf(fileObj)
+    if job["revision"] != paragraph_cache.revisionOf(fileObj) or not (localPath and os.path.exists(localPath)):
+        state = job_queue.STATES[0]  # Edited since, or the local copy's gone: from the top
+    if state == "discovered":
+        with metrics.tracking(fileObj["id"]), budget.stage("download", size):
+            localPath = downloadHelper(fileObj)["path"]
+        if not job_queue.checkpoint(fileObj["id"], worker, "downloaded", revision=job["revision"], path=localPath):
+            return False
+        state = "downloaded"
+    localMeta = {"path": localPath, "id": fileObj["id"], "name": fileObj["title"], "originalMime": fileObj["mimeType"]}
+    if state == "downloaded":
+        with budget.stage("parse", size):
+            fileObj = updateMetadata(
+                fileObj, config.get("autoformat", False), config.get("reparse-threshold", paragraph_cache.THRESHOLD), localMeta
+            )
+        checkpointed = job_queue.checkpoint(
+            fileObj["id"],
+            worker,
+            "classified",
+            revision=job["revision"],
+            result=getMetadata(fileObj),
+            rewritten=localMeta.get("rewritten", False),
+        )
+        if not checkpointed:
+            return False
+    else:
+        # Classified before the crash: the local copy is already the final one
+        fileObj = addMetadata(fileObj, job["result"])
+        if job["rewritten"] and mimeToName(getMimeType(fileObj)) in ("gdoc", "word"):
+            fileObj.SetContentFile(localPath)
+    if not job_queue.holds(fileObj["id"], worker, job["revision"]):
+        # Edited while it was being classified: the new revision's job starts from a fresh download and uploads that instead
+        send2trash(localPath)
+        return False
+    with budget.stage("upload", size):
+        uploadFile(
+            sortIntoFolder(fileObj, types), config.get("slow-file-seconds", 30), int(float(config.get("upload-chunk-mb", 8)) * (1 << 20))
+        )
+    written = job_queue.checkpoint(fileObj["id"], worker, "written", revision=job["revision"])
+    send2trash(localPath)
+    if not written:
+        return False
+    if job["lane"] == "fresh":
+        metrics.observe("pymun_fresh_latency_seconds", time.time() - driveTime(fileObj["modifiedDate"]))
+    return True
+
+
+def runJobs(folders, listed, config, worker, lanes=job_queue.LANES):
+    """Work through the job queue with "threads" (in config.json) threads, each a worker of its own sharing this process's pooled
+    drive connections
+
+    :param folders: {main folder ID: (main folder, its type folders, its account's GoogleDrive)}
+    :param listed: {file ID: drive file} for the files listed this tick, so those don't have to be fetched again
+    :param config: The parsed config.json
+    :param worker: This process's worker ID; threads after the first add their number to it
+    :param lanes: Which of the queue's lanes to work on
+    :returns: Number of files finished
+    :rtype: Integer
+
+    """
+    threads = int(config.get("threads", 1))
+    if threads <= 1:
+        return workJobs(folders, listed, config, worker, lanes)
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [
+            executor.submit(workJobs, folders, listed, config, f"{worker}:t{n}" if n else worker, lanes) for n in range(threads)
+        ]
+    return sum(i.result() for i in futures)
+
+
+def workJobs(folders, listed, config, worker, lanes=job_queue.LANES):
+    """Work through the job queue until there's nothing left this worker can claim, including jobs left over from earlier ticks
+    and ones other workers gave up. Between jobs, it polls for just-modified files, and hands back the rest of a backlog batch
+    as soon as there's a fast-lane job waiting
+
+    :param folders: {main folder ID: (main folder, its type folders, its account's GoogleDrive)}
+    :param listed: {file ID: drive file} for the files listed this tick, so those don't have to be fetched again
+    :param config: The parsed config.json
+    :param worker: This worker's ID
+    :param lanes: Which of the queue's lanes to work on
+    :returns: Number of files finished
+    :rtype: Integer
+
+    """
+    finished = 0
+    budget = memory_budget.configuredBudget(config)
+    while True:
+        listed.update(pollFresh(folders, config, worker))
+        jobs = job_queue.leaseBatch(worker, list(folders), config.get("batch-size", job_queue.BATCH), lanes=lanes)
+        if not jobs:
+            break
+        metrics.setGauge("pymun_queue_depth", sum(v for k, v in job_queue.counts().items() if k in job_queue.STATES[:-1]), queue="jobs")
+        for n, job in enumerate(jobs):
+            if n:
+                listed.update(pollFresh(folders, config, worker))
+                if job_queue.freshWaiting(list(folders)):
+                    job_queue.unlease(worker, [i["id"] for i in jobs[n:]])
+                    break
+            _, types, drive = folders[job["folder"]]
+            start = time.perf_counter()
+            done = False
+            fileObj = listed.get(job["id"])
+            metrics.startFile(job["id"])
+            try:
+                if fileObj is None:
+                    with drive_pool.client(drive) as pooled:
+                        fileObj = pooled.CreateFile({"id": job["id"]})
+                        try:
+                            with metrics.apiCall("files.get"):
+                                fileObj.FetchMetadata()
+                        except ApiRequestError:
+                            job_queue.forget(job["id"])  # Deleted since it was queued
+                            continue
+                # Waits for room in the budget before checking out a connection, so a held-back thread isn't holding one too
+                with budget.admit(memory_budget.sizeOf(fileObj)), drive_pool.client(drive):
+                    done = processJob(job, fileObj, types, config, worker)
+                finished += done
+            except Exception as e:  # Whatever a bad file does, it mustn't stop the rest; it's retried, then quarantined
+                job_queue.fail(job["id"], worker, f"{type(e).__name__}: {e}")
+                metrics.inc("pymun_job_failures_total")
+            finally:
+                # A file that failed (or was given up to another worker) never reaches finishFile
+                metrics.dropFile(job["id"])
+                job_queue.recordWork(worker, time.perf_counter() - start, done)
+                # Keeps the rest of the batch's leases from running out while this one was worked on
+                job_queue.heartbeat(worker)
+            metrics.dump()
+    metrics.setGauge("pymun_queue_depth", 0, queue="jobs")
+    return finished
+
+
+def driveTime(value):
+    # Drive's RFC 3339 timestamps, as seconds since the epoch
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+def driveTimestamp(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def jobPriority(fileObj, rules, priorityTypes=PRIORITY_TYPES):
+    """Where a file goes in the backlog: its modified time, plus bonuses for a title rule giving it one of the priority types and
+    for being small (quick to do, so they don't wait behind a big one)
+
+    :param fileObj: The drive file
+    :param rules: The custom rules; only the title ones are used, since nothing's been downloaded yet
+    :param priorityTypes: Types whose files go first
+    :returns: Priority, higher first
+    :rtype: Float
+
+    """
+    priority = driveTime(fileObj["modifiedDate"])
+    if ruleType({"name": rules.get("name", []), "contains": []}, fileObj["title"], "") in priorityTypes:
+        priority += HINT_BONUS
+    # Google docs have no size until exported; they're usually small
+    size = int(fileObj.get("fileSize") or 0)
+    return priority + SMALL_BONUS * max(0, 1 - size / SMALL_BYTES)
+
+
+def queueFiles(files, folderId, config):
+    """Add files to the job queue, the ones modified in the last fresh-minutes in the fast lane
+
+    :param files: Drive files which need processing
+    :param folderId: Their main folder
+    :param config: The parsed config.json
+    :returns: None
+    :rtype: NoneType
+
+    """
+    freshAfter = time.time() - float(config.get("fresh-minutes", FRESH_MINUTES)) * 60
+    rules = customRules()
+    priorityTypes = config.get("priority-types", PRIORITY_TYPES)
+    lanes = {"fresh": [], "backlog": []}
+    for i in files:
+        lanes["fresh" if driveTime(i["modifiedDate"]) >= freshAfter else "backlog"].append(i)
+    for lane, queued in lanes.items():
+        job_queue.discover(queued, folderId, paragraph_cache.revisionOf, lambda f: jobPriority(f, rules, priorityTypes), lane)
+
+
+def pollFresh(folders, config, worker):
+    """The fast lane's quick look for files modified in the last few minutes, between the full listings of each tick. Each folder's
+    polled by one worker at a time, at most every fast-lane-seconds
+
+    :param folders: {main folder ID: (main folder, its type folders, its account's GoogleDrive)}
+    :param config: The parsed config.json
+    :param worker: This worker's ID
+    :returns: {file ID: drive file} of the files queued
+    :rtype: Dict
+
+    """
+    listed = {}
+    window = float(config.get("fresh-minutes", FRESH_MINUTES)) * 60
+    for folderId, (mainFolder, _, drive) in folders.items():
+        if not job_queue.claimListing(folderId, worker, float(config.get("fast-lane-seconds", FAST_LANE_SECONDS)), "polled"):
+            continue
+        since = driveTimestamp(datetime.now(timezone.utc) - timedelta(seconds=window))
+        # Only needs analysing files; ones whose metadata only needs migrating are left to the full listing
+        toUpdate, _ = triageFiles(listFiles(mainFolder, drive, modifiedSince=since))
+        queueFiles(toUpdate, folderId, config)
+        listed.update((i["id"], i) for i in toUpdate)
+    return listed
+
+
+def listFolder(mainFolder, types, config, drive=mydrive):
+    """List a folder's new and changed files, queue the ones that need processing, and upload the ones that only needed their
+    metadata migrating
+
+    :param mainFolder: The main folder
+    :param types: A dict, as returned by createTypeFolders
+    :param config: The parsed config.json
+    :param drive: GoogleDrive object
+    :returns: {file ID: drive file} of the files queued
+    :rtype: Dict
+
+    """
+    # Only new files and ones modified since the last tick are listed. The first tick lists everything, which migrates old metadata
+    started = datetime.now(timezone.utc)
+    since = lastTick(mainFolder["id"])
+    relevant = listFiles(mainFolder, drive, processed=False, modifiedSince=since) if since else listFiles(mainFolder, drive)
+    toUpdate, migrated = triageFiles(relevant)
+    queueFiles(toUpdate, mainFolder["id"], config)
+    for i in sortAllFiles(migrated, types):
+        uploadFile(i, config.get("slow-file-seconds", 30))
+    # Failed files stay queued, so the tick can move on without them
+    saveTick(mainFolder["id"], started)
+    return {i["id"]: i for i in toUpdate}
+
+
+def batchProcess(drive=mydrive, worker=None, primary=True):
+    """A single function that processes all files in the drive, sorts them, etc. as appropriate. Should be automatically run regularly.
+    Any number of workers can run it at once, sharing the job queue: each folder is listed by whichever gets to it first that tick
+
+    :param drive: The drive object in which to look (for folders without an account of their own)
+    :param worker: This worker's ID, job_queue.workerId() if not given
+    :param primary: Whether this is the machine's main worker, which also re-applies changed custom rules to the files it has processed
+    :returns: None
+    :rtype: NoneType
+
+    """
+    config = json.load(open("config.json"))
+    worker = worker or job_queue.workerId()
+    memory_budget.resetPeakRss()
+    # Read before any file is classified, so a rule added mid-tick is still re-applied next tick
+    rules = customRules()
+    folders = {}
+    listed = {}
+    for folder in configuredFolders(config):
+        folderDrive = accountDrive(folder.get("account"), drive)
+        mainFolder = getMainFolder(folder["path"], folderDrive)
+        types = createTypeFolders(mainFolder["id"], drive=folderDrive)
+        folders[mainFolder["id"]] = (mainFolder, types, folderDrive)
+        if job_queue.claimListing(mainFolder["id"], worker, float(config["delay"]) * 60):
+            listed.update(listFolder(mainFolder, types, config, folderDrive))
+    prepared.clear()
+    prepared.update(folders)
+    # Each file is committed to the queue, then uploaded as soon as it's done, so a crash only loses the file in hand
+    runJobs(folders, listed, config, worker)
+    if primary:
+        # The fingerprints the rules are re-applied from are this machine's, so every machine's main worker does its own
+        if applyRuleChanges(rules, folders, config.get("slow-file-seconds", 30)):
+            rule_changes.saveApplied(rules)
+    memory_budget.reportPeakRss(worker)
+    metrics.dump()
+
+
+def lastTick(folderId, tickFile=TICK_FILE):
+    """When the last complete tick over a folder started, less TICK_OVERLAP
+
+    :param folderId: The ID of the main folder
+    :param tickFile: Where tick times are kept
+    :returns: RFC 3339 timestamp, or None if the folder hasn't been processed before
+    :rtype: String or NoneType
+
+    """
+    try:
+        with open(tickFile) as f:
+            return json.load(f).get(folderId)
+    except (OSError, ValueError):
+        return None
+
+
+def saveTick(folderId, started, tickFile=TICK_FILE):
+    try:
+        with open(tickFile) as f:
+            ticks = json.load(f)
+    except (OSError, ValueError):
+        ticks = {}
+    ticks[folderId] = driveTimestamp(started - timedelta(seconds=TICK_OVERLAP))
+    os.makedirs(os.path.dirname(tickFile), exist_ok=True)
+    with open(tickFile + ".tmp", "w") as f:
+        json.dump(ticks, f)
+    os.replace(tickFile + ".tmp", tickFile)
+
+
+def runBatch(profile=None, trace=False, index=None):
+    """Run batchProcess once, optionally under the profiler and/or tracer
+
+    :param profile: None, "sample" or "cprofile"
+    :param trace: Whether to record a trace-event timeline of the run
+    :param index: Which of the machine's extra worker processes is running it (see workerMain), None for the main one
+    :returns: None
+    :rtype: NoneType
+
+    """
+    # Each process writes its own trace and profile, so workers ticking in the same second don't overwrite each other's
+    name = time.strftime("%Y%m%d-%H%M%S") + (f"-{index}" if index else "")
+
+    def run():
+        batchProcess(worker=job_queue.workerId(index), primary=index is None)
+
+    if trace:
+        tracing.start()
+    try:
+        if profile:
+            print(f"Profile written to {profileRun(run, profile, os.path.join(PROFILE_DIR, name))}")
+        else:
+            run()
+    finally:
+        if trace:
+            print(f"Trace written to {tracing.stop(os.path.join(tracing.TRACE_DIR, name + '.json'))}")
+
+
+def profileMode(config):
+    # "profile": true (or "sample") profiles every tick with the sampler, "cprofile" uses cProfile instead
+    profile = config.get("profile")
+    return ("cprofile" if profile == "cprofile" else "sample") if profile else None
 
 
 def main():
     # I think 'run every 30-60 minutes is a good median
-    seconds = json.load(open("config.json"))["delay"] * 60
-    batchProcess()
-    Timer(seconds, main).start()
+    config = json.load(open("config.json"))
+    seconds = float(config["delay"]) * 60
+    try:
+        with busy:
+            runBatch(profileMode(config), config.get("trace", False))
+    finally:
+        # A tick that fails (the drive unreachable, say) shouldn't stop the daemon for good
+        Timer(seconds, main).start()
+
+
+def fastLane():
+    """Between ticks, look for just-modified files and process them straight away rather than at the next tick. Skipped while a
+    tick's running, since that does the same between its jobs
+
+    :returns: None
+    :rtype: NoneType
+
+    """
+    config = json.load(open("config.json"))
+    try:
+        if prepared and busy.acquire(blocking=False):
+            try:
+                runJobs(prepared, {}, config, job_queue.workerId(), lanes=("fresh",))
+                metrics.dump()
+            finally:
+                busy.release()
+    finally:
+        # A drive error shouldn't stop the polling for good
+        Timer(float(config.get("fast-lane-seconds", FAST_LANE_SECONDS)), fastLane).start()
+
+
+def workerMain(index):
+    """The tick loop of one of this machine's extra worker processes, which share the job queue with the main one
+
+    :param index: Which extra worker this is, from 1
+    :returns: None
+    :rtype: NoneType
+
+    """
+    metrics.SNAPSHOT = metrics.SNAPSHOT.replace(".json", f"-{index}.json")  # The web UI shows the main worker's
+    config = json.load(open("config.json"))
+    try:
+        runBatch(profileMode(config), config.get("trace", False), index)
+    finally:
+        Timer(float(config["delay"]) * 60, workerMain, (index,)).start()
+
+
+def startWorkers(count):
+    # Spawned rather than forked, so each process authorises its own drive connection instead of sharing the parent's socket
+    context = multiprocessing.get_context("spawn")
+    for index in range(1, count):
+        context.Process(target=workerMain, args=(index,)).start()
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Classify and sort MUN documents in google drive")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="sample",
+        choices=("sample", "cprofile"),
+        help="Run a single profiled batch, write pstats/collapsed stacks to ~/tmp/pyMUN/profiles and exit",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Run a single batch, write a Perfetto/Chrome trace of it to ~/tmp/pyMUN/traces and exit",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes to run on this machine (default: \"workers\" in config.json, or 1)",
+    )
+    args = parser.parse_args()
+    if args.profile or args.trace:
+        runBatch(args.profile, args.trace)
+    else:
+        startWorkers(args.workers or json.load(open("config.json")).get("workers", 1))
+        main()
+        fastLane()
 # batchProcess()
 """
 DONE mainFolder is a slight issue, all the rest are manageable
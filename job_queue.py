@@ -0,0 +1,524 @@
+#! /usr/bin/env python
+# Durable work queue for batchProcess (SQLite), so a tick that dies halfway through picks up where it left off instead of starting over.
+# Every file that needs processing becomes a job, which moves through STATES as it goes: downloaded (the local copy is on disk),
+# classified (its metadata is worked out and the local copy is final), then written (uploaded, done). A worker leases one job at a time;
+# a lease that runs out (the worker crashed) makes the job available again, from its last checkpoint. Each lease counts as an attempt,
+# and a job that's been attempted too often is quarantined rather than crashing every tick: a new revision of the file releases it.
+# Several workers, on one machine or several sharing the queue file (see "queue-file" in config.json), can work through it together.
+# Jobs are split between the live workers by a hash of the file ID, folders take turns so a big backlog in one doesn't starve the others,
+# and each worker's throughput is kept in the workers table.
+# Within a folder, jobs go by priority (see gdrive_tools.jobPriority), and files modified in the last few minutes go in a fast lane,
+# which every worker serves before anything else and checks for between backlog jobs, so new documents aren't stuck behind a backfill.
+import json
+import socket
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+from os import getpid, kill, makedirs, path
+
+import config_service
+import metrics
+
+appname = "pyMUN"
+QUEUE_FILE = f"{path.expanduser('~')}/tmp/{appname}/jobs.sqlite3"
+STATES = ("discovered", "downloaded", "classified", "written")
+QUARANTINED = "quarantined"
+MAX_ATTEMPTS = 3  # Overridden by "max-attempts" in config.json
+LEASE_SECONDS = 600  # Renewed at every checkpoint, so this only needs to cover one step of one file
+RETRY_SECONDS = 300  # A failed job waits this long per attempt so far before it's retried, so it isn't retried straight away
+SHARDS = 64  # Jobs are hashed into this many shards, which are dealt out between however many workers are live
+BATCH = 8  # Jobs leased at a time, all from one folder
+WORKER_HISTORY = 7 * 86400  # Seconds a worker that's gone is still reported on
+LANES = ("fresh", "backlog")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    title TEXT,
+    revision TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    path TEXT,
+    result TEXT,
+    error TEXT,
+    updated REAL,
+    shard INTEGER NOT NULL DEFAULT 0,
+    priority REAL NOT NULL DEFAULT 0,
+    lane TEXT NOT NULL DEFAULT 'backlog',
+    rewritten INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(folder, state);
+CREATE TABLE IF NOT EXISTS folders (id TEXT PRIMARY KEY, listed REAL, served REAL, lister TEXT, polled REAL);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    started REAL,
+    heartbeat REAL,
+    files INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    busy REAL NOT NULL DEFAULT 0
+);
+"""
+COLUMNS = (
+    "id",
+    "folder",
+    "title",
+    "revision",
+    "state",
+    "attempts",
+    "worker",
+    "lease_until",
+    "path",
+    "result",
+    "error",
+    "updated",
+    "shard",
+    "priority",
+    "lane",
+    "rewritten",
+)
+# Columns added since the queue was first released: (table, column, definition), for queues created before them
+ADDED = (
+    ("jobs", "shard", "INTEGER NOT NULL DEFAULT 0"),
+    ("jobs", "priority", "REAL NOT NULL DEFAULT 0"),
+    ("jobs", "lane", "TEXT NOT NULL DEFAULT 'backlog'"),
+    ("folders", "polled", "REAL"),
+    ("jobs", "rewritten", "INTEGER NOT NULL DEFAULT 1"),
+)
+
+ready = set()  # Queue files whose schema has been created by this process
+
+
+def configuredQueue(configFile="config.json"):
+    # Workers on other machines share the queue by pointing "queue-file" at the same file on shared storage
+    return path.expanduser(config_service.current(configFile).get("queue-file", QUEUE_FILE))
+
+
+def shardOf(fileId):
+    return zlib.crc32(fileId.encode()) % SHARDS
+
+
+def connect(queueFile=None):
+    queueFile = queueFile or configuredQueue()
+    makedirs(path.dirname(queueFile), exist_ok=True)
+    # Autocommit: transactions are begun explicitly, IMMEDIATE where a read decides a write, so two workers can't lease the same job
+    db = sqlite3.connect(queueFile, timeout=30, isolation_level=None)
+    if queueFile not in ready:
+        # WAL's index lives in shared memory, which only processes on the one machine can share, so a queue on shared storage
+        # (any "queue-file") uses a rollback journal, which needs nothing but the file system's own locks
+        db.execute(f"PRAGMA journal_mode={'WAL' if queueFile == QUEUE_FILE else 'DELETE'}")
+        db.executescript(SCHEMA)
+        for table, column, definition in ADDED:
+            if column not in [i[1] for i in db.execute(f"PRAGMA table_info({table})")]:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                if column == "shard":
+                    db.create_function("shardOf", 1, shardOf)
+                    db.execute("UPDATE jobs SET shard = shardOf(id)")
+        ready.add(queueFile)
+    return db
+
+
+def workerId(index=None):
+    """This worker's ID: machine and process, plus which of the process's workers it is, if there are several"""
+    worker = f"{socket.gethostname()}:{getpid()}"
+    return worker if index is None else f"{worker}:{index}"
+
+
+def running(worker):
+    """Whether a worker on this machine is still alive, going by its process. Workers elsewhere are assumed to be
+
+    :param worker: As returned by workerId
+    :returns: False only if it's this machine's and its process has gone
+    :rtype: Boolean
+
+    """
+    host, pid = worker.split(":")[:2]
+    if host != socket.gethostname():
+        return True
+    try:
+        kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+def configuredAttempts(configFile="config.json"):
+    try:
+        return int(config_service.current(configFile).get("max-attempts", MAX_ATTEMPTS))
+    except (TypeError, ValueError):
+        return MAX_ATTEMPTS
+
+
+def toJob(row):
+    job = dict(zip(COLUMNS, row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def discover(files, folderId, revisionOf, priorityOf=None, lane="backlog", queueFile=None):
+    """Queue files which need processing. A file that's already queued keeps its place and checkpoint, unless it's been edited since,
+    in which case it starts again from scratch (and a quarantined file gets another chance)
+
+    :param files: The drive files
+    :param folderId: The main folder they're being processed for
+    :param revisionOf: Function giving a file's revision, e.g. paragraph_cache.revisionOf
+    :param priorityOf: Function giving a file's priority, higher first. All files are equal if not given
+    :param lane: One of LANES
+    :param queueFile: Path of the queue
+    :returns: Number of files queued, or re-queued because they changed
+    :rtype: Integer
+
+    """
+    count = 0
+    now = time.time()
+    with closing(connect(queueFile)) as db:
+        db.execute("BEGIN IMMEDIATE")
+        for fileObj in files:
+            revision = revisionOf(fileObj)
+            row = db.execute("SELECT revision, state FROM jobs WHERE id = ?", (fileObj["id"],)).fetchone()
+            if row and row[0] == revision and row[1] != "written":
+                continue
+            # Any lease is dropped: a worker still on the old revision finds out at its next checkpoint, and leaves the job to
+            # whoever leases the new one
+            db.execute(
+                "INSERT INTO jobs (id, folder, title, revision, state, attempts, updated, shard, priority, lane) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET folder = excluded.folder, title = excluded.title, revision = excluded.revision, "
+                "state = excluded.state, attempts = 0, path = NULL, result = NULL, error = NULL, updated = excluded.updated, "
+                "priority = excluded.priority, lane = excluded.lane, worker = NULL, lease_until = NULL",
+                (
+                    fileObj["id"],
+                    folderId,
+                    fileObj["title"],
+                    revision,
+                    STATES[0],
+                    now,
+                    shardOf(fileObj["id"]),
+                    priorityOf(fileObj) if priorityOf else 0,
+                    lane,
+                ),
+            )
+            count += 1
+        db.execute("COMMIT")
+    return count
+
+
+def heartbeat(worker, seconds=LEASE_SECONDS, queueFile=None):
+    """Tell the queue a worker's alive, renewing the leases on the jobs it holds
+
+    :param worker: As returned by workerId
+    :param seconds: New length of its leases
+    :param queueFile: Path of the queue
+    :returns: (this worker's position among the live workers, how many are live), which decides its shards
+    :rtype: Tuple
+
+    """
+    now = time.time()
+    with closing(connect(queueFile)) as db:
+        db.execute("BEGIN IMMEDIATE")
+        db.execute(
+            "INSERT INTO workers (id, started, heartbeat) VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (worker, now, now),
+        )
+        db.execute("UPDATE jobs SET lease_until = ? WHERE worker = ?", (now + seconds, worker))
+        db.execute("DELETE FROM workers WHERE heartbeat < ?", (now - WORKER_HISTORY,))
+        live = [i for (i,) in db.execute("SELECT id FROM workers WHERE heartbeat >= ? ORDER BY id", (now - seconds,))]
+        db.execute("COMMIT")
+    return live.index(worker), len(live)
+
+
+def leaseBatch(worker, folderIds, size=BATCH, seconds=LEASE_SECONDS, maxAttempts=None, lanes=LANES, queueFile=None):
+    """Claim unfinished jobs (ones nobody holds, or whose lease has run out). A job in the fast lane comes first, from any folder, one at
+    a time so it isn't stuck behind others. Otherwise up to size jobs, all from one folder: whichever of them was served longest ago,
+    so every folder gets its turn. Jobs in this worker's own shards come first, highest priority first, but it takes others' rather than
+    sit idle. Jobs that have already had maxAttempts are quarantined on the way
+
+    :param worker: Who's claiming them, e.g. workerId()
+    :param folderIds: The main folders it works for
+    :param size: Most backlog jobs to claim
+    :param seconds: How long the leases last before the jobs are up for grabs again, unless renewed by heartbeat
+    :param maxAttempts: Attempts before quarantine, configuredAttempts() if not given
+    :param lanes: Which of LANES to take jobs from
+    :param queueFile: Path of the queue
+    :returns: The jobs (dicts of COLUMNS, result decoded); an empty list if there's nothing left to do
+    :rtype: List
+
+    """
+    maxAttempts = maxAttempts if maxAttempts is not None else configuredAttempts()
+    index, workers = heartbeat(worker, seconds, queueFile)
+    now = time.time()
+    folders = ", ".join("?" * len(folderIds))
+    available = f"j.folder IN ({folders}) AND j.state NOT IN ('written', '{QUARANTINED}') AND (j.lease_until IS NULL OR j.lease_until < ?)"
+    jobs = []
+    with closing(connect(queueFile)) as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # A crashed process's leases don't have to run out if it was on this machine: restarting picks its jobs straight up
+            holders = db.execute(
+                f"SELECT DISTINCT worker FROM jobs WHERE folder IN ({folders}) AND worker IS NOT NULL AND lease_until >= ?", (*folderIds, now)
+            ).fetchall()
+            for (holder,) in holders:
+                if holder != worker and not running(holder):
+                    db.execute("UPDATE jobs SET worker = NULL, lease_until = NULL WHERE worker = ?", (holder,))
+            while not jobs:
+                columns = ", ".join("j." + i for i in COLUMNS)
+                rows = []
+                if "fresh" in lanes:
+                    rows = db.execute(
+                        f"SELECT {columns} FROM jobs j WHERE {available} AND j.lane = 'fresh' ORDER BY j.priority DESC LIMIT 1", (*folderIds, now)
+                    ).fetchall()
+                if not rows and "backlog" in lanes:
+                    row = db.execute(
+                        f"SELECT j.folder FROM jobs j LEFT JOIN folders f ON f.id = j.folder WHERE {available} AND j.lane = 'backlog' "
+                        "GROUP BY j.folder ORDER BY coalesce(max(f.served), 0) LIMIT 1",
+                        (*folderIds, now),
+                    ).fetchone()
+                    if row:
+                        rows = db.execute(
+                            f"SELECT {columns} FROM jobs j WHERE {available} AND j.lane = 'backlog' AND j.folder = ? "
+                            "ORDER BY j.shard % ? = ? DESC, j.priority DESC, j.updated LIMIT ?",
+                            (*folderIds, now, row[0], workers, index, size),
+                        ).fetchall()
+                if not rows:
+                    return []
+                for job in map(toJob, rows):
+                    if job["attempts"] < maxAttempts:
+                        jobs.append(job)
+                        continue
+                    db.execute("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, updated = ? WHERE id = ?", (QUARANTINED, now, job["id"]))
+                    metrics.inc("pymun_quarantined_total")
+                    print(f"Quarantined {job['title']} ({job['id']}) after {job['attempts']} attempts: {job['error']}")
+            db.executemany(
+                "UPDATE jobs SET attempts = attempts + 1, worker = ?, lease_until = ? WHERE id = ?", [(worker, now + seconds, i["id"]) for i in jobs]
+            )
+            db.execute(
+                "INSERT INTO folders (id, served) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET served = excluded.served", (jobs[0]["folder"], now)
+            )
+        finally:
+            db.execute("COMMIT")
+    for job in jobs:
+        job.update(attempts=job["attempts"] + 1, worker=worker, lease_until=now + seconds)
+    return jobs
+
+
+def claimListing(folderId, worker, interval, kind="listed", queueFile=None):
+    """Claim the job of listing a folder for new and changed files, which only one worker needs to do per tick
+
+    :param folderId: The main folder
+    :param worker: Who's claiming it
+    :param interval: Seconds between listings (the tick length); the folder's only listed again once this has passed
+    :param kind: "listed" for the full listing each tick, "polled" for the fast lane's quick look for just-modified files
+    :param queueFile: Path of the queue
+    :returns: Whether this worker should list the folder now
+    :rtype: Boolean
+
+    """
+    if kind not in ("listed", "polled"):
+        raise ValueError(f"Unknown listing {kind}")
+    now = time.time()
+    with closing(connect(queueFile)) as db:
+        db.execute("BEGIN IMMEDIATE")
+        row = db.execute(f"SELECT {kind} FROM folders WHERE id = ?", (folderId,)).fetchone()
+        # A little slack, so the worker that listed last time isn't beaten to it by one whose timer fired a moment earlier
+        claimed = row is None or row[0] is None or row[0] < now - interval * 0.9
+        if claimed:
+            db.execute(
+                f"INSERT INTO folders (id, {kind}, lister) VALUES (?, ?, ?) "
+                f"ON CONFLICT(id) DO UPDATE SET {kind} = excluded.{kind}, lister = excluded.lister",
+                (folderId, now, worker),
+            )
+        db.execute("COMMIT")
+    return claimed
+
+
+def freshWaiting(folderIds, queueFile=None):
+    # Whether a fast-lane job is waiting for a worker, so one working through the backlog should hand its batch back
+    folders = ", ".join("?" * len(folderIds))
+    with closing(connect(queueFile)) as db:
+        row = db.execute(
+            f"SELECT 1 FROM jobs WHERE folder IN ({folders}) AND lane = 'fresh' AND state NOT IN ('written', '{QUARANTINED}') "
+            "AND (lease_until IS NULL OR lease_until < ?) LIMIT 1",
+            (*folderIds, time.time()),
+        ).fetchone()
+    return row is not None
+
+
+def unlease(worker, fileIds, queueFile=None):
+    # Hand back leased jobs that weren't started, without counting it as an attempt
+    with closing(connect(queueFile)) as db:
+        db.executemany(
+            "UPDATE jobs SET worker = NULL, lease_until = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ?",
+            [(i, worker) for i in fileIds],
+        )
+
+
+def recordWork(worker, seconds, finished, queueFile=None):
+    # Throughput: time spent on one job, and whether it got done
+    with closing(connect(queueFile)) as db:
+        db.execute(
+            "UPDATE workers SET busy = busy + ?, files = files + ?, failures = failures + ? WHERE id = ?",
+            (seconds, int(finished), int(not finished), worker),
+        )
+
+
+def workerStats(queueFile=None):
+    """Throughput of every worker that's used the queue
+
+    :param queueFile: Path of the queue
+    :returns: Dicts of id, live, files, failures, busy (seconds), per minute (files finished per minute alive), utilisation (fraction of that time busy)
+    :rtype: List
+
+    """
+    now = time.time()
+    with closing(connect(queueFile)) as db:
+        rows = db.execute("SELECT id, started, heartbeat, files, failures, busy FROM workers ORDER BY id").fetchall()
+    stats = []
+    for worker, started, beat, files, failures, busy in rows:
+        alive = max(beat - started, 1)
+        stats.append(
+            {
+                "id": worker,
+                "live": beat >= now - LEASE_SECONDS,
+                "files": files,
+                "failures": failures,
+                "busy": busy,
+                "per minute": files * 60 / alive,
+                "utilisation": min(busy / alive, 1),
+            }
+        )
+    return stats
+
+
+def checkpoint(fileId, worker, state, seconds=LEASE_SECONDS, queueFile=None, revision=None, **fields):
+    """Record that a job got to a state, renewing its lease. Finishing (written) releases it
+
+    :param fileId: The job's file ID
+    :param worker: The worker holding the lease
+    :param state: One of STATES
+    :param seconds: New length of the lease
+    :param queueFile: Path of the queue
+    :param revision: The revision the worker leased. If the file's been re-queued for another since, the checkpoint doesn't count
+    :param fields: path (of the local copy), result (the metadata) and/or rewritten (whether the local copy's content changed) to keep with the checkpoint
+    :returns: Whether the worker still held the lease (on that revision). If not, someone else has the job, or it's been edited
+        since, and this worker should leave it be
+    :rtype: Boolean
+
+    """
+    now = time.time()
+    done = state == STATES[-1]
+    values = {
+        "state": state,
+        "lease_until": None if done else now + seconds,
+        "worker": None if done else worker,
+        "updated": now,
+        "error": None,
+        **{k: json.dumps(v) if k == "result" else v for k, v in fields.items()},
+    }
+    if done:
+        values["attempts"] = 0
+    with closing(connect(queueFile)) as db:
+        changed = db.execute(
+            f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in values)} WHERE id = ? AND worker = ? AND (? IS NULL OR revision = ?)",
+            (*values.values(), fileId, worker, revision, revision),
+        ).rowcount
+    return changed == 1
+
+
+def holds(fileId, worker, revision=None, queueFile=None):
+    # Whether a worker still has the lease on a job (and on that revision of it), e.g. before it overwrites the file on the drive
+    with closing(connect(queueFile)) as db:
+        row = db.execute("SELECT worker, revision FROM jobs WHERE id = ?", (fileId,)).fetchone()
+    return bool(row) and row[0] == worker and (revision is None or row[1] == revision)
+
+
+def fail(fileId, worker, error, queueFile=None):
+    # Gives up the lease, keeping the checkpoint: after a back-off, the next lease retries from there
+    now = time.time()
+    with closing(connect(queueFile)) as db:
+        db.execute(
+            "UPDATE jobs SET worker = NULL, lease_until = ? + attempts * ?, error = ?, updated = ? WHERE id = ? AND worker = ?",
+            (now, RETRY_SECONDS, str(error)[:1000], now, fileId, worker),
+        )
+
+
+def folderOf(fileId, queueFile=None):
+    with closing(connect(queueFile)) as db:
+        row = db.execute("SELECT folder FROM jobs WHERE id = ?", (fileId,)).fetchone()
+    return row[0] if row else None
+
+
+def forget(fileId, queueFile=None):
+    # The file's gone from the drive
+    with closing(connect(queueFile)) as db:
+        db.execute("DELETE FROM jobs WHERE id = ?", (fileId,))
+
+
+def release(fileId, queueFile=None):
+    """Give a quarantined job another go, from its last checkpoint
+
+    :param fileId: The job's file ID
+    :param queueFile: Path of the queue
+    :returns: Whether there was such a quarantined job
+    :rtype: Boolean
+
+    """
+    with closing(connect(queueFile)) as db:
+        row = db.execute("SELECT path, result FROM jobs WHERE id = ? AND state = ?", (fileId, QUARANTINED)).fetchone()
+        if row is None:
+            return False
+        # Where it was: classified if it got that far, otherwise downloaded if it has a copy, otherwise from scratch
+        state = "classified" if row[1] else ("downloaded" if row[0] else STATES[0])
+        db.execute("UPDATE jobs SET state = ?, attempts = 0, lease_until = NULL, updated = ? WHERE id = ?", (state, time.time(), fileId))
+    return True
+
+
+def counts(folderId=None, queueFile=None):
+    """Number of jobs in each state
+
+    :param folderId: Only count this folder's jobs
+    :param queueFile: Path of the queue
+    :returns: {state: count}
+    :rtype: Dict
+
+    """
+    with closing(connect(queueFile)) as db:
+        if folderId is None:
+            rows = db.execute("SELECT state, count(*) FROM jobs GROUP BY state")
+        else:
+            rows = db.execute("SELECT state, count(*) FROM jobs WHERE folder = ? GROUP BY state", (folderId,))
+        return dict(rows.fetchall())
+
+
+def quarantined(queueFile=None):
+    with closing(connect(queueFile)) as db:
+        rows = db.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE state = ? ORDER BY updated", (QUARANTINED,)).fetchall()
+    return [toJob(i) for i in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the batch job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Jobs in each state, the quarantined ones, and each worker's throughput")
+    releaseCommand = commands.add_parser("release", help="Retry quarantined files on the next tick")
+    releaseCommand.add_argument("ids", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for state, count in sorted(counts().items()):
+            print(f"{state:12} {count}")
+        for job in quarantined():
+            print(f"  {job['title']} ({job['id']}), {job['attempts']} attempts: {job['error']}")
+        for worker in workerStats():
+            print(
+                f"{worker['id']:32} {'live' if worker['live'] else 'gone':5} {worker['files']:6} files {worker['failures']:4} failures "
+                f"{worker['per minute']:7.1f}/min {worker['utilisation']:5.0%} busy"
+            )
+    else:
+        for fileId in args.ids:
+            print(f"{fileId}: {'released' if release(fileId) else 'not quarantined'}")
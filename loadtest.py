@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+# Load test batchProcess against the fake drive server (fake_drive.py), at increasing folder sizes.
+import json
+import multiprocessing
+import os
+import time
+from urllib.request import Request, urlopen
+
+os.environ.setdefault("PYMUN_OFFLINE", "1")
+
+from benchmark import startLinkServer
+from fake_drive import FakeDriveServer, fakeDrive
+from gdrive_tools import batchProcess
+
+
+def serve(queue, latency, errorRate, throttleRate):
+    server = FakeDriveServer(latency=latency, errorRate=errorRate, throttleRate=throttleRate)
+    queue.put(server.url)
+    server.serve_forever()
+
+
+def startServer(latency=0.0, errorRate=0.0, throttleRate=0.0):
+    """Run the fake drive in its own process, so it doesn't fight batchProcess for the GIL
+
+    :returns: The server process and its root URL
+    :rtype: Tuple
+
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(queue, latency, errorRate, throttleRate), daemon=True
+    )
+    process.start()
+    return process, queue.get(timeout=30)
+
+
+def control(url, action, data=None):
+    request = Request(f"{url}_fake/{action}", data=json.dumps(data or {}).encode(), method="POST")
+    with urlopen(request, timeout=600) as response:
+        return json.load(response)
+
+
+def loadTest(count, classified=0.0, latency=0.0, errorRate=0.0, throttleRate=0.0):
+    """Seed a fresh fake drive with count files and time a single batchProcess tick against it
+
+    :param count: Number of files in the folder
+    :param classified: Fraction of files that already have metadata (so are only listed, not processed)
+    :param latency: Mean added latency per API call, in seconds
+    :param errorRate: Probability of any API call failing with a 500
+    :param throttleRate: Probability of any API call being rate limited (403)
+    :returns: A report of throughput, API usage and latency
+    :rtype: Dict
+
+    """
+    with open("config.json") as conf:
+        folderpath = json.load(conf)["folderpath"]
+    process, url = startServer(latency, errorRate, throttleRate)
+    # The seeded documents' links are fetched (for their titles) from a local server rather than the internet
+    links = startLinkServer()
+    try:
+        control(url, "seed", {"count": count, "folderpath": folderpath, "classified": classified})
+        control(url, "reset")
+        drive = fakeDrive(url)
+        error = None
+        start = time.perf_counter()
+        try:
+            batchProcess(drive)
+        except Exception as e:  # Report how far we got rather than dying
+            error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+        stats = control(url, "stats")
+    finally:
+        links.shutdown()
+        process.terminate()
+    # Every processed file ends in exactly one update (content changed) or patch (metadata only)
+    processed = stats["calls"].get("files.update", 0) + stats["calls"].get("files.patch", 0)
+    return {
+        "files": count,
+        "processed": processed,
+        "seconds": elapsed,
+        "filesPerSecond": processed / elapsed if elapsed else 0,
+        "listedPerSecond": count / elapsed if elapsed else 0,
+        "callsPerFile": stats["total"] / processed if processed else None,
+        "calls": stats["calls"],
+        "faults": stats["faults"],
+        "latency": stats["latency"],
+        "error": error,
+    }
+
+
+def printReport(result):
+    print(
+        f"{result['files']:>7} files: {result['processed']} processed in {result['seconds']:.1f}s "
+        f"({result['filesPerSecond']:.2f} files/s, {result['listedPerSecond']:.0f} listed/s)"
+    )
+    if result["callsPerFile"] is not None:
+        print(f"         API calls per processed file: {result['callsPerFile']:.2f}  {result['calls']}")
+    latency = result["latency"]
+    print(
+        f"         API latency p50 {latency['p50'] * 1000:.1f}ms  p95 {latency['p95'] * 1000:.1f}ms  "
+        f"p99 {latency['p99'] * 1000:.1f}ms  max {latency['max'] * 1000:.1f}ms  faults {result['faults']}"
+    )
+    if result["error"]:
+        print(f"         Aborted: {result['error']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test batchProcess against a fake drive")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated folder sizes")
+    parser.add_argument(
+        "--classified",
+        type=float,
+        default=0.99,
+        help="Fraction of files already classified, i.e. a steady state tick. Use 0 for a full backfill",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    results = []
+    for size in [int(i) for i in args.sizes.split(",")]:
+        result = loadTest(size, args.classified, args.latency, args.error_rate, args.throttle_rate)
+        printReport(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=1)
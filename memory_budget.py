@@ -0,0 +1,175 @@
+#! /usr/bin/env python
+# Backpressure on the bytes of documents in flight, so a few 200 MB PDFs arriving at once can't run a small machine out of memory.
+# Before a file is downloaded, its Drive fileSize is charged against the process's budget; a thread whose file doesn't fit waits
+# until enough of the others' files have been uploaded. Files above a size threshold go through a lane of their own, which only lets
+# large-file-concurrency of them through at a time, so they queue among themselves without holding up the small files behind them. While a file is in a
+# stage, its bytes are counted against that stage too, so /metrics shows where the memory is going.
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+BUDGET_MB = 256  # Overridden by "memory-budget-mb" in config.json
+LARGE_MB = 50  # Overridden by "large-file-mb": files at least this big go through the large-file lane
+LARGE_CONCURRENCY = 1  # Overridden by "large-file-concurrency"
+UNSIZED_BYTES = 1 << 20  # Google Docs have no fileSize until they're exported, so they're charged this much
+
+budgets = {}  # (budget, large threshold, large concurrency) -> ByteBudget, so every thread in the process shares one
+budgetsLock = threading.Lock()
+
+
+def sizeOf(fileObj):
+    """How many bytes a drive file will take once downloaded, as far as can be told before downloading it
+
+    :param fileObj: The drive file
+    :returns: Its fileSize, or UNSIZED_BYTES for Google Docs and the like which haven't got one
+    :rtype: Integer
+
+    """
+    try:
+        return int(fileObj.get("fileSize") or UNSIZED_BYTES)
+    except (TypeError, ValueError):
+        return UNSIZED_BYTES
+
+
+class ByteBudget:
+    """Admission control by the bytes of the files being worked on. A file bigger than the whole budget is still let through,
+    but only once nothing else is in flight, so it never waits forever"""
+
+    def __init__(self, limit, largeBytes, largeConcurrency=LARGE_CONCURRENCY):
+        self.limit = limit
+        self.largeBytes = largeBytes
+        self.inFlight = 0
+        self.stages = {}  # Stage -> bytes currently in it
+        self.condition = threading.Condition()
+        self.large = threading.BoundedSemaphore(max(1, largeConcurrency))
+
+    @contextmanager
+    def admit(self, nbytes):
+        """Wait until a file of this size fits in the budget (and, if it's large, for its turn in the large-file lane), and hold
+        its share of the budget until the block ends
+
+        :param nbytes: The file's size
+        :returns: Context manager
+        :rtype: contextmanager
+
+        """
+        large = nbytes >= self.largeBytes
+        charge = min(nbytes, self.limit)
+        start = time.perf_counter()
+        if large:
+            self.large.acquire()
+        try:
+            with self.condition:
+                self.condition.wait_for(lambda: self.inFlight + charge <= self.limit)
+                self.inFlight += charge
+                metrics.setGauge("pymun_inflight_bytes", self.inFlight, stage="admitted")
+            metrics.observe("pymun_admission_wait_seconds", time.perf_counter() - start, lane="large" if large else "normal")
+            try:
+                yield
+            finally:
+                with self.condition:
+                    self.inFlight -= charge
+                    metrics.setGauge("pymun_inflight_bytes", self.inFlight, stage="admitted")
+                    self.condition.notify_all()
+        finally:
+            if large:
+                self.large.release()
+
+    @contextmanager
+    def stage(self, name, nbytes):
+        """Count a file's bytes against a pipeline stage while it's in it
+
+        :param name: The stage, e.g. download, parse, upload
+        :param nbytes: The file's size
+        :returns: Context manager
+        :rtype: contextmanager
+
+        """
+        with self.condition:
+            self.stages[name] = self.stages.get(name, 0) + nbytes
+            metrics.setGauge("pymun_inflight_bytes", self.stages[name], stage=name)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.stages[name] -= nbytes
+                metrics.setGauge("pymun_inflight_bytes", self.stages[name], stage=name)
+
+
+def configuredBudget(config):
+    """This process's byte budget, as set in config.json
+
+    :param config: The parsed config.json
+    :returns: The budget every thread in the process shares
+    :rtype: ByteBudget
+
+    """
+    try:
+        key = (
+            int(float(config.get("memory-budget-mb", BUDGET_MB)) * (1 << 20)),
+            int(float(config.get("large-file-mb", LARGE_MB)) * (1 << 20)),
+            int(config.get("large-file-concurrency", LARGE_CONCURRENCY)),
+        )
+    except (TypeError, ValueError):
+        key = (BUDGET_MB << 20, LARGE_MB << 20, LARGE_CONCURRENCY)
+    with budgetsLock:
+        if key not in budgets:
+            budgets[key] = ByteBudget(*key)
+        return budgets[key]
+
+
+def resetPeakRss():
+    """Start measuring peak memory afresh, so each run's peak can be told apart. Only Linux lets the high-water mark be reset;
+    elsewhere, peakRss carries on giving the process's peak so far
+
+    :returns: Whether it was reset
+    :rtype: Boolean
+
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as refs:
+            refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peakRss():
+    """The most memory this process has had resident since resetPeakRss (or since it started)
+
+    :returns: Bytes, or None where it can't be found out
+    :rtype: Integer or NoneType
+
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource  # Not on Windows
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+    return peak if sys.platform == "darwin" else peak * 1024  # macOS gives bytes, everything else kilobytes
+
+
+def reportPeakRss(worker):
+    """Record the run's peak memory as a gauge and print it
+
+    :param worker: The worker whose run it was
+    :returns: The peak, in bytes
+    :rtype: Integer or NoneType
+
+    """
+    peak = peakRss()
+    if peak is not None:
+        metrics.setGauge("pymun_peak_rss_bytes", peak)
+        print(f"{worker}: peak RSS {peak / (1 << 20):.1f} MB")
+    return peak
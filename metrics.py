@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+# Counters and latency histograms for the classifier, exposed in Prometheus text format by webform.py's /metrics route.
+# The daemon and the web UI are separate processes, so the daemon dumps a snapshot to disk and the web UI renders that.
+import json
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from os import makedirs, path, replace
+
+appname = "pyMUN"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SNAPSHOT = f"{path.expanduser('~')}/tmp/{appname}/metrics.json"
+SLOW_LOG = f"{path.expanduser('~')}/tmp/{appname}/slow_files.log"
+HELP = {
+    "pymun_stage_seconds": "Time spent in each pipeline stage",
+    "pymun_stage_total": "Stage executions, by outcome",
+    "pymun_api_calls_total": "Drive API calls, by method",
+    "pymun_api_seconds": "Drive API call latency, by method",
+    "pymun_queue_depth": "Items waiting in each queue of the current batch",
+    "pymun_cache_requests_total": "Cache lookups, by cache and result",
+    "pymun_files_total": "Files fully processed",
+    "pymun_slow_files_total": "Files which took longer than the slow-file threshold",
+    "pymun_paragraphs_total": "Paragraphs of word documents parsed, by whether they were reused from the file's fingerprint",
+    "pymun_classifications_total": "Word documents classified, by engine and type",
+    "pymun_duplicates_total": "Word documents which inherited their metadata from a near-duplicate",
+    "pymun_job_failures_total": "Attempts at processing a queued file which raised an error",
+    "pymun_quarantined_total": "Queued files given up on after too many failed attempts",
+    "pymun_worker_files_total": "Files finished by each worker sharing the job queue",
+    "pymun_worker_failures_total": "Failed attempts by each worker sharing the job queue",
+    "pymun_worker_busy_seconds_total": "Time each worker sharing the job queue has spent processing files",
+    "pymun_fresh_latency_seconds": "Time from a fast-lane file's last modification to its upload",
+    "pymun_reclassified_total": "Already-classified files whose type changed when the custom rules did",
+    "pymun_reclassify_failures_total": "Already-classified files whose metadata couldn't be updated when the custom rules changed",
+    "pymun_inflight_bytes": "Bytes of the files being worked on, admitted to the memory budget and by stage",
+    "pymun_admission_wait_seconds": "Time files waited for room in the memory budget, by lane",
+    "pymun_peak_rss_bytes": "Peak resident memory during the last run",
+    "pymun_link_bytes_total": "Bytes of linked pages and PDFs downloaded to find their titles, by kind",
+    "pymun_uploads_total": "Files uploaded, by how their content was sent: none (metadata only), whole, or chunked",
+    "pymun_upload_resumes_total": "Chunks of resumable uploads retried after a transient failure",
+}
+
+lock = threading.Lock()
+counters = {}  # (name, labels) -> value
+gauges = {}  # (name, labels) -> value
+histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+local = threading.local()
+fileRecords = {}  # file ID -> {"start": time, "stages": {stage: seconds}}
+stageListeners = []  # Functions taking a stage name and returning a context manager to run around it (e.g. the profiler)
+
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter
+
+    :param name: Metric name
+    :param amount: How much to add
+    :param labels: Prometheus labels, as keyword arguments
+    :returns: None
+    :rtype: NoneType
+
+    """
+    key = (name, labelKey(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def setGauge(name, value, **labels):
+    with lock:
+        gauges[(name, labelKey(labels))] = value
+
+
+def observe(name, seconds, **labels):
+    """Record a single observation in a histogram
+
+    :param name: Metric name
+    :param seconds: The observed duration
+    :param labels: Prometheus labels, as keyword arguments
+    :returns: None
+    :rtype: NoneType
+
+    """
+    key = (name, labelKey(labels))
+    with lock:
+        hist = histograms.setdefault(key, [0] * len(BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+
+def cacheLookup(cache, hit):
+    inc("pymun_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage, and attribute it to whichever file the current thread is working on
+
+    :param name: One of list, download, parse, dedup, link-rewrite, link-fetch, classify, reclassify, format, index, upload (or anything else worth timing)
+    :returns: Context manager
+    :rtype: contextmanager
+
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with ExitStack() as stack:
+            for listener in stageListeners:
+                stack.enter_context(listener(name))
+            yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("pymun_stage_seconds", elapsed, stage=name)
+        inc("pymun_stage_total", stage=name, outcome=outcome)
+        record = fileRecords.get(getattr(local, "fileId", None))
+        if record is not None:
+            record["stages"][name] = record["stages"].get(name, 0) + elapsed
+
+
+@contextmanager
+def apiCall(method):
+    """Count and time a Drive API call
+
+    :param method: API method name, e.g. files.list
+    :returns: Context manager
+    :rtype: contextmanager
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        inc("pymun_api_calls_total", method=method)
+        observe("pymun_api_seconds", time.perf_counter() - start, method=method)
+
+
+@contextmanager
+def tracking(fileId):
+    """Attribute stages run inside this block to a file, so slow files can be broken down by stage
+
+    :param fileId: The drive ID of the file being worked on
+    :returns: Context manager
+    :rtype: contextmanager
+
+    """
+    with lock:
+        fileRecords.setdefault(fileId, {"start": time.time(), "stages": {}})
+    previous = getattr(local, "fileId", None)
+    local.fileId = fileId
+    try:
+        yield
+    finally:
+        local.fileId = previous
+
+
+def startFile(fileId):
+    # Begin a fresh record for an attempt at a file, so a retry isn't timed from the first attempt's start
+    with lock:
+        fileRecords[fileId] = {"start": time.time(), "stages": {}}
+
+
+def dropFile(fileId):
+    # Forget a file's record without counting it, e.g. when the attempt failed; nothing if finishFile already closed it
+    with lock:
+        fileRecords.pop(fileId, None)
+
+
+def finishFile(fileId, title="", threshold=30, logFile=SLOW_LOG):
+    """Close a file's record, and log it to the slow-file log if it took longer than the threshold
+
+    :param fileId: The drive ID of the file
+    :param title: The file's title, for the log
+    :param threshold: Seconds, from the start of tracking to now, above which a file counts as slow
+    :param logFile: Where slow files are appended, one JSON object per line
+    :returns: The total seconds spent on the file, or None if it was never tracked
+    :rtype: Float
+
+    """
+    with lock:
+        record = fileRecords.pop(fileId, None)
+    if record is None:
+        return None
+    total = time.time() - record["start"]
+    inc("pymun_files_total")
+    if total > threshold:
+        inc("pymun_slow_files_total")
+        makedirs(path.dirname(logFile), exist_ok=True)
+        with open(logFile, "a") as log:
+            log.write(
+                json.dumps(
+                    {
+                        "id": fileId,
+                        "title": title,
+                        "seconds": round(total, 3),
+                        "stages": {k: round(v, 3) for k, v in record["stages"].items()},
+                        "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    }
+                )
+                + "\n"
+            )
+    return total
+
+
+def snapshot():
+    with lock:
+        return {
+            "counters": [[k[0], dict(k[1]), v] for k, v in counters.items()],
+            "gauges": [[k[0], dict(k[1]), v] for k, v in gauges.items()],
+            "histograms": [[k[0], dict(k[1]), v] for k, v in histograms.items()],
+        }
+
+
+def dump(snapshotFile=None):
+    """Atomically write the current metrics to disk, for the web UI to pick up. Extra worker processes change SNAPSHOT to their own file"""
+    snapshotFile = snapshotFile or SNAPSHOT
+    makedirs(path.dirname(snapshotFile), exist_ok=True)
+    temp = snapshotFile + ".tmp"
+    with open(temp, "w") as out:
+        json.dump(snapshot(), out)
+    replace(temp, snapshotFile)
+
+
+def loadSnapshot(snapshotFile=SNAPSHOT):
+    try:
+        with open(snapshotFile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def formatLabels(labels, extra=None):
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    escaped = [
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in sorted(labels.items())
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def render(data=None):
+    """Render metrics in the Prometheus text exposition format
+
+    :param data: A snapshot (as returned by snapshot/loadSnapshot), defaults to this process's metrics
+    :returns: The exposition text
+    :rtype: String
+
+    """
+    data = data or snapshot()
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for name, labels, value in sorted(data["counters"], key=lambda i: i[0]):
+        header(name, "counter")
+        lines.append(f"{name}{formatLabels(labels)} {value}")
+    for name, labels, value in sorted(data["gauges"], key=lambda i: i[0]):
+        header(name, "gauge")
+        lines.append(f"{name}{formatLabels(labels)} {value}")
+    for name, labels, hist in sorted(data["histograms"], key=lambda i: i[0]):
+        header(name, "histogram")
+        for bound, count in zip(BUCKETS, hist):
+            lines.append(f"{name}_bucket{formatLabels(labels, {'le': bound})} {count}")
+        lines.append(f"{name}_bucket{formatLabels(labels, {'le': '+Inf'})} {hist[-1]}")
+        lines.append(f"{name}_sum{formatLabels(labels)} {hist[-2]}")
+        lines.append(f"{name}_count{formatLabels(labels)} {hist[-1]}")
+    return "\n".join(lines) + "\n"
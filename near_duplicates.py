@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+# Near-duplicate detection. Delegates copy and lightly edit each other's drafts; a copy of a document we've already classified inherits
+# its metadata and its link table (so its links aren't fetched again), instead of going through the heuristics from scratch.
+# Each document gets a MinHash signature of its word shingles, and an LSH index (bands of the signature) finds candidates without
+# comparing against every document. Signatures use one-permutation hashing: each shingle is hashed once and lands in one of BINS bins,
+# the minimum per bin is kept, and empty bins are filled from their neighbours (densification).
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+from array import array
+from contextlib import closing
+from os import makedirs, path
+
+import config_service
+
+appname = "pyMUN"
+INDEX_FILE = f"{path.expanduser('~')}/tmp/{appname}/duplicates.sqlite3"
+BINS = 128
+BANDS = 16  # Of BINS // BANDS rows each: pairs above ~0.7 similarity almost always share a band
+SHINGLE = 4  # Words per shingle
+MIN_SHINGLES = 50  # Shorter documents are too short to tell a copy from a template
+THRESHOLD = 0.9  # Estimated Jaccard similarity above which a document counts as a copy. Overridden by "duplicate-threshold" in config.json
+WORD = re.compile(r"\w+")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    signature BLOB NOT NULL,
+    cluster TEXT NOT NULL,
+    result TEXT,
+    links TEXT,
+    heuristic TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_cluster ON documents(cluster);
+CREATE TABLE IF NOT EXISTS bands (band INTEGER, key BLOB, id TEXT);
+CREATE INDEX IF NOT EXISTS bands_key ON bands(band, key);
+CREATE INDEX IF NOT EXISTS bands_id ON bands(id);
+"""
+# Columns added since the index was first released: (table, column, definition), for indexes created before them
+ADDED = (("documents", "heuristic", "TEXT"),)
+
+ready = set()  # Index files whose schema has been created by this process
+
+
+def shingles(texts):
+    words = WORD.findall(" ".join(texts).lower())
+    return {" ".join(words[i : i + SHINGLE]) for i in range(max(len(words) - SHINGLE + 1, 0))}
+
+
+def signature(texts):
+    """MinHash signature of a document
+
+    :param texts: The document's paragraphs
+    :returns: BINS 64-bit values, or None if the document is too short to compare
+    :rtype: array or NoneType
+
+    """
+    found = shingles(texts)
+    if len(found) < MIN_SHINGLES:
+        return None
+    empty = 1 << 64
+    values = [empty] * BINS
+    for shingle in found:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little")
+        # Low bits pick the bin, the rest is the value
+        index, value = h % BINS, h // BINS
+        if value < values[index]:
+            values[index] = value
+    for index in range(BINS):
+        if values[index] == empty:
+            # Take the next non-empty bin to the right, offset by the distance so borrowed values don't collide with real ones
+            distance = next(d for d in range(1, BINS) if values[(index + d) % BINS] < empty)
+            values[index] = values[(index + distance) % BINS] % (1 << 57) + (distance << 57)
+    return array("Q", values)
+
+
+def similarity(a, b):
+    # Estimated Jaccard similarity: the fraction of bins that agree
+    return sum(x == y for x, y in zip(a, b)) / BINS
+
+
+def bandKeys(sig):
+    rows = BINS // BANDS
+    for band in range(BANDS):
+        yield band, hashlib.blake2b(sig[band * rows : (band + 1) * rows].tobytes(), digest_size=8).digest()
+
+
+def toBlob(sig):
+    sig = array("Q", sig)
+    if sys.byteorder == "big":
+        sig.byteswap()
+    return sig.tobytes()
+
+
+def fromBlob(blob):
+    sig = array("Q")
+    sig.frombytes(blob)
+    if sys.byteorder == "big":
+        sig.byteswap()
+    return sig
+
+
+def connect(indexFile=INDEX_FILE):
+    makedirs(path.dirname(indexFile), exist_ok=True)
+    db = sqlite3.connect(indexFile, timeout=30)
+    if indexFile not in ready:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+        for table, column, definition in ADDED:
+            if column not in [i[1] for i in db.execute(f"PRAGMA table_info({table})")]:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        ready.add(indexFile)
+    return db
+
+
+def configuredThreshold(configFile="config.json"):
+    try:
+        return float(config_service.current(configFile).get("duplicate-threshold", THRESHOLD))
+    except (TypeError, ValueError):
+        return THRESHOLD
+
+
+def findDuplicate(sig, exclude=None, threshold=None, indexFile=INDEX_FILE):
+    """Find the already-indexed document most similar to a signature, if it's similar enough to count as a copy
+
+    :param sig: As returned by signature
+    :param exclude: A file ID to ignore (the document's own earlier revision)
+    :param threshold: Minimum estimated similarity, configuredThreshold() if not given
+    :param indexFile: Path of the index
+    :returns: Dict of id, title, similarity, cluster, result (metadata dict), links (link table) and heuristic (its type before
+        any custom rule, None if it was indexed before that was kept), or None
+    :rtype: Dict or NoneType
+
+    """
+    if sig is None:
+        return None
+    threshold = threshold if threshold is not None else configuredThreshold()
+    best = None
+    with closing(connect(indexFile)) as db:
+        candidates = set()
+        for band, key in bandKeys(sig):
+            candidates.update(i for (i,) in db.execute("SELECT id FROM bands WHERE band = ? AND key = ?", (band, key)))
+        candidates.discard(exclude)
+        for candidate in candidates:
+            row = db.execute(
+                "SELECT id, title, signature, cluster, result, links, heuristic FROM documents WHERE id = ?", (candidate,)
+            ).fetchone()
+            if row is None:
+                continue
+            score = similarity(sig, fromBlob(row[2]))
+            if score >= threshold and (best is None or score > best["similarity"]):
+                best = {
+                    "id": row[0],
+                    "title": row[1],
+                    "similarity": score,
+                    "cluster": row[3],
+                    "result": json.loads(row[4] or "{}"),
+                    "links": json.loads(row[5] or "{}"),
+                    "heuristic": row[6],
+                }
+    return best
+
+
+def linkTable(fileId, indexFile=INDEX_FILE):
+    with closing(connect(indexFile)) as db:
+        row = db.execute("SELECT links FROM documents WHERE id = ?", (fileId,)).fetchone()
+    return json.loads(row[0] or "{}") if row else {}
+
+
+def addDocument(fileId, title, sig, result, links=None, original=None, heuristic=None, indexFile=INDEX_FILE):
+    """Add (or update) a document in the index
+
+    :param fileId: The drive ID of the file
+    :param title: Its title
+    :param sig: As returned by signature. Documents without one aren't indexed
+    :param result: Its metadata
+    :param links: Its link table ({url: replacement}), merged into what's already stored for it
+    :param original: What findDuplicate returned for it, if it's a copy; it then joins that document's cluster
+    :param heuristic: Its type before any custom rule, which a copy of it inherits (the copy's own rules then apply)
+    :param indexFile: Path of the index
+    :returns: None
+    :rtype: NoneType
+
+    """
+    if sig is None:
+        removeDocument(fileId, indexFile)
+        return
+    with closing(connect(indexFile)) as db, db:
+        row = db.execute("SELECT cluster, links FROM documents WHERE id = ?", (fileId,)).fetchone()
+        cluster = original["cluster"] if original else (row[0] if row else fileId)
+        table = {**(json.loads(row[1] or "{}") if row else {}), **(links or {})}
+        # An upsert rather than a replace, so the row (and so the document's place in its cluster) stays put
+        db.execute(
+            "INSERT INTO documents (id, title, signature, cluster, result, links, heuristic) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = excluded.title, signature = excluded.signature, cluster = excluded.cluster, "
+            "result = excluded.result, links = excluded.links, heuristic = excluded.heuristic",
+            (fileId, title, toBlob(sig), cluster, json.dumps(result), json.dumps(table), heuristic),
+        )
+        db.execute("DELETE FROM bands WHERE id = ?", (fileId,))
+        db.executemany("INSERT INTO bands (band, key, id) VALUES (?, ?, ?)", [(band, key, fileId) for band, key in bandKeys(sig)])
+
+
+def removeDocument(fileId, indexFile=INDEX_FILE):
+    with closing(connect(indexFile)) as db, db:
+        db.execute("DELETE FROM bands WHERE id = ?", (fileId,))
+        db.execute("DELETE FROM documents WHERE id = ?", (fileId,))
+
+
+def clusters(minSize=2, indexFile=INDEX_FILE):
+    """Groups of documents which are copies of each other
+
+    :param minSize: Smallest cluster to return
+    :param indexFile: Path of the index
+    :returns: List of clusters (largest first), each a list of {id, title, type} dicts, the document first seen first
+    :rtype: List
+
+    """
+    with closing(connect(indexFile)) as db:
+        rows = db.execute(
+            "SELECT cluster, id, title, result FROM documents WHERE cluster IN "
+            "(SELECT cluster FROM documents GROUP BY cluster HAVING count(*) >= ?) ORDER BY cluster, rowid",
+            (minSize,),
+        ).fetchall()
+    grouped = {}
+    for cluster, fileId, title, result in rows:
+        grouped.setdefault(cluster, []).append({"id": fileId, "title": title, "type": json.loads(result or "{}").get("type")})
+    return sorted(grouped.values(), key=len, reverse=True)
+
+
+if __name__ == "__main__":
+    for n, cluster in enumerate(clusters()):
+        print(f"Cluster {n + 1}:")
+        for i in cluster:
+            print(f"  {i['type'] or '':14} {i['title']} ({i['id']})")
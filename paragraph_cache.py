@@ -0,0 +1,305 @@
+#! /usr/bin/env python
+# Per-file paragraph fingerprints, so an edited document only has its changed paragraphs re-read.
+# Every w:p of document.xml is hashed and kept alongside its text and text features (links, key: value metadata); on the next revision
+# the hashes are diffed, unchanged paragraphs are taken from the cache and only the changed ranges are parsed again.
+# Paragraphs are rendered straight from the XML the way docx2python renders them (tabs for list levels, then the list marker), which is
+# much cheaper than running docx2python over the whole document again.
+# Fingerprints are stored zlib-compressed, and double as the local copy of each document's text that custom rules are re-applied to
+# (see rule_changes.py), so changing the rules doesn't mean downloading everything again.
+import hashlib
+import json
+import re
+import zipfile
+import zlib
+from difflib import SequenceMatcher
+from os import listdir, makedirs, path, replace
+from xml.sax.saxutils import unescape
+
+import classifier
+import metrics
+import tracing
+from docx_tools import PARAGRAPH, documentFeatures, headerWindow, textFeatures
+
+appname = "pyMUN"
+CACHE_DIR = f"{path.expanduser('~')}/tmp/{appname}/paragraphs"
+THRESHOLD = 0.3  # Fraction of paragraphs changed above which a document is fully re-classified
+VERSION = 3
+FIELDS = ("texts", "numbers", "bold", "links", "naked", "meta")  # Per-paragraph lists stored in a fingerprint
+# Per-file values carried over from one revision's fingerprint to the next: the metadata last set, the file's title, and the type
+# the heuristics gave it before any custom rule
+CARRIED = ("result", "title", "heuristic")
+
+RUN = re.compile(r"<w:r\b[^>]*>(.*?)</w:r>", re.S)
+PIECE = re.compile(r"<w:t(?:\s[^>]*)?>([^<]*)</w:t>|<w:(tab|br|cr)/>")
+BOLD = re.compile(r'<w:b(?: w:val="(?:true|1|on)")?\s*/>')
+NUM_ID = re.compile(r'<w:numId w:val="(\d+)"')
+ILVL = re.compile(r'<w:ilvl w:val="(\d+)"')
+ABSTRACT = re.compile(r'<w:abstractNum\b[^>]*w:abstractNumId="(\d+)".*?</w:abstractNum>', re.S)
+LEVEL = re.compile(r'<w:lvl\b[^>]*w:ilvl="(\d+)".*?</w:lvl>', re.S)
+NUM = re.compile(r'<w:num\b[^>]*w:numId="(\d+)".*?<w:abstractNumId w:val="(\d+)"', re.S)
+START = re.compile(r'<w:start w:val="(\d+)"')
+FORMAT = re.compile(r'<w:numFmt w:val="(\w+)"')
+NUMERALS = ((1000, "m"), (900, "cm"), (500, "d"), (400, "cd"), (100, "c"), (90, "xc"), (50, "l"), (40, "xl"), (10, "x"), (9, "ix"), (5, "v"), (4, "iv"), (1, "i"))
+ENTITIES = {"&quot;": '"', "&apos;": "'"}  # On top of the &amp; &lt; &gt; unescape always handles
+
+
+def paragraphHash(xml):
+    return hashlib.blake2b(xml.encode(), digest_size=8).hexdigest()
+
+
+def readParagraph(xml):
+    """Everything the cache keeps about a paragraph, read from its XML
+
+    :param xml: A w:p element of document.xml
+    :returns: (text, [numId, ilvl] or None, text of its first bold run or None)
+    :rtype: Tuple
+
+    """
+    pieces = []
+    for match in PIECE.finditer(xml):
+        if match.group(2):
+            pieces.append("\t" if match.group(2) == "tab" else "\n")
+        else:
+            pieces.append(unescape(match.group(1), ENTITIES))
+    numbers = None
+    properties = xml[: xml.find("</w:pPr>")] if "<w:numPr>" in xml else ""
+    numId = NUM_ID.search(properties)
+    if numId and numId.group(1) != "0":
+        ilvl = ILVL.search(properties)
+        numbers = [int(numId.group(1)), int(ilvl.group(1)) if ilvl else 0]
+    bold = None
+    for run in RUN.finditer(xml):
+        body = run.group(1)
+        if "<w:rPr>" in body and BOLD.search(body[: body.find("</w:rPr>")]):
+            bold = "".join(unescape(i.group(1), ENTITIES) for i in PIECE.finditer(body) if i.group(1) is not None)
+            break
+    return "".join(pieces), numbers, bold
+
+
+def numberingFormats(numberingXml):
+    """Map each list (numId) to the format and start value of each of its levels
+
+    :param numberingXml: Contents of word/numbering.xml, or an empty string if there isn't one
+    :returns: Dict of {numId: {ilvl: (numFmt, start)}}
+    :rtype: Dict
+
+    """
+    abstracts = {}
+    for abstract in ABSTRACT.finditer(numberingXml):
+        levels = {}
+        for level in LEVEL.finditer(abstract.group(0)):
+            numFmt = FORMAT.search(level.group(0))
+            start = START.search(level.group(0))
+            levels[int(level.group(1))] = (
+                numFmt.group(1) if numFmt else "decimal",
+                int(start.group(1)) if start else 1,
+            )
+        abstracts[abstract.group(1)] = levels
+    return {int(numId): abstracts.get(abstractId, {}) for numId, abstractId in NUM.findall(numberingXml)}
+
+
+def roman(n):
+    result = ""
+    for value, numeral in NUMERALS:
+        while n >= value:
+            result += numeral
+            n -= value
+    return result
+
+
+def letters(n):
+    result = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        result = chr(ord("a") + remainder) + result
+    return result
+
+
+def marker(numFmt, value):
+    # The same markers docx2python uses, whatever the list's own lvlText says
+    if numFmt == "bullet":
+        return "--"
+    if numFmt == "lowerLetter":
+        return letters(value) + ")"
+    if numFmt == "upperLetter":
+        return letters(value).upper() + ")"
+    if numFmt == "lowerRoman":
+        return roman(value) + ")"
+    if numFmt == "upperRoman":
+        return roman(value).upper() + ")"
+    return f"{value})"
+
+
+def renderLines(texts, numbers, formats):
+    """Turn cached paragraph texts back into docx2python-style lines. List numbering depends on every earlier paragraph of the list,
+    so it's redone for the whole document each time; it's only integer bookkeeping
+
+    :param texts: Text of each paragraph
+    :param numbers: [numId, ilvl] (or None) for each paragraph
+    :param formats: As returned by numberingFormats
+    :returns: One line per paragraph
+    :rtype: List of strings
+
+    """
+    counters = {}  # numId -> {ilvl: current value}
+    lines = []
+    for text, number in zip(texts, numbers):
+        if not number:
+            lines.append(text)
+            continue
+        numId, ilvl = number
+        numFmt, start = formats.get(numId, {}).get(ilvl, ("decimal", 1))
+        levels = counters.setdefault(numId, {})
+        levels[ilvl] = levels.get(ilvl, start - 1) + 1
+        for deeper in [i for i in levels if i > ilvl]:
+            del levels[deeper]
+        lines.append("\t" * ilvl + marker(numFmt, levels[ilvl]) + "\t" + text)
+    return lines
+
+
+def fingerprintPath(fileId, cacheDir=CACHE_DIR):
+    return path.join(cacheDir, f"{fileId}.json.z")
+
+
+def fingerprintIds(cacheDir=CACHE_DIR):
+    try:
+        return [i[: -len(".json.z")] for i in listdir(cacheDir) if i.endswith(".json.z")]
+    except OSError:
+        return []
+
+
+def loadFingerprint(fileId, cacheDir=CACHE_DIR):
+    try:
+        with open(fingerprintPath(fileId, cacheDir), "rb") as f:
+            record = json.loads(zlib.decompress(f.read()))
+    except (OSError, ValueError, zlib.error):
+        return None
+    return record if record.get("version") == VERSION else None
+
+
+def saveFingerprint(fileId, record, cacheDir=CACHE_DIR):
+    """Atomically write a file's fingerprint
+
+    :param fileId: The drive ID of the file
+    :param record: As returned by parseDocument, with the classification stored under "result"
+    :param cacheDir: Folder the fingerprints are kept in
+    :returns: None
+    :rtype: NoneType
+
+    """
+    makedirs(cacheDir, exist_ok=True)
+    target = fingerprintPath(fileId, cacheDir)
+    with open(target + ".tmp", "wb") as out:
+        out.write(zlib.compress(json.dumps(record).encode()))
+    replace(target + ".tmp", target)
+
+
+def revisionOf(fileObj):
+    # Binary files have a checksum; google docs don't, but their modified date changes with every edit
+    return fileObj.get("md5Checksum") or fileObj.get("modifiedDate")
+
+
+def setRevision(fileId, revision, cacheDir=CACHE_DIR):
+    """Record which drive revision a fingerprint describes. Called once our own upload is done, since that makes a new revision too"""
+    record = loadFingerprint(fileId, cacheDir)
+    if record is not None and revision:
+        record["revision"] = revision
+        saveFingerprint(fileId, record, cacheDir)
+
+
+def isCurrent(fileObj, cacheDir=CACHE_DIR):
+    """Whether the file has been edited since it was last processed. Files processed before fingerprints existed count as current
+
+    :param fileObj: The drive file
+    :param cacheDir: Folder the fingerprints are kept in
+    :returns: False if there's a fingerprint and the file's revision has moved on from it
+    :rtype: Boolean
+
+    """
+    record = loadFingerprint(fileObj["id"], cacheDir)
+    return record is None or record.get("revision") == revisionOf(fileObj)
+
+
+@tracing.traced()
+def parseDocument(docPath, previous=None):
+    """Fingerprint a document, re-reading only the paragraphs that changed since a previous fingerprint
+
+    :param docPath: Path to the word doc, or a file object of it (see parse_pool.py)
+    :param previous: The fingerprint of an earlier version (e.g. from loadFingerprint). None parses everything
+    :returns: (the new fingerprint, the document's lines, the fraction of paragraphs that had to be re-read)
+    :rtype: Tuple
+
+    """
+    with zipfile.ZipFile(docPath) as z:
+        xml = z.read("word/document.xml").decode()
+        names = z.namelist()
+        numberingXml = z.read("word/numbering.xml").decode() if "word/numbering.xml" in names else ""
+    paragraphs = [i.group(0) for i in PARAGRAPH.finditer(xml)]
+    hashes = [paragraphHash(i) for i in paragraphs]
+    numbering = paragraphHash(numberingXml)
+    old = previous
+    carried = {key: (previous or {}).get(key) for key in CARRIED}
+    carried["result"] = carried["result"] or {}
+    if old is None or old["numbering"] != numbering:
+        # Nothing to reuse: the list definitions affect every line
+        old = {"hashes": [], **{field: [] for field in FIELDS}}
+    # The previous classification is carried over, for the caller to keep or replace
+    record = {"version": VERSION, "revision": None, "numbering": numbering, "hashes": hashes, **carried}
+    for field in FIELDS:
+        record[field] = []
+    formats = numberingFormats(numberingXml)
+    reread = 0
+    matcher = SequenceMatcher(None, old["hashes"], hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for field in FIELDS:
+                record[field].extend(old[field][i1:i2])
+            continue
+        for paragraph in paragraphs[j1:j2]:
+            text, numbers, bold = readParagraph(paragraph)
+            # Text features are taken from the line as docx2python would render it, so they match docType's
+            line = renderLines([text], [numbers], formats)[0]
+            links, naked, meta = textFeatures(line)
+            for field, value in zip(FIELDS, (text, numbers, bold, links, naked, meta)):
+                record[field].append(value)
+        reread += j2 - j1
+    metrics.inc("pymun_paragraphs_total", len(hashes) - reread, result="reused")
+    metrics.inc("pymun_paragraphs_total", reread, result="reparsed")
+    lines = renderLines(record["texts"], record["numbers"], formats)
+    return record, lines, reread / len(hashes) if hashes else 0.0
+
+
+def headerMeta(record, window=None):
+    """scanHeader, from a fingerprint: the metadata found in the same head and tail windows, the first line with each key winning
+
+    :param record: As returned by parseDocument
+    :param window: Number of lines at each end to look at, headerWindow() if not given
+    :returns: {field: value} for each field found
+    :rtype: Dict
+
+    """
+    meta = {}
+    window = window or headerWindow()
+    found = record["meta"]
+    for fields in found[:window] + found[max(window, len(found) - window) :]:
+        for k, v in fields.items():
+            meta.setdefault(k, v)
+    return meta
+
+
+def classify(record, lines):
+    """magicParse, from a fingerprint rather than the document
+
+    :param record: As returned by parseDocument
+    :param lines: The document's lines, as returned by parseDocument
+    :returns: Dictionary of the metadata inferred, including the type
+    :rtype: Dict
+
+    """
+    meta = headerMeta(record)
+    documentType = classifier.classify(lines, documentFeatures(lines, record["links"]), meta)
+    committee = next((i for i in record["bold"] if i is not None), None)
+    committee = committee.replace("Committee:", "").strip() if committee else None
+    if documentType == "resolution" and committee:
+        return {"committee": committee, **meta, "type": documentType}
+    return {**meta, "type": documentType}
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+# Parsing word documents in a pool of worker processes without copying them through pickles.
+# Handing a worker the document's bytes pickles them into its pipe, and handing back the parsed fingerprint pickles every paragraph
+# on the way out. Instead, each document is read once, straight into a multiprocessing.shared_memory segment, and only the segment's
+# name goes to the worker, which opens the zip in place through a read-only file over the shared buffer. What comes back is a compact
+# record (the classification, or a feature row) rather than the paragraphs it was worked out from. The parent owns every segment and
+# unlinks it as soon as its result is in, and no more than a couple of segments per worker exist at once, so memory stays bounded
+# however many documents are queued.
+import io
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+from paragraph_cache import classify, parseDocument
+
+IN_FLIGHT = 2  # Segments per worker process: one being parsed, one waiting
+
+
+class SharedFile(io.RawIOBase):
+    """A read-only, seekable file over a memoryview, so zipfile can read a shared segment without it being copied"""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.view[self.position : self.position + len(buffer)]
+        buffer[: len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def shareFile(docPath):
+    """Read a file into a new shared memory segment
+
+    :param docPath: The file
+    :returns: (the segment, its handle (name and size) to send to a worker)
+    :rtype: Tuple
+
+    """
+    size = os.path.getsize(docPath)
+    segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        with open(docPath, "rb", buffering=0) as f:
+            view = segment.buf[:size]
+            while view:
+                read = f.readinto(view)
+                if not read:
+                    break
+                view = view[read:]
+            view.release()
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    return segment, (segment.name, size)
+
+
+def openShared(handle, func):
+    # In the worker: attach to the segment, run func over a file view of it, and let go of the segment (the parent unlinks it)
+    name, size = handle
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        view = segment.buf[:size]
+        try:
+            with SharedFile(view) as docFile:
+                return func(docFile)
+        finally:
+            view.release()
+    finally:
+        segment.close()
+
+
+def classifyRecord(docFile):
+    """Parse and classify a document, keeping only the outcome
+
+    :param docFile: The word document, as a path or a file object
+    :returns: The classification and metadata, as paragraph_cache.classify gives them
+    :rtype: Dict
+
+    """
+    record, lines, _ = parseDocument(docFile)
+    return classify(record, lines)
+
+
+def classifyShared(handle, func=classifyRecord):
+    return openShared(handle, func)
+
+
+def mapShared(func, paths, processes=None):
+    """Run func over documents in worker processes, each document handed over in shared memory
+
+    :param func: A module-level function taking a file object of the document and returning something small to pickle back
+    :param paths: The documents
+    :param processes: Worker processes, os.cpu_count() if not given
+    :returns: {path: what func returned}, or the exception it raised
+    :rtype: Dict
+
+    """
+    processes = processes or os.cpu_count() or 1
+    results = {}
+    pending = {}  # Future -> (path, segment)
+    queued = iter(paths)
+    try:
+        with ProcessPoolExecutor(processes) as executor:
+            while True:
+                for docPath in queued:
+                    try:
+                        segment, handle = shareFile(docPath)
+                    except OSError as e:  # Missing or unreadable: that document's result, not the whole map's
+                        results[docPath] = e
+                        continue
+                    pending[executor.submit(classifyShared, handle, func)] = (docPath, segment)
+                    if len(pending) >= processes * IN_FLIGHT:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    docPath, segment = pending.pop(future)
+                    segment.close()
+                    segment.unlink()
+                    error = future.exception()
+                    results[docPath] = error if error else future.result()
+    finally:
+        # Whatever stopped the map early (e.g. a KeyboardInterrupt), the segments still handed out mustn't outlive it
+        for _, segment in pending.values():
+            segment.close()
+            segment.unlink()
+    return results
+
+
+def classifyFiles(paths, processes=None):
+    """Classify word documents in parallel
+
+    :param paths: Paths of the documents
+    :param processes: Worker processes, os.cpu_count() if not given
+    :returns: {path: classification dict}, or the exception parsing it raised
+    :rtype: Dict
+
+    """
+    return mapShared(classifyRecord, paths, processes)
@@ -0,0 +1,235 @@
+#! /usr/bin/env python
+# Profiling for a batchProcess run, split into the pipeline's phases (download, parse = paragraph_cache.parseDocument, link-rewrite = replaceLinks, upload).
+# Each run writes <phase>.pstats files (readable with pstats/snakeviz) and a collapsed-stack file for flamegraph.pl/speedscope.
+import cProfile
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from os import makedirs, path
+
+import metrics
+
+appname = "pyMUN"
+PHASES = ("download", "parse", "link-rewrite", "upload")
+OTHER = "other"
+PROFILE_DIR = f"{path.expanduser('~')}/tmp/{appname}/profiles"
+
+
+def frameKey(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def frameLabel(key):
+    return f"{path.basename(key[0])}:{key[2]}"
+
+
+class SamplingProfiler:
+    """Samples every thread's stack from a background thread. Overhead is a few percent at the default rate, so it's fine on a production-sized folder"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()  # (phase, frame keys from outermost to innermost) -> count
+        self.phases = {}  # thread ID -> stack of phases it's in
+        self.running = False
+        self.rounds = 0
+        self.wall = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.phases.setdefault(threading.get_ident(), [])
+        stack.append(name)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def sample(self):
+        me = threading.get_ident()
+        for thread, frame in sys._current_frames().items():
+            if thread == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frameKey(frame.f_code))
+                frame = frame.f_back
+            phases = self.phases.get(thread)
+            self.samples[(phases[-1] if phases else OTHER, tuple(reversed(stack)))] += 1
+
+    def loop(self):
+        start = time.perf_counter()
+        while self.running:
+            self.sample()
+            self.rounds += 1
+            time.sleep(self.interval)
+        self.wall = time.perf_counter() - start
+
+    def perSample(self):
+        # Sampling itself takes time, so work out the real interval rather than trusting the nominal one
+        return self.wall / self.rounds if self.rounds else self.interval
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def collapsed(self):
+        """Samples as flamegraph collapsed stacks: "phase;outer;...;inner count" lines"""
+        lines = Counter()
+        for (phase, stack), count in self.samples.items():
+            lines[";".join([phase] + [frameLabel(i) for i in stack])] += count
+        return [f"{k} {v}" for k, v in sorted(lines.items())]
+
+    def stats(self, phase):
+        """Turn a phase's samples into the dict pstats loads from a .pstats file. Call counts are sample counts, times are samples * measured interval"""
+        own = Counter()
+        inclusive = Counter()
+        callers = {}
+        for (samplePhase, stack), count in self.samples.items():
+            if samplePhase != phase or not stack:
+                continue
+            own[stack[-1]] += count
+            for key in set(stack):
+                inclusive[key] += count
+            for caller, callee in zip(stack, stack[1:]):
+                edges = callers.setdefault(callee, Counter())
+                edges[caller] += count
+        result = {}
+        interval = self.perSample()
+        for key in inclusive:
+            edges = {
+                caller: (n, n, 0.0, n * interval)
+                for caller, n in callers.get(key, {}).items()
+            }
+            result[key] = (
+                inclusive[key],
+                inclusive[key],
+                own[key] * interval,
+                inclusive[key] * interval,
+                edges,
+            )
+        return result
+
+    def write(self, folder):
+        for phase in PHASES + (OTHER,):
+            data = self.stats(phase)
+            if data:
+                with open(path.join(folder, f"{phase}.pstats"), "wb") as f:
+                    marshal.dump(data, f)
+        with open(path.join(folder, "collapsed.txt"), "w") as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+
+
+class PhaseProfiler:
+    """Deterministic profiling with one cProfile.Profile per phase. Exact call counts, but much more overhead than sampling, and only sees the thread that started it"""
+
+    def __init__(self):
+        self.profiles = {}
+        self.active = []
+
+    def profile(self, name):
+        if name not in self.profiles:
+            self.profiles[name] = cProfile.Profile()
+        return self.profiles[name]
+
+    @contextmanager
+    def phase(self, name):
+        if self.active:
+            self.active[-1].disable()
+        current = self.profile(name)
+        self.active.append(current)
+        current.enable()
+        try:
+            yield
+        finally:
+            current.disable()
+            self.active.pop()
+            if self.active:
+                self.active[-1].enable()
+
+    def start(self):
+        self.active.append(self.profile(OTHER))
+        self.active[-1].enable()
+
+    def stop(self):
+        self.active.pop().disable()
+
+    def collapsed(self):
+        # cProfile keeps no full stacks, so this is its caller -> callee graph with each edge's cumulative time (in microseconds)
+        lines = []
+        for phase, profile in self.profiles.items():
+            for callee, (_, _, _, _, callers) in pstats.Stats(profile).stats.items():
+                for caller, edge in callers.items():
+                    weight = int(edge[3] * 1e6)
+                    if weight:
+                        lines.append(f"{phase};{frameLabel(caller)};{frameLabel(callee)} {weight}")
+        return sorted(lines)
+
+    def write(self, folder):
+        for phase, profile in self.profiles.items():
+            profile.dump_stats(path.join(folder, f"{phase}.pstats"))
+        with open(path.join(folder, "collapsed.txt"), "w") as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+
+
+def makeProfiler(mode):
+    """
+    :param mode: "sample" (default, low overhead) or "cprofile"
+    :returns: A profiler with phase/start/stop/write methods
+    :rtype: SamplingProfiler or PhaseProfiler
+
+    """
+    return PhaseProfiler() if mode == "cprofile" else SamplingProfiler()
+
+
+def profileRun(func, mode="sample", folder=None):
+    """Run func once under a profiler, with time split by pipeline phase, and write the results
+
+    :param func: The function to profile, e.g. a batchProcess call
+    :param mode: "sample" or "cprofile"
+    :param folder: Output folder, defaults to a timestamped folder under ~/tmp/pyMUN/profiles
+    :returns: The folder the pstats and collapsed-stack files were written to
+    :rtype: String
+
+    """
+    folder = folder or path.join(PROFILE_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    makedirs(folder, exist_ok=True)
+    profiler = makeProfiler(mode)
+
+    def listener(name):
+        return profiler.phase(name) if name in PHASES else _noop()
+
+    metrics.stageListeners.append(listener)
+    profiler.start()
+    try:
+        func()
+    finally:
+        profiler.stop()
+        metrics.stageListeners.remove(listener)
+        profiler.write(folder)
+    return folder
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+def summary(folder, top=10):
+    """Print the most expensive functions of each phase in a profile folder"""
+    for phase in PHASES + (OTHER,):
+        statsFile = path.join(folder, f"{phase}.pstats")
+        if path.exists(statsFile):
+            print(f"=== {phase} ===")
+            pstats.Stats(statsFile).sort_stats("cumulative").print_stats(top)
+
+
+if __name__ == "__main__":
+    summary(sys.argv[1] if len(sys.argv) > 1 else PROFILE_DIR)
@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# Works out what a change to config.json's custom rules means for files that are already classified. Every word document's text, title
+# and heuristic type (the type before any custom rule) are kept in its paragraph fingerprint, so finding the files a changed rule matches,
+# and their new types, needs no downloads. gdrive_tools.applyRuleChanges then updates just those files' metadata.
+import json
+from os import makedirs, path, replace
+
+import paragraph_cache
+from docx_tools import ruleType
+
+appname = "pyMUN"
+STATE_FILE = f"{path.expanduser('~')}/tmp/{appname}/rules.json"
+NO_RULES = {"name": [], "contains": []}
+
+
+def appliedRules(stateFile=STATE_FILE):
+    """The custom rules the stored classifications reflect. Before any have been recorded, that's none, so every rule counts as new
+
+    :param stateFile: Where the applied rules are recorded
+    :returns: Rules, in the same shape as config.json's "custom-rules"
+    :rtype: Dict
+
+    """
+    try:
+        with open(stateFile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return NO_RULES
+
+
+def saveApplied(rules, stateFile=STATE_FILE):
+    makedirs(path.dirname(stateFile), exist_ok=True)
+    with open(stateFile + ".tmp", "w") as f:
+        json.dump(rules, f)
+    replace(stateFile + ".tmp", stateFile)
+
+
+def changedRules(old, new):
+    """The rules added, removed or changed between two sets. Only documents one of these matches can change type
+
+    :param old: Rules the current classifications reflect
+    :param new: Rules now in config.json
+    :returns: {"name": set of strings, "contains": set of strings}
+    :rtype: Dict
+
+    """
+    changed = {}
+    for kind in ("name", "contains"):
+        before = [(i["regex"], i["type"]) for i in old.get(kind, [])]
+        after = [(i["regex"], i["type"]) for i in new.get(kind, [])]
+        if set(before) == set(after) and before != after:
+            # Only reordered, but the first match wins, so any document any of them matches might change
+            changed[kind] = {regex for regex, _ in after}
+        else:
+            changed[kind] = {regex for regex, _ in set(before) ^ set(after)}
+    return changed
+
+
+def affected(record, changed):
+    title = record.get("title") or ""
+    if any(i in title for i in changed["name"]):
+        return True
+    if changed["contains"]:
+        text = "\n".join(record["texts"])
+        return any(i in text for i in changed["contains"])
+    return False
+
+
+def pendingChanges(rules, changed, cacheDir=paragraph_cache.CACHE_DIR):
+    """Re-apply the rules to every stored document a changed rule matches, from the fingerprints alone
+
+    :param rules: The rules now in config.json
+    :param changed: As returned by changedRules
+    :param cacheDir: Folder the fingerprints are kept in
+    :returns: {file ID: (fingerprint, new type)} for the documents whose type changes
+    :rtype: Dict
+
+    """
+    changes = {}
+    if not any(changed.values()):
+        return changes
+    for fileId in paragraph_cache.fingerprintIds(cacheDir):
+        record = paragraph_cache.loadFingerprint(fileId, cacheDir)
+        # Fingerprints from before the heuristic type was recorded can't be re-ruled; they're picked up when next edited
+        if not record or record.get("heuristic") is None or not affected(record, changed):
+            continue
+        newType = ruleType(rules, record.get("title") or "", lambda: "\n".join(record["texts"])) or record["heuristic"]
+        if newType != record["result"].get("type"):
+            changes[fileId] = (record, newType)
+    return changes
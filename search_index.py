@@ -0,0 +1,207 @@
+#! /usr/bin/env python
+# Local full-text index of the classified documents (SQLite FTS5), so the web UI can search their content and filter by our metadata
+# without any drive calls. updateMetadata adds each file as it's processed; `python3 search_index.py rebuild` fills it from the drive
+# metadata and the paragraph fingerprints, for files processed before the index existed.
+import html
+import re
+import sqlite3
+from contextlib import closing
+from os import makedirs, path
+
+appname = "pyMUN"
+INDEX_FILE = f"{path.expanduser('~')}/tmp/{appname}/search.sqlite3"
+FACETS = ("type", "committee", "agenda", "country")
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS documents (
+        rowid INTEGER PRIMARY KEY,
+        id TEXT UNIQUE NOT NULL,
+        title TEXT,
+        link TEXT,
+        filetype TEXT,
+        """
+    + ", ".join(f"{i} TEXT" for i in FACETS)
+    + ");"
+    + "".join(f"CREATE INDEX IF NOT EXISTS documents_{i} ON documents({i});" for i in FACETS)
+    + "CREATE VIRTUAL TABLE IF NOT EXISTS text USING fts5(title, body, tokenize='unicode61 remove_diacritics 2');"
+)
+WORD = re.compile(r"\w+")
+# snippet() wraps matches in these, so the text can be escaped before they're turned into <mark>s
+START, END = "\x02", "\x03"
+
+ready = set()  # Index files whose schema has been created by this process
+
+
+def connect(indexFile=INDEX_FILE):
+    makedirs(path.dirname(indexFile), exist_ok=True)
+    db = sqlite3.connect(indexFile, timeout=30)
+    if indexFile not in ready:
+        # WAL, so the web UI can read while the daemon writes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+        ready.add(indexFile)
+    return db
+
+
+def indexDocument(fileId, title, meta, text="", link=None, indexFile=INDEX_FILE):
+    """Add a document to the index, or replace what's indexed for it
+
+    :param fileId: The drive ID of the file
+    :param title: The file's title
+    :param meta: Its metadata, as stored in its description
+    :param text: Its text, if it was read (word documents), otherwise only the title is searchable
+    :param link: Link to open the file in drive
+    :param indexFile: Path of the index
+    :returns: None
+    :rtype: NoneType
+
+    """
+    values = (title, link, meta.get("filetype"), *(meta.get(i) for i in FACETS))
+    with closing(connect(indexFile)) as db, db:
+        row = db.execute("SELECT rowid FROM documents WHERE id = ?", (fileId,)).fetchone()
+        if row:
+            rowid = row[0]
+            db.execute(
+                "UPDATE documents SET title = ?, link = ?, filetype = ?, "
+                + ", ".join(f"{i} = ?" for i in FACETS)
+                + " WHERE rowid = ?",
+                (*values, rowid),
+            )
+            db.execute("DELETE FROM text WHERE rowid = ?", (rowid,))
+        else:
+            rowid = db.execute(
+                f"INSERT INTO documents (id, title, link, filetype, {', '.join(FACETS)}) VALUES (?, ?, ?, ?, {', '.join('?' * len(FACETS))})",
+                (fileId, *values),
+            ).lastrowid
+        db.execute("INSERT INTO text (rowid, title, body) VALUES (?, ?, ?)", (rowid, title, text))
+
+
+def removeDocument(fileId, indexFile=INDEX_FILE):
+    with closing(connect(indexFile)) as db, db:
+        row = db.execute("SELECT rowid FROM documents WHERE id = ?", (fileId,)).fetchone()
+        if row:
+            db.execute("DELETE FROM text WHERE rowid = ?", row)
+            db.execute("DELETE FROM documents WHERE rowid = ?", row)
+
+
+def matchQuery(query):
+    """Turn what the user typed into an FTS5 query: every word must appear, the last one as a prefix (so results show up while typing).
+    Anything else FTS5 would read as syntax is dropped
+
+    :param query: Free text
+    :returns: FTS5 MATCH expression, or an empty string if there are no words
+    :rtype: String
+
+    """
+    words = WORD.findall(query)
+    if not words:
+        return ""
+    return " ".join(f'"{i}"' for i in words[:-1]) + f' "{words[-1]}"*'
+
+
+def highlight(snippet):
+    return html.escape(snippet).replace(START, "<mark>").replace(END, "</mark>")
+
+
+def search(query="", facets=None, limit=50, indexFile=INDEX_FILE):
+    """Search the index
+
+    :param query: Free text to look for in the documents' titles and text
+    :param facets: {facet: value} filters, facets being any of FACETS
+    :param limit: Maximum number of results
+    :param indexFile: Path of the index
+    :returns: Dict of total (matching documents), results (dicts, best match first, with an HTML snippet) and facets
+        ({facet: [(value, count)]}, each counted with every filter but its own applied, so the other values can still be picked)
+    :rtype: Dict
+
+    """
+    facets = {k: v for k, v in (facets or {}).items() if k in FACETS and v}
+    match = matchQuery(query)
+    # CROSS JOIN makes SQLite start from the full-text matches; left to itself it may walk a facet's index and test MATCH row by row
+    source = "text CROSS JOIN documents d ON d.rowid = text.rowid" if match else "documents d"
+
+    def where(exclude=None):
+        clauses, params = [], []
+        if match:
+            clauses.append("text MATCH ?")
+            params.append(match)
+        for k, v in facets.items():
+            if k != exclude:
+                clauses.append(f"d.{k} = ?")
+                params.append(v)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    with closing(connect(indexFile)) as db:
+        clause, params = where()
+        total = db.execute(f"SELECT count(*) FROM {source}{clause}", params).fetchone()[0]
+        columns = ", ".join(f"d.{i}" for i in ("id", "title", "link", "filetype", *FACETS))
+        if match:
+            rows = db.execute(
+                f"SELECT {columns}, snippet(text, 1, '{START}', '{END}', '…', 16) FROM {source}{clause} ORDER BY bm25(text) LIMIT ?",
+                params + [limit],
+            )
+        else:
+            rows = db.execute(f"SELECT {columns}, '' FROM {source}{clause} ORDER BY d.title LIMIT ?", params + [limit])
+        results = [
+            {**dict(zip(("id", "title", "link", "filetype", *FACETS), row[:-1])), "snippet": highlight(row[-1])} for row in rows
+        ]
+        counts = {}
+        for facet in FACETS:
+            clause, params = where(facet)
+            counts[facet] = db.execute(
+                f"SELECT d.{facet}, count(*) FROM {source}{clause}{' AND' if clause else ' WHERE'} d.{facet} IS NOT NULL "
+                f"GROUP BY d.{facet} ORDER BY count(*) DESC, d.{facet}",
+                params,
+            ).fetchall()
+    return {"total": total, "results": results, "facets": counts}
+
+
+def rebuild(drive=None, indexFile=INDEX_FILE):
+    """Index every file in the configured drive folders which already has metadata, taking word documents' text from their paragraph fingerprints
+
+    :param drive: GoogleDrive object, defaults to the authorised one
+    :param indexFile: Path of the index
+    :returns: Number of files indexed
+    :rtype: Integer
+
+    """
+    # Imported here: gdrive_tools imports this module
+    import json
+
+    import gdrive_tools
+    import paragraph_cache
+
+    drive = drive or gdrive_tools.mydrive
+    with open("config.json") as conf:
+        config = json.load(conf)
+    count = 0
+    for configured in gdrive_tools.configuredFolders(config):
+        folderDrive = gdrive_tools.accountDrive(configured.get("account"), drive)
+        folder = gdrive_tools.getMainFolder(configured["path"], folderDrive)
+        for fileObj in gdrive_tools.listFiles(folder, folderDrive, processed=True):
+            meta = gdrive_tools.getMetadata(fileObj)
+            record = paragraph_cache.loadFingerprint(fileObj["id"])
+            text = "\n".join(record["texts"]) if record else ""
+            indexDocument(fileObj["id"], fileObj["title"], meta, text, fileObj.get("alternateLink"), indexFile)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="The local search index of classified documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="Index every already-classified file in the drive folder")
+    searchCommand = commands.add_parser("search", help="Search from the command line")
+    searchCommand.add_argument("query", nargs="?", default="")
+    for facet in FACETS:
+        searchCommand.add_argument(f"--{facet}")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print(f"Indexed {rebuild()} files in {INDEX_FILE}")
+    else:
+        found = search(args.query, {i: getattr(args, i) for i in FACETS})
+        print(f"{found['total']} documents")
+        for i in found["results"]:
+            print(f"{i['type'] or '':14} {i['title']}")
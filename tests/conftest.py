@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Importing gdrive_tools would otherwise start an OAuth flow
+os.environ.setdefault("PYMUN_OFFLINE", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,22 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from batch_classify import COLUMNS, TYPES, classifyMatrix  # noqa: E402
+from docx_tools import THRESHOLDS, typeFromFeatures  # noqa: E402
+
+ROWS = [
+    {"paragraphs": 0, "lists": 0, "maxIndent": -1, "roman": 0, "words": 0, "links": 0},
+    {"paragraphs": 1, "lists": 0, "maxIndent": -1, "roman": 0, "words": 1000, "links": 0},
+    {"paragraphs": 10, "lists": 6, "maxIndent": 0, "roman": 0, "words": 400, "links": 0},
+    {"paragraphs": 10, "lists": 0, "maxIndent": -1, "roman": 0, "words": 400, "links": 0, "country": True},
+    {"paragraphs": 10, "lists": 0, "maxIndent": -1, "roman": 0, "words": 400, "links": 3},
+    {"paragraphs": 10, "lists": 0, "maxIndent": -1, "roman": 0, "words": 400, "links": 0},
+]
+
+
+@pytest.mark.parametrize("row", ROWS)
+def test_classifyMatrix_matches_typeFromFeatures(row):
+    matrix = np.array([[float(row.get(i, 0)) for i in COLUMNS]])
+    meta = {"country": "x"} if row.get("country") else {}
+    assert TYPES[classifyMatrix(matrix, THRESHOLDS)[0]] == typeFromFeatures(row, meta, THRESHOLDS)
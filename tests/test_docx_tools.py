@@ -0,0 +1,82 @@
+import docx
+
+from docx_tools import THRESHOLDS, Clause, documentFeatures, formatDocx, typeFromFeatures
+
+BODY = ["Recalling its earlier resolutions,", "1. Urges states", "a) first", "b) second", "2. Decides to remain seized"]
+
+
+def shape(clause):
+    return [(i.root, shape(i)) for i in clause.children]
+
+
+def test_lone_i_starts_a_roman_list():
+    tree = Clause.fromFormattedDocArr(["1. Urges states", "i) first", "ii) second", "iii) third", "2. Decides"])
+    assert shape(tree) == [("Urges states", [("first", []), ("second", []), ("third", [])]), ("Decides", [])]
+    assert tree.format() == {0: ":", 1: ";", 2: ";", 3: ";", 4: "."}
+
+
+def test_i_after_h_is_a_letter():
+    tree = Clause.fromFormattedDocArr(["1. Urges", "g) seventh", "h) eighth", "i) ninth", "j) tenth"])
+    assert [i.root for i in tree.children[0].children] == ["seventh", "eighth", "ninth", "tenth"]
+
+
+def test_roman_under_letters():
+    tree = Clause.fromFormattedDocArr(["1. Urges", "a) first", "i) one", "ii) two", "b) second", "c) third"])
+    assert shape(tree) == [("Urges", [("first", [("one", []), ("two", [])]), ("second", []), ("third", [])])]
+
+
+def test_short_documents_count_as_all_list():
+    # docType's rule from the start: fewer list items than half the paragraphs, rounded down, is never true of 0 or 1 paragraphs
+    for lines in ([], ["A single paragraph of prose"]):
+        assert typeFromFeatures(documentFeatures(lines, [0] * len(lines)), {}, THRESHOLDS) == "resolution"
+
+
+def makeDoc(tmp_path, paragraphs):
+    docPath = str(tmp_path / "resolution.docx")
+    document = docx.Document()
+    for i in paragraphs:
+        document.add_paragraph(i)
+    document.save(docPath)
+    return docPath
+
+
+def texts(docPath):
+    return [i.text for i in docx.Document(docPath).paragraphs]
+
+
+def test_punctuates_operative_clauses(tmp_path):
+    docPath = makeDoc(tmp_path, BODY)
+    assert formatDocx(docPath) == 4
+    assert texts(docPath) == [
+        "Recalling its earlier resolutions,",
+        "1. Urges states:",
+        "a) first;",
+        "b) second;",
+        "2. Decides to remain seized.",
+    ]
+
+
+def test_counts_only_applied_edits(tmp_path):
+    docPath = makeDoc(tmp_path, ["1. Urges states:", "a) first;", "b) second", "2. Decides."])
+    assert formatDocx(docPath) == 1
+    assert texts(docPath)[2] == "b) second;"
+
+
+def test_nothing_to_do_leaves_the_file_alone(tmp_path):
+    docPath = makeDoc(tmp_path, BODY)
+    formatDocx(docPath)
+    with open(docPath, "rb") as f:
+        before = f.read()
+    assert formatDocx(docPath) == 0
+    with open(docPath, "rb") as f:
+        assert f.read() == before
+
+
+def test_mismatched_paragraphs_are_left_unformatted(tmp_path):
+    docPath = makeDoc(tmp_path, BODY)
+    with open(docPath, "rb") as f:
+        before = f.read()
+    # Lines which don't line up with the document's own paragraphs
+    assert formatDocx(docPath, ["1. Something else", "2. Entirely"]) == 0
+    with open(docPath, "rb") as f:
+        assert f.read() == before
@@ -0,0 +1,73 @@
+import pytest
+
+import gdrive_tools
+
+TYPES = ("source", "note", "position", "resolution", "unclassified")
+
+
+def typeFolders():
+    return {i: {"id": f"folder-{i}"} for i in TYPES}
+
+
+# Everything docx_tools' heuristics and getType can give, and what the web UI lets a rule set
+@pytest.mark.parametrize("doctype", ["resolution", "position", "notes", "unclassified", "source", "note"])
+def test_sortIntoFolder_every_type(doctype):
+    fileObj = gdrive_tools.setMetadata({"id": "doc", "parents": [{"id": "main"}]}, {"type": doctype})
+    moved = gdrive_tools.sortIntoFolder(fileObj, typeFolders())
+    expected = gdrive_tools.TYPE_FOLDERS.get(doctype, doctype)
+    assert [i["id"] for i in moved["parents"]] == ["main", f"folder-{expected}"]
+
+
+def test_sortIntoFolder_moves_reclassified_file():
+    types = typeFolders()
+    fileObj = {"id": "doc", "parents": [{"id": "main"}, {"id": "folder-position"}]}
+    gdrive_tools.setMetadata(fileObj, {"type": "notes"})
+    assert [i["id"] for i in gdrive_tools.sortIntoFolder(fileObj, types)["parents"]] == ["main", "folder-note"]
+
+
+class FakeFile(dict):
+    def FetchMetadata(self):
+        pass
+
+
+class FakeDrive:
+    def CreateFile(self, meta):
+        return FakeFile(meta, title=f"Title of {meta['id']}", parents=[{"id": "main"}])
+
+
+def test_applyRuleChanges_retries_failed_files(monkeypatch):
+    pending = {i: ({"result": {"type": "position"}, "texts": ["text"]}, "notes") for i in ("good", "bad", "unsortable")}
+    saved = {}
+    monkeypatch.setattr(gdrive_tools.rule_changes, "appliedRules", lambda: {})
+    monkeypatch.setattr(gdrive_tools.rule_changes, "pendingChanges", lambda rules, changed: pending)
+    monkeypatch.setattr(gdrive_tools.job_queue, "folderOf", lambda fileId: None)
+    monkeypatch.setattr(gdrive_tools.paragraph_cache, "saveFingerprint", lambda fileId, record: saved.update({fileId: record}))
+    monkeypatch.setattr(gdrive_tools.search_index, "indexDocument", lambda *args: None)
+    real = gdrive_tools.sortIntoFolder
+
+    def sortIntoFolder(fileObj, types):
+        if fileObj["id"] == "unsortable":
+            raise KeyError("notes")
+        return real(fileObj, types)
+
+    def uploadFile(fileObj, slowSeconds=30):
+        if fileObj["id"] == "bad":
+            raise OSError("connection reset")
+
+    monkeypatch.setattr(gdrive_tools, "sortIntoFolder", sortIntoFolder)
+    monkeypatch.setattr(gdrive_tools, "uploadFile", uploadFile)
+    folders = {"main": ({"id": "main"}, typeFolders(), FakeDrive())}
+    # The failures don't stop the good file, but keep the rules from being marked applied, and leave their fingerprints alone
+    assert gdrive_tools.applyRuleChanges({"name": [{"regex": "Title", "type": "notes"}]}, folders) is False
+    assert list(saved) == ["good"]
+    assert saved["good"]["result"]["type"] == "notes"
+
+
+def test_isUnedited_uses_the_revision_on_the_file():
+    # Whichever machine processed it, without needing its fingerprint
+    fileObj = gdrive_tools.setMetadata({"id": "doc", "md5Checksum": "a"}, {"type": "resolution"})
+    fileObj["properties"].append(gdrive_tools.metadataProperty(gdrive_tools.REVISION, "a"))
+    assert gdrive_tools.isUnedited(fileObj)
+    assert gdrive_tools.getMetadata(fileObj) == {"type": "resolution"}
+    fileObj["md5Checksum"] = "b"
+    assert not gdrive_tools.isUnedited(fileObj)
@@ -0,0 +1,96 @@
+import time
+from contextlib import closing
+
+import pytest
+
+import job_queue
+
+FOLDER = "folder"
+# Workers on another machine, so the queue takes them to be alive without looking for their processes
+ALICE = "elsewhere:1"
+BOB = "elsewhere:2"
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def drive(fileId, revision):
+    return {"id": fileId, "title": f"Title of {fileId}", "revision": revision}
+
+
+def discover(queue, *files):
+    return job_queue.discover(files, FOLDER, lambda f: f["revision"], queueFile=queue)
+
+
+def job(queue, fileId):
+    with closing(job_queue.connect(queue)) as db:
+        row = db.execute(f"SELECT {', '.join(job_queue.COLUMNS)} FROM jobs WHERE id = ?", (fileId,)).fetchone()
+    return job_queue.toJob(row)
+
+
+def test_discover_requeues_only_new_revisions(queue):
+    assert discover(queue, drive("a", "1"), drive("b", "1")) == 2
+    assert discover(queue, drive("a", "1"), drive("b", "1")) == 0
+    [leased] = job_queue.leaseBatch(ALICE, [FOLDER], size=1, maxAttempts=3, queueFile=queue)
+    assert job_queue.checkpoint(leased["id"], ALICE, "downloaded", queueFile=queue, revision="1", path="/tmp/x")
+    # Edited: back to the start, with the lease and the attempts dropped
+    assert discover(queue, drive(leased["id"], "2")) == 1
+    requeued = job(queue, leased["id"])
+    assert (requeued["state"], requeued["revision"], requeued["attempts"]) == ("discovered", "2", 0)
+    assert requeued["worker"] is None and requeued["path"] is None
+
+
+def test_expired_lease_is_taken_over(queue):
+    discover(queue, drive("a", "1"))
+    [leased] = job_queue.leaseBatch(ALICE, [FOLDER], seconds=0.2, maxAttempts=3, queueFile=queue)
+    assert job_queue.leaseBatch(BOB, [FOLDER], maxAttempts=3, queueFile=queue) == []
+    time.sleep(0.3)
+    [taken] = job_queue.leaseBatch(BOB, [FOLDER], maxAttempts=3, queueFile=queue)
+    assert taken["id"] == leased["id"] and taken["attempts"] == 2
+    # Alice has lost it: her checkpoints don't count, Bob's do
+    assert not job_queue.holds("a", ALICE, queueFile=queue)
+    assert not job_queue.checkpoint("a", ALICE, "downloaded", queueFile=queue, revision="1")
+    assert job_queue.checkpoint("a", BOB, "downloaded", queueFile=queue, revision="1")
+    assert job_queue.checkpoint("a", BOB, "written", queueFile=queue, revision="1")
+    assert job_queue.counts(queueFile=queue) == {"written": 1}
+
+
+def test_checkpoint_rejected_after_requeue(queue):
+    discover(queue, drive("a", "1"))
+    job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=3, queueFile=queue)
+    discover(queue, drive("a", "2"))
+    assert not job_queue.checkpoint("a", ALICE, "written", queueFile=queue, revision="1")
+    assert not job_queue.holds("a", ALICE, "1", queueFile=queue)
+    [new] = job_queue.leaseBatch(BOB, [FOLDER], maxAttempts=3, queueFile=queue)
+    assert new["revision"] == "2"
+    # Even under the same worker, a checkpoint for the old revision doesn't mark the new one done
+    assert not job_queue.checkpoint("a", BOB, "written", queueFile=queue, revision="1")
+    assert job_queue.checkpoint("a", BOB, "written", queueFile=queue, revision="2")
+
+
+def test_quarantine_after_max_attempts(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_SECONDS", 0)
+    discover(queue, drive("a", "1"))
+    for _ in range(2):
+        [leased] = job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=2, queueFile=queue)
+        job_queue.fail(leased["id"], ALICE, "KeyError: 'notes'", queueFile=queue)
+        time.sleep(0.01)
+    assert job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=2, queueFile=queue) == []
+    [stuck] = job_queue.quarantined(queue)
+    assert (stuck["id"], stuck["attempts"], stuck["error"]) == ("a", 2, "KeyError: 'notes'")
+    # Released by hand, it's tried again
+    assert job_queue.release("a", queue)
+    assert job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=2, queueFile=queue)[0]["id"] == "a"
+
+
+def test_new_revision_releases_quarantine(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_SECONDS", 0)
+    discover(queue, drive("a", "1"))
+    [leased] = job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=1, queueFile=queue)
+    job_queue.fail("a", ALICE, "boom", queueFile=queue)
+    time.sleep(0.01)
+    assert job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=1, queueFile=queue) == []
+    assert discover(queue, drive("a", "2")) == 1
+    assert job_queue.leaseBatch(ALICE, [FOLDER], maxAttempts=1, queueFile=queue)[0]["revision"] == "2"
@@ -0,0 +1,31 @@
+import sqlite3
+
+import near_duplicates
+
+TEXTS = [" ".join(f"word{i}{j}" for j in range(20)) for i in range(10)]
+
+
+def test_copy_inherits_the_heuristic_type(tmp_path):
+    index = str(tmp_path / "duplicates.sqlite3")
+    sig = near_duplicates.signature(TEXTS)
+    # The original's title matched a custom rule making it a position paper; the heuristics said resolution
+    near_duplicates.addDocument("original", "Position of X", sig, {"type": "position"}, heuristic="resolution", indexFile=index)
+    found = near_duplicates.findDuplicate(sig, exclude="copy", threshold=0.9, indexFile=index)
+    assert found["id"] == "original"
+    assert found["result"]["type"] == "position"
+    assert found["heuristic"] == "resolution"
+
+
+def test_index_from_before_heuristics_were_kept(tmp_path):
+    index = str(tmp_path / "duplicates.sqlite3")
+    with sqlite3.connect(index) as db:
+        db.executescript(near_duplicates.SCHEMA.replace(",\n    heuristic TEXT", ""))
+    sig = near_duplicates.signature(TEXTS)
+    with sqlite3.connect(index) as db:
+        db.execute(
+            "INSERT INTO documents (id, title, signature, cluster, result, links) VALUES (?, ?, ?, ?, ?, ?)",
+            ("original", "Old", near_duplicates.toBlob(sig), "original", '{"type": "notes"}', "{}"),
+        )
+        db.executemany("INSERT INTO bands (band, key, id) VALUES (?, ?, ?)", [(b, k, "original") for b, k in near_duplicates.bandKeys(sig)])
+    found = near_duplicates.findDuplicate(sig, threshold=0.9, indexFile=index)
+    assert found["id"] == "original" and found["heuristic"] is None
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+import parse_pool
+
+
+def segments():
+    return {i for i in os.listdir("/dev/shm") if i.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+def firstByte(docFile):
+    return docFile.read(1)
+
+
+def test_unreadable_files_are_per_path_errors(tmp_path):
+    paths = []
+    for i in range(5):
+        paths.append(str(tmp_path / f"doc{i}"))
+        with open(paths[-1], "wb") as f:
+            f.write(bytes([i]) * 10)
+    missing = str(tmp_path / "missing")
+    before = segments()
+    results = parse_pool.mapShared(firstByte, paths[:2] + [missing] + paths[2:], processes=1)
+    assert isinstance(results.pop(missing), FileNotFoundError)
+    assert results == {p: bytes([i]) for i, p in enumerate(paths)}
+    assert segments() == before
+
+
+def test_segments_unlinked_when_interrupted(tmp_path, monkeypatch):
+    paths = [str(tmp_path / f"doc{i}") for i in range(4)]
+    for p in paths:
+        with open(p, "wb") as f:
+            f.write(b"x")
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(parse_pool, "wait", interrupted)
+    before = segments()
+    with pytest.raises(KeyboardInterrupt):
+        parse_pool.mapShared(firstByte, paths, processes=1)
+    assert segments() == before
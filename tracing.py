@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+# Opt-in tracer recording each file's journey through the pipeline as Chrome trace-event JSON (open it in https://ui.perfetto.dev or chrome://tracing).
+# Every thread (and process) gets its own track, so parallel workers and the gaps between their spans are visible.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from os import makedirs, path
+
+import metrics
+
+appname = "pyMUN"
+TRACE_DIR = f"{path.expanduser('~')}/tmp/{appname}/traces"
+
+enabled = False
+events = []
+namedThreads = set()
+lock = threading.Lock()
+
+
+def start():
+    """Start recording spans, discarding anything recorded before"""
+    global enabled
+    with lock:
+        events.clear()
+        namedThreads.clear()
+    metrics.stageListeners.append(stageSpan)
+    enabled = True
+
+
+def stop(traceFile=None):
+    """Stop recording and write the trace
+
+    :param traceFile: Where to write the JSON, defaults to a timestamped file under ~/tmp/pyMUN/traces
+    :returns: The path of the written trace
+    :rtype: String
+
+    """
+    global enabled
+    enabled = False
+    if stageSpan in metrics.stageListeners:
+        metrics.stageListeners.remove(stageSpan)
+    traceFile = traceFile or path.join(TRACE_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    makedirs(path.dirname(traceFile), exist_ok=True)
+    with lock:
+        data = {"traceEvents": list(events), "displayTimeUnit": "ms"}
+    with open(traceFile, "w") as out:
+        json.dump(data, out)
+    return traceFile
+
+
+def nameThread(pid, tid):
+    # Metadata events label each track with its thread name, e.g. the worker it belongs to
+    if (pid, tid) not in namedThreads:
+        namedThreads.add((pid, tid))
+        events.append(
+            {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": threading.current_thread().name}}
+        )
+
+
+@contextmanager
+def span(name, category="pipeline", **args):
+    """Record a span (a trace-event "complete" event) around a block, if tracing is enabled
+
+    :param name: The span's name
+    :param category: Trace category, used for filtering in the viewer
+    :param args: Extra details shown when the span is selected, e.g. the file ID
+    :returns: Context manager
+    :rtype: contextmanager
+
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        pid, tid = os.getpid(), threading.get_ident()
+        fileId = getattr(metrics.local, "fileId", None)
+        if fileId:
+            args.setdefault("file", fileId)
+        with lock:
+            nameThread(pid, tid)
+            events.append(
+                {
+                    "ph": "X",
+                    "name": name,
+                    "cat": category,
+                    "ts": start / 1000,
+                    "dur": (end - start) / 1000,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+
+
+def stageSpan(name):
+    return span(name, "stage")
+
+
+def traced(name=None, withArgs=False):
+    """Decorator: record a span for every call of the function while tracing is enabled
+
+    :param name: Span name, defaults to the function's name
+    :param withArgs: Whether to include the (truncated) positional arguments in the span, e.g. the URL being fetched
+    :returns: Decorator
+    :rtype: function
+
+    """
+
+    def decorator(func):
+        spanName = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            details = {"args": [str(i)[:200] for i in args]} if withArgs else {}
+            with span(spanName, "heuristic", **details):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def merge(traceFiles, output):
+    """Merge traces written by several processes (e.g. separate workers) into one timeline
+
+    :param traceFiles: Paths of trace JSON files
+    :param output: Where to write the merged trace
+    :returns: The output path
+    :rtype: String
+
+    """
+    merged = []
+    for traceFile in traceFiles:
+        with open(traceFile) as f:
+            merged.extend(json.load(f)["traceEvents"])
+    with open(output, "w") as out:
+        json.dump({"traceEvents": merged, "displayTimeUnit": "ms"}, out)
+    return output
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(merge(sys.argv[2:], sys.argv[1]))
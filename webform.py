@@ -1,10 +1,9 @@
 #! /usr/bin/env ipython3
-from json import dump, load
 from threading import Timer
 from time import sleep
 from webbrowser import open as browse
 
-from flask import Flask, flash, redirect, render_template, request
+from flask import Flask, Response, flash, redirect, render_template, request
 from flask_wtf import FlaskForm
 from werkzeug.datastructures import ImmutableMultiDict, MultiDict
 from wtforms import (
@@ -15,6 +14,11 @@ from wtforms import (
     validators,
 )
 
+import config_service
+import job_queue
+import metrics
+import near_duplicates
+import search_index
 from gdrive_tools import authorisedDrive, deAuthorise, getMainFolder
 
 # App config.
@@ -22,6 +26,8 @@ DEBUG = True
 app = Flask(__name__)
 app.config.from_object(__name__)
 app.config["SECRET_KEY"] = "7d441f27d441f27567d441f2b6176a"
+# Parsed once per change to config.json; the folder's drive link is looked up in the background
+settings = config_service.service(resolver=lambda folderpath: getMainFolder(folderpath)["alternateLink"])
 
 
 class ConfigForm(FlaskForm):
@@ -50,16 +56,17 @@ class ConfigForm(FlaskForm):
         """
         form = ConfigForm(gen_multi_dict())
         if request.method == "POST":
+            config = settings.get()
             delay = (
                 request.form["delay"]
                 if "delay" in request.form
-                else load("./config.json")["delay"]
+                else config["delay"]
             )
             autoformat = "autoformat" in request.form
             folderpath = (
                 request.form["folderpath"]
                 if "folderpath" in request.form
-                else load("./config.json")["folderpath"]
+                else config["folderpath"]
             )
             print(request.form)
             rule_matrix = [
@@ -73,14 +80,22 @@ class ConfigForm(FlaskForm):
                 formatted_rule = {"regex": rule_matrix[1][i], "type": rule_matrix[2][i]}
                 rule_json[rule_matrix[0][i]].append(formatted_rule)
 
-            conf_dict = {
-                "delay": delay,
-                "autoformat": autoformat,
-                "folderpath": folderpath,
-                "folderlink": getMainFolder(folderpath)["alternateLink"],
-                "custom-rules": rule_json,
-            }
-            dump(conf_dict, open("./config.json", "w"))
+            # Settings this form doesn't show are kept. A new folder's link is only known straight away if it was looked up
+            # before; otherwise it's saved once the background lookup finishes. Read and written under the service's lock, so
+            # a lookup finishing in between can't be lost or land next to the wrong folder
+            with settings.lock:
+                config = settings.get()
+                unchanged = config.get("folderlink") if folderpath == config["folderpath"] else None
+                settings.update(
+                    **{
+                        "delay": delay,
+                        "autoformat": autoformat,
+                        "folderpath": folderpath,
+                        "folderlink": settings.knownLink(folderpath) or unchanged,
+                        "custom-rules": rule_json,
+                    }
+                )
+            settings.resolveLater(folderpath)
 
         if form.validate():
             # Save the comment here.
@@ -98,19 +113,17 @@ class ConfigForm(FlaskForm):
         """
 
         def currentJson():
-            return load(open("./config.json"))
+            return settings.get()
 
         def defaultJson():
             return {"delay": "10", "autoformat": False, "root": "/MUN"}
 
         def linkFromJson():
-            folderpath = load(open("./config.json"))["folderpath"]
-            return getMainFolder(folderpath)["alternateLink"]
+            return settings.folderLink() or "#"
 
         def customRules():
             data = []
-            with open("config.json") as conf_json:
-                conf = load(conf_json)["custom-rules"]
+            conf = settings.get()["custom-rules"]
             for i in conf["name"]:
                 data.append(["name", i["regex"], i["type"]])
             for i in conf["contains"]:
@@ -124,6 +137,51 @@ class ConfigForm(FlaskForm):
             rules=customRules,
         )
 
+    @app.route("/metrics")
+    def prometheus():
+        """Exposes the classifier's per-stage counters and latency histograms in Prometheus text format. The daemon writes a snapshot after every file, so this works while it runs in another process.
+
+        :returns: Prometheus text exposition
+        :rtype: flask.Response
+
+        """
+        data = metrics.loadSnapshot() or metrics.snapshot()
+        # Every worker's throughput, from the shared queue, whichever process or machine it runs in
+        for worker in job_queue.workerStats():
+            labels = {"worker": worker["id"]}
+            data["counters"] += [
+                ["pymun_worker_files_total", labels, worker["files"]],
+                ["pymun_worker_failures_total", labels, worker["failures"]],
+                ["pymun_worker_busy_seconds_total", labels, worker["busy"]],
+            ]
+        return Response(
+            metrics.render(data),
+            mimetype="text/plain; version=0.0.4",
+        )
+
+    @app.route("/search")
+    def search():
+        """Search the classified documents' text, filtered by the metadata facets. Everything comes from the local index, not the drive
+
+        :returns: A rendered search page
+        :rtype: String
+
+        """
+        query = request.args.get("q", "")
+        facets = {i: request.args.get(i, "") for i in search_index.FACETS}
+        found = search_index.search(query, facets)
+        return render_template("search.jinja.html", query=query, facets=facets, found=found)
+
+    @app.route("/duplicates")
+    def duplicates():
+        """Lists the groups of documents which are near-copies of each other
+
+        :returns: A rendered page of duplicate clusters
+        :rtype: String
+
+        """
+        return render_template("duplicates.jinja.html", clusters=near_duplicates.clusters())
+
     @app.route("/auth", methods=["GET", "POST"])
     def auth():
         authorisedDrive()
@@ -144,8 +202,7 @@ def gen_multi_dict(config_file="config.json"):
 
     """
     data = MultiDict()
-    with open(config_file) as conf_json:
-        conf = load(conf_json)
+    conf = config_service.service(config_file).get()
     for i in ("delay", "autoformat", "folderpath"):
         data.add(i, conf[i])
     # Now we have to parse the custom rules.